@@ -0,0 +1,228 @@
+"""Compile many .sk files in parallel.
+
+Usage: python3 batch.py [-j N] [--unordered] [-o DIR] [--cache DIR] [-O]
+                       [--profile] [--profile-json FILE] PATH...
+
+Directories are searched recursively for .sk files.  Each file is lexed,
+parsed and lowered to TAC in a worker process; a file that fails to
+compile is reported and the rest of the batch carries on.  -o writes
+each listing to DIR at the file's path below the directory argument it
+was found in (or under its base name if it was named directly); inputs
+that would share a listing are rejected.  With --cache,
+files whose source and compiler are unchanged since an earlier run are
+loaded from the compile cache instead.  -O runs the TAC optimizer on
+every file.  --profile times every phase of each compile (see
+profiler.py) and prints the totals; --profile-json also writes the
+per-file stats to FILE.  With --cache, looking an entry up is the load
+phase, and a miss adds the compile phases and the store of the new
+entry.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from cache import CompileCache, compile_artifacts
+from optimizer import optimize
+from parser import compile_source
+from profiler import CompileProfile, aggregate, format_phases
+
+
+class CompileResult:
+    """Outcome of compiling one file: TAC on success, a message on failure"""
+    __slots__ = ('path', 'code', 'error', 'cached', 'profile')
+
+    def __init__(self, path, code=None, error=None, cached=False, profile=None):
+        self.path = path
+        self.code = code
+        self.error = error
+        self.cached = cached
+        # CompileProfile.as_dict() of a profiled compile
+        self.profile = profile
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+# One CompileCache per process, opened on first use.
+caches = {}
+
+
+def open_cache(cache_dir):
+    cache = caches.get(cache_dir)
+    if cache is None:
+        cache = caches[cache_dir] = CompileCache(cache_dir)
+    return cache
+
+
+def compile_file(path, cache_dir=None, optimized=False, profiled=False):
+    try:
+        with open(path) as source_file:
+            source_code = source_file.read()
+        cached = False
+        profile = CompileProfile(path) if profiled else None
+        if cache_dir is None:
+            code = compile_source(source_code, profile=profile)
+        elif profile is not None:
+            cache = open_cache(cache_dir)
+            with profile.phase('load', 'instructions') as phase:
+                entry = cache.get(source_code)
+            cached = entry is not None
+            if cached:
+                phase.items = len(entry.code)
+            else:
+                entry = compile_artifacts(source_code, profile)
+                with profile.phase('store', 'instructions') as phase:
+                    cache.put(source_code, entry)
+                phase.items = len(entry.code)
+            code = entry.code
+        else:
+            cache = open_cache(cache_dir)
+            entry = cache.get(source_code)
+            cached = entry is not None
+            if not cached:
+                entry = compile_artifacts(source_code)
+                cache.put(source_code, entry)
+            code = entry.code
+        if optimized and profile is not None:
+            with profile.phase('optimize', 'instructions') as phase:
+                code = optimize(code)
+            phase.items = len(code)
+        elif optimized:
+            code = optimize(code)
+        if profile is not None:
+            profile = profile.as_dict()
+        return CompileResult(path, code, cached=cached, profile=profile)
+    except Exception as error:
+        return CompileResult(path, error=f'{type(error).__name__}: {error}')
+
+
+def compile_chunk(paths, cache_dir=None, optimized=False, profiled=False):
+    """Worker entry point: compile a list of files in one task"""
+    return [compile_file(path, cache_dir, optimized, profiled) for path in paths]
+
+
+def compile_many(paths, workers=None, ordered=True, chunksize=None, cache_dir=None, optimized=False,
+                 profiled=False):
+    """Compile `paths` across a process pool, yielding a CompileResult per file.
+
+    With `ordered` results come back in submission order, otherwise each
+    chunk is yielded as soon as it finishes.  Files are sent to workers in
+    chunks to amortize inter-process overhead.  workers=1 compiles in this
+    process, which is handy under a debugger.  `cache_dir` enables the
+    on-disk compile cache shared by all workers, `optimized` runs the TAC
+    optimizer on each result and `profiled` attaches phase stats to each
+    result.
+    """
+    paths = list(paths)
+    if workers == 1:
+        for path in paths:
+            yield compile_file(path, cache_dir, optimized, profiled)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, min(64, len(paths) // (workers * 4)))
+    chunks = [paths[start:start + chunksize] for start in range(0, len(paths), chunksize)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if ordered:
+            for results in executor.map(compile_chunk, chunks, [cache_dir] * len(chunks),
+                                        [optimized] * len(chunks), [profiled] * len(chunks)):
+                yield from results
+        else:
+            futures = [executor.submit(compile_chunk, chunk, cache_dir, optimized, profiled) for chunk in chunks]
+            for future in as_completed(futures):
+                yield from future.result()
+
+
+def expand_paths(paths):
+    """Replace directories with the .sk files beneath them.
+
+    Yields (path, name) pairs, where name is the file's path relative to
+    the directory it was found under, or its base name if it was given
+    directly.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith('.sk'):
+                        found = os.path.join(root, name)
+                        yield found, os.path.relpath(found, path)
+        else:
+            yield path, os.path.basename(path)
+
+
+def output_names(inputs, arg_parser):
+    """Path -> TAC listing name for -o, rejecting inputs that would share a listing"""
+    names = {}
+    owners = {}
+    for path, name in inputs:
+        name = os.path.splitext(name)[0] + '.tac'
+        if name in owners:
+            arg_parser.error(f'{owners[name]} and {path} would both be written to {name}')
+        owners[name] = path
+        names[path] = name
+    return names
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Compile .sk files to three-address code in parallel.')
+    arg_parser.add_argument('paths', nargs='+', help='.sk files or directories to compile')
+    arg_parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    arg_parser.add_argument('--unordered', action='store_true', help='report files as they finish')
+    arg_parser.add_argument('-o', '--output', metavar='DIR',
+                            help='write each TAC listing to DIR, mirroring the input directories')
+    arg_parser.add_argument('--cache', metavar='DIR', help='reuse compile results stored in DIR')
+    arg_parser.add_argument('-O', '--optimize', action='store_true', help='optimize the generated TAC')
+    arg_parser.add_argument('--profile', action='store_true', help='report time and memory of each compiler phase')
+    arg_parser.add_argument('--profile-json', metavar='FILE', help='write per-file phase stats to FILE (implies --profile)')
+    args = arg_parser.parse_args(argv)
+    profiled = args.profile or args.profile_json is not None
+
+    inputs = list(expand_paths(args.paths))
+    if args.output:
+        names = output_names(inputs, arg_parser)
+
+    start = time.perf_counter()
+    compiled = failed = cached = 0
+    profiles = []
+    results = compile_many([path for path, _ in inputs], args.workers, ordered=not args.unordered,
+                           cache_dir=args.cache, optimized=args.optimize, profiled=profiled)
+    for result in results:
+        if not result.ok:
+            failed += 1
+            print(f'{result.path}: error: {result.error}', file=sys.stderr)
+            continue
+        compiled += 1
+        cached += result.cached
+        if result.profile is not None:
+            profiles.append(result.profile)
+        if args.output:
+            output_path = os.path.join(args.output, names[result.path])
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(output_path, 'w') as tac_file:
+                tac_file.write(str(result.code) + '\n')
+        else:
+            print(f'{result.path}: {len(result.code)} instructions')
+
+    elapsed = time.perf_counter() - start
+    summary = f'{compiled} compiled, {failed} failed'
+    if args.cache:
+        summary += f' ({cached} from cache)'
+    print(f'{summary} in {elapsed:.2f}s', file=sys.stderr)
+    if profiles:
+        print(f'phase totals over {len(profiles)} compiled files\n{format_phases(aggregate(profiles))}',
+              file=sys.stderr)
+    if args.profile_json:
+        with open(args.profile_json, 'w') as json_file:
+            json.dump(profiles, json_file, indent=1)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""Content-addressed on-disk cache of compile artifacts.
+
+Entries are keyed by a hash of the source bytes and a fingerprint of the
+compiler's own source (this module and every local module it imports,
+transitively), so editing the lexer, parser, symbol table or code
+generator invalidates every entry automatically.  Each entry holds the token
+stream, the AST and the TAC of one compile in the binary format of
+serialize.py; a hit maps the file instead of reading it, so the parts
+of an entry nobody looks at are never decoded.
+
+Writes go to a temporary file that is renamed into place, so concurrent
+processes never observe a partial entry.  Hits refresh the entry's mtime
+and the least recently used entries are evicted once the cache grows
+past its size bound.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from lexer import Lexer
+from parser import ConstantFolder, Parser, ThreeAddressCodeGenerator, count_nodes
+from serialize import Artifact, dumps
+
+# Modules whose imports, followed transitively, make up the compiler
+COMPILER_ROOTS = ('cache.py',)
+ENTRY_SUFFIX = '.entry'
+IMPORT_PATTERN = re.compile(rb'^[ \t]*(?:from[ \t]+(\w+)[ \t]+import\b|import[ \t]+(\w+))', re.MULTILINE)
+
+
+def compiler_modules(directory, roots=COMPILER_ROOTS):
+    """Sorted file names of `roots` and every module of `directory` they import, directly or not"""
+    found = set()
+    work = list(roots)
+    while work:
+        name = work.pop()
+        if name in found:
+            continue
+        found.add(name)
+        with open(os.path.join(directory, name), 'rb') as module_file:
+            source = module_file.read()
+        for match in IMPORT_PATTERN.finditer(source):
+            imported = (match.group(1) or match.group(2)).decode() + '.py'
+            if imported not in found and os.path.exists(os.path.join(directory, imported)):
+                work.append(imported)
+    return sorted(found)
+
+
+def compiler_fingerprint():
+    """Hash of the compiler modules, used as the cache format version"""
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in compiler_modules(directory):
+        digest.update(name.encode() + b'\0')
+        with open(os.path.join(directory, name), 'rb') as module_file:
+            digest.update(module_file.read())
+    return digest.hexdigest()
+
+
+class CacheEntry:
+    __slots__ = ('tokens', 'ast', 'code')
+
+    def __init__(self, tokens, ast, code):
+        self.tokens = tokens
+        self.ast = ast
+        self.code = code
+
+
+def compile_artifacts(source_code, profile=None):
+    """Run the full pipeline and keep every intermediate result.
+
+    With a profiler.CompileProfile as `profile` each phase is timed as in
+    compile_source.
+    """
+    if profile is None:
+        tokens = Lexer(source_code).tokenize_compact()
+        ast = ConstantFolder().fold(Parser(tokens).parse())
+        generator = ThreeAddressCodeGenerator()
+        generator.generate_code(ast)
+        return CacheEntry(tokens, ast, generator.code)
+    with profile.phase('lex', 'tokens') as phase:
+        tokens = Lexer(source_code).tokenize_compact()
+    phase.items = len(tokens)
+    with profile.phase('parse', 'nodes') as phase:
+        ast = Parser(tokens).parse()
+    phase.items = count_nodes(ast)
+    with profile.phase('fold', 'nodes') as phase:
+        ast = ConstantFolder().fold(ast)
+    phase.items = count_nodes(ast)
+    generator = ThreeAddressCodeGenerator()
+    with profile.phase('codegen', 'instructions') as phase:
+        generator.generate_code(ast)
+    phase.items = len(generator.code)
+    return CacheEntry(tokens, ast, generator.code)
+
+
+class CompileCache:
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, version=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = version or compiler_fingerprint()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self.entries())
+
+    def key(self, source_code):
+        digest = hashlib.sha256(self.version.encode())
+        digest.update(b'\0')
+        digest.update(source_code.encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ENTRY_SUFFIX)
+
+    def get(self, source_code):
+        """Return the cached CacheEntry for `source_code`, or None.
+
+        Its tokens, AST (of serialize.MappedNode) and TAC are read-only
+        views of the entry file.
+        """
+        path = self.path(self.key(source_code))
+        try:
+            artifact = Artifact(path)
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError):
+            # Unreadable or truncated by another process: treat as a miss.
+            self.errors += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CacheEntry(artifact.tokens(), artifact.ast(), artifact.code())
+
+    def put(self, source_code, entry):
+        path = self.path(self.key(source_code))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = dumps(entry.code, entry.ast, entry.tokens)
+        descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            self.errors += 1
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            return
+        self.writes += 1
+        self.total_bytes += len(data)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def compile(self, source_code):
+        """Return the artifacts for `source_code`, compiling only on a miss"""
+        entry = self.get(source_code)
+        if entry is None:
+            entry = compile_artifacts(source_code)
+            self.put(source_code, entry)
+        return entry
+
+    def entries(self):
+        """Yield (path, size, mtime) for every entry on disk"""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(ENTRY_SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    status = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, status.st_size, status.st_mtime
+
+    def evict(self):
+        """Remove least recently used entries until the cache is at most 90% of its bound"""
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        self.total_bytes = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 9 // 10
+        for path, size, _ in entries:
+            if self.total_bytes <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'writes': self.writes,
+            'evictions': self.evictions,
+            'errors': self.errors,
+            'bytes': self.total_bytes
+        }
@@ -0,0 +1,177 @@
+"""Call graphs, recursion and dead functions.
+
+Usage: python3 callgraph.py FILE.sk [ROOT...]
+
+A CallGraph maps every function to the functions it calls, in the order
+of their first call; top-level statements are the caller None.  It can
+be built from the FUNCTION_DECLARATION nodes of an AST or from the
+FUNCTION bodies of TAC.  sccs() groups mutually recursive functions
+with Tarjan's algorithm, callees before their callers, and
+remove_dead_functions drops the bodies no root can reach.
+"""
+import sys
+
+from parser import NodeType, compile_source
+from tac import NAME, Op, QuadBuffer, operand_kind
+
+# Functions kept by remove_dead_functions besides those the top-level
+# statements reach.
+ENTRY_POINTS = ('main',)
+
+
+class CallGraph:
+    def __init__(self):
+        # Caller -> callees in order of first call; None is the top level.
+        self.calls = {}
+        # Functions defined more than once
+        self.redefined = set()
+
+    def add_function(self, name):
+        if name in self.calls:
+            self.redefined.add(name)
+        else:
+            self.calls[name] = []
+
+    def add_call(self, caller, callee):
+        callees = self.calls.setdefault(caller, [])
+        if callee not in callees:
+            callees.append(callee)
+
+    @classmethod
+    def from_code(cls, code):
+        graph = cls()
+        caller = None
+        for instruction in code.instructions():
+            if instruction.op == Op.FUNCTION:
+                caller = code.operand_text(instruction.arg1)
+                graph.add_function(caller)
+            elif instruction.op == Op.END_FUNCTION:
+                caller = None
+            elif instruction.op == Op.CALL and operand_kind(instruction.arg1) == NAME:
+                graph.add_call(caller, code.operand_text(instruction.arg1))
+        return graph
+
+    @classmethod
+    def from_ast(cls, program):
+        graph = cls()
+        # (node, enclosing function) still to visit
+        stack = [(child, None) for child in reversed(program.children)]
+        while stack:
+            node, caller = stack.pop()
+            if node is None:
+                continue
+            if node.type == NodeType.FUNCTION_DECLARATION:
+                caller = node.value
+                graph.add_function(caller)
+            elif node.type == NodeType.FUNCTION_CALL:
+                graph.add_call(caller, node.value)
+            stack.extend((child, caller) for child in reversed(node.children))
+            stack.append((node.right, caller))
+            stack.append((node.left, caller))
+        return graph
+
+    def defined(self, name):
+        return name is not None and name in self.calls
+
+    def sccs(self):
+        """Strongly connected components of the defined functions, callees first"""
+        index = {}
+        lowlink = {}
+        on_stack = set()
+        stack = []
+        components = []
+        for root in self.calls:
+            if root is None or root in index:
+                continue
+            # Each frame is [function, iterator over its defined callees].
+            work = [[root, iter(self.calls[root])]]
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                frame = work[-1]
+                function = frame[0]
+                for callee in frame[1]:
+                    if not self.defined(callee):
+                        continue
+                    if callee not in index:
+                        index[callee] = lowlink[callee] = len(index)
+                        stack.append(callee)
+                        on_stack.add(callee)
+                        work.append([callee, iter(self.calls[callee])])
+                        break
+                    if callee in on_stack:
+                        lowlink[function] = min(lowlink[function], index[callee])
+                else:
+                    work.pop()
+                    if work:
+                        caller = work[-1][0]
+                        lowlink[caller] = min(lowlink[caller], lowlink[function])
+                    if lowlink[function] == index[function]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == function:
+                                break
+                        components.append(component)
+        return components
+
+    def recursive(self):
+        """Functions that can call themselves, directly or through others"""
+        found = set()
+        for component in self.sccs():
+            if len(component) > 1 or component[0] in self.calls[component[0]]:
+                found.update(component)
+        return found
+
+    def reachable(self, roots=ENTRY_POINTS):
+        """Defined functions called, directly or not, from the top level or `roots`"""
+        seen = set()
+        work = [root for root in roots if self.defined(root)]
+        work += [callee for callee in self.calls.get(None, ()) if self.defined(callee)]
+        while work:
+            function = work.pop()
+            if function in seen:
+                continue
+            seen.add(function)
+            work.extend(callee for callee in self.calls[function] if self.defined(callee) and callee not in seen)
+        return seen
+
+
+def remove_dead_functions(code, roots=ENTRY_POINTS):
+    """Copy of `code` without the functions unreachable from the top level and `roots`"""
+    live = CallGraph.from_code(code).reachable(roots)
+    kept = []
+    keeping = True
+    for instruction in code.instructions():
+        if instruction.op == Op.FUNCTION:
+            keeping = code.operand_text(instruction.arg1) in live
+        if keeping:
+            kept.append(instruction)
+        if instruction.op == Op.END_FUNCTION:
+            keeping = True
+    return QuadBuffer.from_instructions(kept, code.strings)
+
+
+def main(argv):
+    with open(argv[0]) as source_file:
+        code = compile_source(source_file.read())
+    graph = CallGraph.from_code(code)
+    recursive = graph.recursive()
+    live = graph.reachable(argv[1:] or ENTRY_POINTS)
+    for component in graph.sccs():
+        for function in component:
+            callees = ', '.join(callee if graph.defined(callee) else f'{callee} (undefined)'
+                                for callee in graph.calls[function])
+            notes = [note for note, flag in (('recursive', function in recursive), ('dead', function not in live))
+                     if flag]
+            suffix = f'  [{", ".join(notes)}]' if notes else ''
+            print(f'{function} -> {callees or "-"}{suffix}')
+    if None in graph.calls:
+        print(f'top level -> {", ".join(graph.calls[None]) or "-"}')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
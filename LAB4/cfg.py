@@ -0,0 +1,261 @@
+"""Basic blocks, control-flow graphs and dominators over TAC.
+
+Usage: python3 cfg.py FILE.sk
+
+build_cfgs splits a QuadBuffer into one ControlFlowGraph per function
+(plus one for any top-level statements).  Blocks start at labels and
+after jumps and returns; block 0 is the entry.  Dominators are computed
+with the Cooper-Harvey-Kennedy iteration over reverse postorder, which
+converges in a couple of passes on the reducible graphs the code
+generator produces.
+"""
+import sys
+
+from parser import compile_source
+from tac import JUMPS, NO_OPERAND, Op
+
+# Instructions after which control does not fall through.
+TERMINATORS = (Op.GOTO, Op.RETURN, Op.JUMP_TABLE)
+
+
+class BasicBlock:
+    __slots__ = ('index', 'instructions', 'successors', 'predecessors')
+
+    def __init__(self, index, instructions):
+        self.index = index
+        self.instructions = instructions
+        self.successors = []
+        self.predecessors = []
+
+    @property
+    def label(self):
+        """Label number this block starts with, or None"""
+        if self.instructions and self.instructions[0].op == Op.LABEL:
+            return self.instructions[0].target
+        return None
+
+    @property
+    def terminator(self):
+        return self.instructions[-1] if self.instructions else None
+
+    def __repr__(self):
+        return f'BasicBlock({self.index}, {len(self.instructions)} instructions)'
+
+
+class ControlFlowGraph:
+    def __init__(self, instructions, name=None, params=()):
+        """Build the graph of a function body (without its FUNCTION/END_FUNCTION markers)"""
+        self.name = name
+        self.params = list(params)
+        self.blocks = []
+        self.idom = None
+        self.split_blocks(instructions)
+        self.link_blocks()
+
+    def split_blocks(self, instructions):
+        current = []
+        for instruction in instructions:
+            if instruction.op == Op.LABEL and current:
+                self.add_block(current)
+                current = []
+            current.append(instruction)
+            if instruction.op in JUMPS or instruction.op == Op.RETURN:
+                self.add_block(current)
+                current = []
+        if current or not self.blocks:
+            self.add_block(current)
+
+    def add_block(self, instructions):
+        self.blocks.append(BasicBlock(len(self.blocks), instructions))
+
+    def link_blocks(self):
+        by_label = {block.label: block for block in self.blocks if block.label is not None}
+        for block in self.blocks:
+            last = block.terminator
+            if last is not None and last.op in JUMPS:
+                for label in last.labels():
+                    target = by_label.get(label)
+                    if target is None:
+                        raise ValueError(f'Jump to undefined label L{label}')
+                    self.add_edge(block, target)
+            if (last is None or last.op not in TERMINATORS) and block.index + 1 < len(self.blocks):
+                self.add_edge(block, self.blocks[block.index + 1])
+
+    def add_edge(self, source, target):
+        if target not in source.successors:
+            source.successors.append(target)
+            target.predecessors.append(source)
+
+    @property
+    def entry(self):
+        return self.blocks[0]
+
+    def instructions(self):
+        """All instructions, block by block"""
+        return [instruction for block in self.blocks for instruction in block.instructions]
+
+    def postorder(self):
+        """Blocks reachable from the entry, in depth-first postorder"""
+        order = []
+        visited = {0}
+        stack = [(self.entry, iter(self.entry.successors))]
+        while stack:
+            block, successors = stack[-1]
+            for successor in successors:
+                if successor.index not in visited:
+                    visited.add(successor.index)
+                    stack.append((successor, iter(successor.successors)))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        return order
+
+    def reverse_postorder(self):
+        order = self.postorder()
+        order.reverse()
+        return order
+
+    def compute_dominators(self):
+        """Fill self.idom: immediate dominator index of each block.
+
+        The entry is its own immediate dominator; unreachable blocks get
+        None.
+        """
+        order = self.postorder()
+        number = [None] * len(self.blocks)
+        for position, block in enumerate(order):
+            number[block.index] = position
+        idom = [None] * len(self.blocks)
+        entry = self.entry.index
+        idom[entry] = entry
+
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(order):
+                if block.index == entry:
+                    continue
+                new_idom = None
+                for predecessor in block.predecessors:
+                    other = predecessor.index
+                    if idom[other] is None:
+                        continue
+                    if new_idom is None:
+                        new_idom = other
+                        continue
+                    # Walk both fingers up the tree to their common ancestor.
+                    while other != new_idom:
+                        while number[other] < number[new_idom]:
+                            other = idom[other]
+                        while number[new_idom] < number[other]:
+                            new_idom = idom[new_idom]
+                if idom[block.index] != new_idom:
+                    idom[block.index] = new_idom
+                    changed = True
+        self.idom = idom
+        return idom
+
+    def dominates(self, first, second):
+        """True if block `first` dominates block `second` (both indices)"""
+        if self.idom is None:
+            self.compute_dominators()
+        idom = self.idom
+        if idom[second] is None:
+            return False
+        while second != first:
+            parent = idom[second]
+            if parent == second:
+                return False
+            second = parent
+        return True
+
+    def dominator_tree(self):
+        """Children of each block in the dominator tree"""
+        if self.idom is None:
+            self.compute_dominators()
+        children = [[] for _ in self.blocks]
+        for index, parent in enumerate(self.idom):
+            if parent is not None and parent != index:
+                children[parent].append(index)
+        return children
+
+
+def liveness(graph, tracked):
+    """Bitsets of the variables live on entry to and exit from each block.
+
+    Only operands for which `tracked(operand)` is true are considered.
+    Returns (index, live_in, live_out), where index maps each variable
+    to its bit number.
+    """
+    blocks = graph.blocks
+    index = {}
+    upward = [0] * len(blocks)
+    killed = [0] * len(blocks)
+    for block in blocks:
+        for instruction in block.instructions:
+            for operand in instruction.uses():
+                if tracked(operand):
+                    bit = 1 << index.setdefault(operand, len(index))
+                    if not killed[block.index] & bit:
+                        upward[block.index] |= bit
+            defined = instruction.defined()
+            if defined != NO_OPERAND and tracked(defined):
+                killed[block.index] |= 1 << index.setdefault(defined, len(index))
+
+    live_in = upward[:]
+    live_out = [0] * len(blocks)
+    order = graph.postorder()
+    changed = True
+    while changed:
+        changed = False
+        for block in order:
+            out = 0
+            for successor in block.successors:
+                out |= live_in[successor.index]
+            live_out[block.index] = out
+            new = upward[block.index] | (out & ~killed[block.index])
+            if new != live_in[block.index]:
+                live_in[block.index] = new
+                changed = True
+    return index, live_in, live_out
+
+
+def build_cfgs(code):
+    """One ControlFlowGraph per function in the QuadBuffer `code`.
+
+    Statements outside any function are gathered into a graph named None.
+    """
+    graphs = []
+    top_level = []
+    body = None
+    for instruction in code.instructions():
+        if instruction.op == Op.FUNCTION:
+            name, params, body = code.operand_text(instruction.arg1), instruction.args, []
+        elif instruction.op == Op.END_FUNCTION:
+            graphs.append(ControlFlowGraph(body, name, params))
+            body = None
+        elif body is not None:
+            body.append(instruction)
+        else:
+            top_level.append(instruction)
+    if top_level:
+        graphs.append(ControlFlowGraph(top_level))
+    return graphs
+
+
+def main(path):
+    with open(path) as source_file:
+        code = compile_source(source_file.read())
+    for graph in build_cfgs(code):
+        graph.compute_dominators()
+        print(f'function {graph.name}' if graph.name is not None else 'top level')
+        for block in graph.blocks:
+            successors = ', '.join(f'B{successor.index}' for successor in block.successors)
+            idom = graph.idom[block.index]
+            print(f'  B{block.index}: {len(block.instructions)} instructions, '
+                  f'successors [{successors}], idom {"-" if idom is None else f"B{idom}"}')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
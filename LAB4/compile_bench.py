@@ -0,0 +1,244 @@
+"""Compile throughput and memory on synthetic .sk programs.
+
+Usage: python3 compile_bench.py [-o FILE] [--label NAME] [--scale N] [--repeat N]
+                                [--shape NAME]... [--write-sk DIR]
+       python3 compile_bench.py --compare BASE.json NEW.json [--threshold FRACTION]
+
+Each shape generates one program whose size grows with --scale:
+
+    expressions  long arithmetic chains in straight-line code
+    nesting      if/while statements nested hundreds deep
+    functions    many small functions calling each other
+    switch       state machines with dense and sparse switches
+    arrays       large arrays filled in loops and read at many indexes
+
+Every program is compiled --repeat times with a CompileProfile (see
+profiler.py) and the fastest time of each phase is kept.  Memory is
+measured in one extra compile with tracemalloc on, since tracing slows
+the phases down.  The results, tagged with --label (by default the git
+revision), go to FILE as JSON.
+
+--compare reads two results files and lists every shape and phase
+whose throughput fell, or whose peak memory grew, by more than the
+threshold (default 10%).  It exits with status 1 if there are any.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+
+from parser import compile_source
+from profiler import CompileProfile
+
+DEFAULT_THRESHOLD = 0.10
+
+
+def expressions_program(size, rng):
+    """Straight-line code of `size` statements, each a chain of 20 terms"""
+    lines = ['function main() {', '    int a = 3;', '    int b = 7;', '    float x = 1.5;', '    float y = 2.5;']
+    for _ in range(size):
+        if rng.random() < 0.5:
+            terms = [rng.choice(['a', 'b', str(rng.randint(1, 99)), f'(a * {rng.randint(2, 9)})'])
+                     for _ in range(20)]
+            operators = [rng.choice(['+', '-', '*']) for _ in range(19)]
+            target = rng.choice('ab')
+        else:
+            terms = [rng.choice(['x', 'y', 'a', f'{rng.randint(0, 9)}.{rng.randint(0, 9)}', '(x * y)'])
+                     for _ in range(20)]
+            operators = [rng.choice(['+', '-', '*', '/']) for _ in range(19)]
+            target = rng.choice('xy')
+        expression = terms[0] + ''.join(f' {operator} {term}' for operator, term in zip(operators, terms[1:]))
+        lines.append(f'    {target} = {expression};')
+    lines += ['    return a;', '}']
+    return '\n'.join(lines)
+
+
+def nesting_program(size, rng):
+    """`size` levels of alternating if and while statements"""
+    lines = ['function main() {', '    int a = 0;', '    int b = 1;']
+    for depth in range(size):
+        indent = '    ' * (depth + 1)
+        if depth % 2:
+            lines.append(f'{indent}while (a < {rng.randint(1, 50)}) {{')
+        else:
+            lines.append(f'{indent}if (a + b > {rng.randint(-5, 5)}) {{')
+        lines.append(f'{indent}    a = a + {rng.randint(1, 3)};')
+    for depth in reversed(range(size)):
+        lines.append('    ' * (depth + 1) + '}')
+    lines += ['    return a;', '}']
+    return '\n'.join(lines)
+
+
+def functions_program(size, rng):
+    """`size` functions, each calling one defined before it"""
+    functions = []
+    for index in range(size):
+        callee = f'f{rng.randrange(index)}(a + 1, b)' if index else 'a'
+        functions.append(f'function f{index}(int a, float b) {{\n'
+                         f'    int c = a * {rng.randint(2, 9)};\n'
+                         f'    if (c > {rng.randint(10, 90)}) {{\n'
+                         f'        c = c - a;\n'
+                         f'    }}\n'
+                         f'    b = b + c;\n'
+                         f'    return {callee};\n'
+                         f'}}')
+    return '\n'.join(functions)
+
+
+def switch_program(size, rng):
+    """Two state machines of `size` states, one dense and one sparse"""
+    lines = []
+    for name, spacing in (('dense', 1), ('sparse', 17)):
+        lines += [f'function {name}(int steps) {{', '    int state = 0;', '    int total = 0;',
+                  '    while (steps > 0) {', '        switch (state) {']
+        for case in range(size):
+            following = rng.randrange(size)
+            lines.append(f'            case {case * spacing}: state = {following * spacing}; '
+                         f'total = total + {rng.randint(0, 9)}; break;')
+        lines += ['            default: state = 0;', '        }', '        steps = steps - 1;', '    }',
+                  '    return total;', '}']
+    return '\n'.join(lines)
+
+
+def arrays_program(size, rng):
+    """Arrays of `size` elements, filled in loops and read at constant and computed indexes"""
+    lines = ['function main() {', f'    int[{size}] values;', f'    float[{size}] weights;', '    int i = 0;',
+             f'    while (i < {size}) {{', '        values[i] = i * 3;', '        weights[i] = i / 2.0;',
+             '        i = i + 1;', '    }', '    int sum = 0;', '    float mass = 0.0;']
+    for _ in range(size // 10):
+        index = rng.randrange(size)
+        lines.append(f'    sum = sum + values[{index}] - values[(sum + {index}) - (sum + {index}) / {size} * {size}];')
+        lines.append(f'    mass = mass + weights[{rng.randrange(size)}] * values[{index}];')
+    lines += ['    return sum;', '}']
+    return '\n'.join(lines)
+
+
+# Shape name -> (program generator, size at --scale 1)
+SHAPES = {
+    'expressions': (expressions_program, 2000),
+    'nesting': (nesting_program, 400),
+    'functions': (functions_program, 1000),
+    'switch': (switch_program, 1000),
+    'arrays': (arrays_program, 20000),
+}
+
+
+def generate(shape, scale=1.0, seed=0):
+    """Source of the `shape` program at `scale`"""
+    program, size = SHAPES[shape]
+    return program(max(1, int(size * scale)), random.Random(seed))
+
+
+def measure(source_code, repeat):
+    """Phase dicts of compiling `source_code`: best times, then traced peaks"""
+    best = None
+    for _ in range(repeat):
+        profile = CompileProfile(memory=False)
+        compile_source(source_code, profile=profile)
+        if best is None:
+            best = profile.phases
+            continue
+        for kept, stats in zip(best, profile.phases):
+            kept.seconds = min(kept.seconds, stats.seconds)
+    traced = CompileProfile()
+    compile_source(source_code, profile=traced)
+    for kept, stats in zip(best, traced.phases):
+        kept.peak_bytes = stats.peak_bytes
+    return [stats.as_dict() for stats in best]
+
+
+def revision():
+    """Short git revision of this directory, with '+' if the tree is dirty, else None"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        head = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=directory,
+                              capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no', '.'], cwd=directory,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return head + '+' if dirty else head
+
+
+def run(shapes, scale, repeat, label, write_dir=None):
+    results = {'label': label, 'scale': scale, 'repeat': repeat, 'python': sys.version.split()[0], 'shapes': {}}
+    print(f'{"shape":<12}{"phase":<10}{"seconds":>10}{"items":>10} {"unit":<14}{"per second":>12}{"peak KiB":>10}')
+    for shape in shapes:
+        source_code = generate(shape, scale)
+        if write_dir is not None:
+            with open(os.path.join(write_dir, f'{shape}.sk'), 'w') as source_file:
+                source_file.write(source_code)
+        phases = measure(source_code, repeat)
+        results['shapes'][shape] = {'source_bytes': len(source_code), 'phases': phases}
+        for phase in phases:
+            print(f'{shape:<12}{phase["name"]:<10}{phase["seconds"]:>10.4f}{phase["items"]:>10} '
+                  f'{phase["unit"]:<14}{phase["per_second"]:>12.0f}{phase["peak_bytes"] / 1024:>10.1f}')
+    return results
+
+
+def regressions(base, new, threshold=DEFAULT_THRESHOLD):
+    """Descriptions of every phase of `new` slower or bigger than in `base` by more than `threshold`"""
+    found = []
+    for shape, results in new['shapes'].items():
+        if shape not in base['shapes']:
+            continue
+        base_phases = {phase['name']: phase for phase in base['shapes'][shape]['phases']}
+        for phase in results['phases']:
+            old = base_phases.get(phase['name'])
+            if old is None:
+                continue
+            where = f'{shape} {phase["name"]}'
+            if old['per_second'] and phase['per_second'] < old['per_second'] * (1 - threshold):
+                found.append(f'{where}: {phase["per_second"]:.0f} {phase["unit"]}/s, was {old["per_second"]:.0f} '
+                             f'({phase["per_second"] / old["per_second"] - 1:+.1%})')
+            if old['peak_bytes'] and phase['peak_bytes'] > old['peak_bytes'] * (1 + threshold):
+                found.append(f'{where}: peak {phase["peak_bytes"] / 1024:.1f} KiB, was {old["peak_bytes"] / 1024:.1f} '
+                             f'({phase["peak_bytes"] / old["peak_bytes"] - 1:+.1%})')
+    return found
+
+
+def compare(base_path, new_path, threshold):
+    with open(base_path) as base_file:
+        base = json.load(base_file)
+    with open(new_path) as new_file:
+        new = json.load(new_file)
+    if base['scale'] != new['scale']:
+        print(f'warning: comparing scale {base["scale"]} with scale {new["scale"]}', file=sys.stderr)
+    found = regressions(base, new, threshold)
+    print(f'{base["label"]} -> {new["label"]}: {len(found)} regressions beyond {threshold:.0%}')
+    for description in found:
+        print(f'  {description}')
+    return 1 if found else 0
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Benchmark the compiler on synthetic .sk programs.')
+    arg_parser.add_argument('-o', '--output', metavar='FILE', help='write the results to FILE as JSON')
+    arg_parser.add_argument('--label', help='name of this run (default: the git revision)')
+    arg_parser.add_argument('--scale', type=float, default=1.0, help='multiply every program size by N')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='compiles per program; the fastest counts')
+    arg_parser.add_argument('--shape', action='append', choices=sorted(SHAPES), help='run only this shape')
+    arg_parser.add_argument('--write-sk', metavar='DIR', help='also save the generated programs in DIR')
+    arg_parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two results files')
+    arg_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='fraction of throughput or memory change to report')
+    args = arg_parser.parse_args(argv)
+    if args.repeat < 1:
+        arg_parser.error('--repeat must be at least 1')
+
+    if args.compare:
+        return compare(args.compare[0], args.compare[1], args.threshold)
+    if args.write_sk:
+        os.makedirs(args.write_sk, exist_ok=True)
+    label = args.label or revision() or 'unknown'
+    results = run(args.shape or list(SHAPES), args.scale, args.repeat, label, args.write_sk)
+    if args.output:
+        with open(args.output, 'w') as results_file:
+            json.dump(results, results_file, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
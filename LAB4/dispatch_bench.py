@@ -0,0 +1,97 @@
+"""Compare per-node dispatch cost of the handler table with the old if-chain.
+
+Usage: python3 dispatch_bench.py [copies]
+
+IfChainGenerator dispatches with the sequence of `node.type` comparisons
+generate_code used before the handler table, but calls the same handler
+methods, so the difference between the two rows is dispatch alone.
+"""
+import sys
+import time
+
+from lexer import Lexer
+from main import SAMPLE_SOURCE
+from parser import NodeType, Parser, ThreeAddressCodeGenerator
+from tac import NO_OPERAND
+
+
+class IfChainGenerator(ThreeAddressCodeGenerator):
+    def visit(self, node):
+        if not node:
+            return NO_OPERAND
+        if node.type == NodeType.BINARY_OPERATION:
+            return self.generate_binary_operation(node)
+        if node.type == NodeType.UNARY_OPERATION:
+            return self.generate_unary_operation(node)
+        if node.type == NodeType.COMPARISON_OPERATION:
+            return self.generate_comparison_operation(node)
+        if node.type == NodeType.LOGICAL_OPERATION:
+            return self.generate_logical_operation(node)
+        if node.type == NodeType.ASSIGNMENT:
+            return self.generate_assignment(node)
+        if node.type == NodeType.IF_STATEMENT:
+            return self.generate_if_statement(node)
+        if node.type == NodeType.WHILE_STATEMENT:
+            return self.generate_while_statement(node)
+        if node.type == NodeType.SWITCH_STATEMENT:
+            return self.generate_switch_statement(node)
+        if node.type == NodeType.BREAK_STATEMENT:
+            return self.generate_break_statement(node)
+        if node.type == NodeType.CONTINUE_STATEMENT:
+            return self.generate_continue_statement(node)
+        if node.type == NodeType.NUMBER:
+            return self.generate_number(node)
+        if node.type == NodeType.IDENTIFIER:
+            return self.generate_identifier(node)
+        if node.type == NodeType.ARRAY_ACCESS:
+            return self.generate_array_access(node)
+        if node.type == NodeType.FUNCTION_CALL:
+            return self.generate_function_call(node)
+        if node.type == NodeType.RETURN_STATEMENT:
+            return self.generate_return_statement(node)
+        return self.generate_children(node)
+
+
+def collect_nodes(root):
+    nodes = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            continue
+        nodes.append(node)
+        stack.append(node.right)
+        stack.append(node.left)
+        stack.extend(reversed(node.children))
+    return nodes
+
+
+def best_of(runs, function):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(copies):
+    source_code = SAMPLE_SOURCE * copies
+    ast = Parser(Lexer(source_code).iter_tokens()).parse()
+    nodes = collect_nodes(ast)
+    print(f'{len(nodes)} nodes from {copies} copies of the main.py sample\n')
+    print(f'{"generator":<28}{"dispatch ns/node":>18}{"codegen ns/node":>18}')
+
+    for generator_class in (IfChainGenerator, ThreeAddressCodeGenerator):
+        generator = generator_class()
+        # Dispatch alone: resolve the handler for every node and drop the
+        # generator it returns without running it.
+        dispatch = best_of(5, lambda: [generator.visit(node) for node in nodes])
+        codegen = best_of(5, lambda: generator_class().generate_code(ast))
+        print(f'{generator_class.__name__:<28}{dispatch / len(nodes) * 1e9:>18.1f}'
+              f'{codegen / len(nodes) * 1e9:>18.1f}')
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
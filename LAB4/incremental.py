@@ -0,0 +1,273 @@
+"""Incremental recompilation for editors.
+
+The source is split into top-level units: each function declaration is
+one unit and each run of top-level statements between them is another.
+Every unit is parsed on its own, so an edit only re-lexes and re-parses
+the units it touches; the ASTs of the others are kept as they are.  A
+function sees nothing around it and is lowered to TAC on its own.  The
+top-level statements all run in one scope, so when any of them change
+they are lowered again together, in order, each unit into a QuadBuffer
+of its own.  Every unit numbers its temps and labels from 1; lines()
+moves them past those of the units before it, which gives the same TAC
+as compile_source.
+
+    compiler = IncrementalCompiler(source)
+    compiler.edit(start, end, text)    # replace source[start:end]
+    compiler.lines()                   # TAC, unit by unit
+"""
+import bisect
+
+from lexer import Lexer, Token, TokenType, TOKEN_KIND_INDEX
+from parser import ASTNode, ConstantFolder, NodeType, Parser, ThreeAddressCodeGenerator, TypeChecker, drive
+from tac import JUMPS, NO_OPERAND, TEMP, Op, QuadBuffer, operand_kind
+
+FUNCTION_KIND = TOKEN_KIND_INDEX[TokenType.FUNCTION]
+LBRACE_KIND = TOKEN_KIND_INDEX[TokenType.LBRACE]
+RBRACE_KIND = TOKEN_KIND_INDEX[TokenType.RBRACE]
+
+# A region ending right after one of these tokens cannot run into the
+# unit that follows it.
+CLOSED_TOKENS = ';{}()[],:'
+
+
+class Unit:
+    """One top-level unit: its source span, AST nodes and TAC"""
+    __slots__ = ('start', 'end', 'nodes', 'code', 'temps', 'labels')
+
+    def __init__(self, start, end, nodes, code=None, temps=0, labels=0):
+        self.start = start
+        self.end = end
+        self.nodes = nodes
+        self.code = code
+        # Temps and labels `code` numbers from 1.
+        self.temps = temps
+        self.labels = labels
+
+    @property
+    def name(self):
+        """Function name, or None for a run of top-level statements"""
+        if self.nodes and self.nodes[0].type == NodeType.FUNCTION_DECLARATION:
+            return self.nodes[0].value
+        return None
+
+
+def split_units(tokens):
+    """Yield (first, stop) token index ranges of the top-level units"""
+    kinds = tokens.kinds
+    count = len(tokens) - 1
+    index = 0
+    while index < count:
+        first = index
+        depth = 0
+        if kinds[index] == FUNCTION_KIND:
+            # A declaration runs to the brace that closes its body.
+            index += 1
+            while index < count:
+                kind = kinds[index]
+                if kind == LBRACE_KIND:
+                    depth += 1
+                elif kind == RBRACE_KIND:
+                    depth -= 1
+                    if depth == 0:
+                        index += 1
+                        break
+                elif kind == FUNCTION_KIND and depth <= 0:
+                    break
+                index += 1
+        else:
+            while index < count:
+                kind = kinds[index]
+                if kind == LBRACE_KIND:
+                    depth += 1
+                elif kind == RBRACE_KIND:
+                    depth -= 1
+                elif kind == FUNCTION_KIND and depth <= 0:
+                    break
+                index += 1
+        yield first, index
+
+
+def unit_tokens(tokens, first, stop):
+    """Tokens first..stop-1 followed by an EOF token where the unit ends"""
+    for index in range(first, stop):
+        yield tokens[index]
+    yield Token(TokenType.EOF, '', tokens.lines[stop], tokens.columns[stop])
+
+
+def compile_unit(tokens, first, stop):
+    """Parse a unit; a function is lowered too, top-level code by TopLevel"""
+    program_node = ConstantFolder().fold(Parser(unit_tokens(tokens, first, stop)).parse())
+    end = tokens.starts[stop - 1] + tokens.lengths[stop - 1]
+    unit = Unit(tokens.starts[first], end, list(program_node.children))
+    if unit.name is not None:
+        generator = ThreeAddressCodeGenerator()
+        generator.generate_code(program_node)
+        unit.code = generator.code
+        unit.temps = generator.temp_counter
+        unit.labels = generator.label_counter
+    return unit
+
+
+class TopLevel:
+    """Type checker and code generator over the scope of the top-level statements"""
+
+    def __init__(self):
+        self.checker = TypeChecker()
+        self.generator = ThreeAddressCodeGenerator()
+        self.checker.symbol_table.enter_top_level()
+        self.generator.symbol_table.enter_top_level()
+        self.generator.types = self.checker.types
+        self.generator.warnings = self.checker.warnings
+
+    def lower(self, unit):
+        """Check and lower `unit` after the units given so far"""
+        generator = self.generator
+        generator.code = QuadBuffer()
+        generator.temp_counter = generator.label_counter = 0
+        for node in unit.nodes:
+            self.checker.check(node)
+        for node in unit.nodes:
+            drive(generator.visit, node)
+        unit.code = generator.code
+        unit.temps = generator.temp_counter
+        unit.labels = generator.label_counter
+
+
+def renumbered(code, temps, labels):
+    """Copy of `code` with every temp moved up by `temps` and label by `labels`"""
+
+    def move(operand):
+        if operand != NO_OPERAND and operand_kind(operand) == TEMP:
+            return operand + (temps << 2)
+        return operand
+
+    instructions = code.instructions()
+    for instruction in instructions:
+        instruction.result = move(instruction.result)
+        instruction.arg1 = move(instruction.arg1)
+        instruction.arg2 = move(instruction.arg2)
+        if instruction.op == Op.CALL:
+            instruction.args = [move(arg) for arg in instruction.args]
+        elif instruction.op == Op.LABEL or instruction.op in JUMPS:
+            instruction.retarget({label: label + labels for label in instruction.labels()})
+    return QuadBuffer.from_instructions(instructions, code.strings)
+
+
+def lex_region(source, start, stop):
+    """Lex source[start:stop] with line and column numbers of the whole source"""
+    lexer = Lexer(source)
+    lexer.current = start
+    lexer.line = source.count('\n', 0, start) + 1
+    lexer.column = start - source.rfind('\n', 0, start)
+    return lexer.tokenize_compact(stop)
+
+
+def ends_cleanly(source, tokens, start, stop):
+    """True if lexing source[start:stop] on its own ends on a token boundary"""
+    if stop >= len(source):
+        return True
+    if len(tokens) > 1:
+        last_end = tokens.starts[-2] + tokens.lengths[-2]
+    else:
+        last_end = start
+    if last_end == stop:
+        return source[stop - 1] in CLOSED_TOKENS
+    # Only whitespace and comments follow the last token; a comment still
+    # open at `stop` would swallow the next unit.
+    tail = source[last_end:stop]
+    return '//' not in tail[tail.rfind('\n') + 1:]
+
+
+class IncrementalCompiler:
+    def __init__(self, source_code=''):
+        self.source_code = source_code
+        self.units = None
+        # Units recompiled by the most recent build or edit.
+        self.recompiled = []
+        self.rebuild()
+
+    def rebuild(self):
+        """Recompile the whole source"""
+        self.units = None
+        units = self.compile_region(0, len(self.source_code))
+        self.lower_top_level(units)
+        self.units = self.recompiled = units
+        return self.recompiled
+
+    def compile_region(self, start, stop):
+        tokens = lex_region(self.source_code, start, stop)
+        return [compile_unit(tokens, first, last) for first, last in split_units(tokens)]
+
+    def lower_top_level(self, units):
+        """Lower every run of top-level statements in `units` again; return those runs"""
+        top_level = TopLevel()
+        runs = [unit for unit in units if unit.name is None]
+        for unit in runs:
+            top_level.lower(unit)
+        return runs
+
+    def edit(self, start, end, text):
+        """Replace source[start:end] with `text` and recompile what it touches.
+
+        Returns the recompiled units, which include every run of
+        top-level statements if any of them changed.  A ValueError from
+        the new source propagates; the edit is still applied, and the
+        next edit recompiles everything.
+        """
+        old_source = self.source_code
+        if not 0 <= start <= end <= len(old_source):
+            raise ValueError(f'Edit range {start}:{end} outside source of length {len(old_source)}')
+        self.source_code = old_source[:start] + text + old_source[end:]
+        units = self.units
+        if not units:
+            return self.rebuild()
+        delta = len(text) - (end - start)
+
+        # A unit is touched if the edit reaches it or the whitespace on
+        # either side of it.
+        first = max(bisect.bisect_left(units, start, key=lambda unit: unit.start) - 1, 0)
+        last = min(bisect.bisect_right(units, end, key=lambda unit: unit.end), len(units) - 1)
+        region_start = units[first - 1].end if first > 0 else 0
+
+        self.units = None
+        while True:
+            region_stop = units[last + 1].start + delta if last + 1 < len(units) else len(self.source_code)
+            tokens = lex_region(self.source_code, region_start, region_stop)
+            if ends_cleanly(self.source_code, tokens, region_start, region_stop):
+                break
+            last += 1
+
+        recompiled = [compile_unit(tokens, first_token, stop) for first_token, stop in split_units(tokens)]
+        for unit in units[last + 1:]:
+            unit.start += delta
+            unit.end += delta
+        replaced = units[first:last + 1]
+        units = units[:first] + recompiled + units[last + 1:]
+        if any(unit.name is None for unit in replaced + recompiled):
+            runs = self.lower_top_level(units)
+            recompiled = [unit for unit in units if unit in recompiled or unit in runs]
+        self.units = units
+        self.recompiled = recompiled
+        return recompiled
+
+    @property
+    def program(self):
+        """PROGRAM node over the nodes of every unit"""
+        program_node = ASTNode(NodeType.PROGRAM)
+        for unit in self.units:
+            for node in unit.nodes:
+                program_node.add_child(node)
+        return program_node
+
+    def functions(self):
+        """Map each function name to its TAC"""
+        return {unit.name: unit.code for unit in self.units if unit.name is not None}
+
+    def lines(self):
+        lines = []
+        temps = labels = 0
+        for unit in self.units:
+            lines.extend(renumbered(unit.code, temps, labels).lines())
+            temps += unit.temps
+            labels += unit.labels
+        return lines
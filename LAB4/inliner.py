@@ -0,0 +1,252 @@
+"""Inline small functions into their callers.
+
+Usage: python3 inliner.py FILE.sk
+
+    code = Inliner().run(compile_source(source))
+
+Functions are visited callees first (CallGraph.sccs), so a body is
+inlined with its own calls already expanded.  A call is replaced by the
+callee's body when the callee is defined once, is not recursive, takes
+as many arguments as the call passes and has at most max_callee_size
+instructions, and the caller stays within max_function_size.  The copy
+gets fresh temps and labels, and the callee's variables are renamed
+`callee.site.name`; parameters are assigned the arguments, and any other
+variable that may be read before it is written starts at 0, as in a
+fresh VM frame.  Each return assigns the call's result and jumps past
+the copy.  A callee that can finish without a value is only inlined
+where the result is never read, since TAC cannot spell the None such a
+call produces.
+"""
+import sys
+
+from callgraph import CallGraph
+from parser import compile_source
+from tac import JUMPS, NAME, NO_OPERAND, TEMP, Instruction, Op, QuadBuffer, operand_kind, temp_operand
+
+MAX_CALLEE_SIZE = 40
+MAX_FUNCTION_SIZE = 2000
+
+
+def split_program(instructions):
+    """Program order as top-level instructions and (FUNCTION instruction, body) pairs"""
+    layout = []
+    body = None
+    for instruction in instructions:
+        if instruction.op == Op.FUNCTION:
+            body = []
+            layout.append((instruction, body))
+        elif instruction.op == Op.END_FUNCTION:
+            body = None
+        elif body is not None:
+            body.append(instruction)
+        else:
+            layout.append(instruction)
+    return layout
+
+
+def size(body):
+    return sum(1 for instruction in body if instruction.op != Op.LABEL)
+
+
+def read_names(instruction):
+    """Named operands read by `instruction`, arrays included"""
+    names = [operand for operand in instruction.uses() if operand_kind(operand) == NAME]
+    if instruction.op == Op.LOAD:
+        names.append(instruction.arg1)
+    elif instruction.op == Op.STORE:
+        names.append(instruction.result)
+    return names
+
+
+def written_name(instruction):
+    if instruction.op == Op.ARRAY:
+        return instruction.result
+    defined = instruction.defined()
+    return defined if operand_kind(defined) == NAME else NO_OPERAND
+
+
+def unset_reads(body, params):
+    """Variables of `body` that may be read before anything is assigned to them.
+
+    Only the straight-line start of the body is followed; a variable
+    read anywhere after the first label or jump counts unless that start
+    assigned it.
+    """
+    assigned = set(params)
+    unset = []
+    straight = True
+    for instruction in body:
+        if instruction.op == Op.LABEL or instruction.op in JUMPS:
+            straight = False
+        for name in read_names(instruction):
+            if name not in assigned and name not in unset:
+                unset.append(name)
+        if straight:
+            written = written_name(instruction)
+            if written != NO_OPERAND:
+                assigned.add(written)
+    return unset
+
+
+class Inliner:
+    def __init__(self, max_callee_size=MAX_CALLEE_SIZE, max_function_size=MAX_FUNCTION_SIZE):
+        self.max_callee_size = max_callee_size
+        self.max_function_size = max_function_size
+        # Calls replaced by the most recent run
+        self.inlined = 0
+
+    def run(self, code):
+        """Return a copy of the QuadBuffer `code` with small calls inlined"""
+        self.code = code
+        self.inlined = 0
+        self.sites = 0
+        graph = CallGraph.from_code(code)
+        instructions = code.instructions()
+        layout = split_program(instructions)
+        if graph.redefined:
+            return QuadBuffer.from_instructions(instructions, code.strings)
+        self.next_temp, self.next_label = self.fresh_numbers(instructions)
+        recursive = graph.recursive()
+        self.functions = {code.operand_text(entry[0].arg1): entry for entry in layout if isinstance(entry, tuple)}
+        self.candidates = {name for name in self.functions if name not in recursive}
+        for component in graph.sccs():
+            for name in component:
+                header, body = self.functions[name]
+                body[:] = self.inline_calls(body, name)
+        top_level = [entry for entry in layout if not isinstance(entry, tuple)]
+        expanded = iter(self.inline_calls(top_level, None, keep_positions=True))
+
+        result = QuadBuffer(code.strings)
+        for entry in layout:
+            if isinstance(entry, tuple):
+                header, body = entry
+                result.append(header)
+                for instruction in body:
+                    result.append(instruction)
+                result.emit(Op.END_FUNCTION)
+            else:
+                for instruction in next(expanded):
+                    result.append(instruction)
+        return result
+
+    def fresh_numbers(self, instructions):
+        """First unused temp number and label"""
+        temp = label = 0
+        for instruction in instructions:
+            for operand in (instruction.result, instruction.arg1, instruction.arg2, *(instruction.args or ())):
+                if operand != NO_OPERAND and operand_kind(operand) == TEMP:
+                    temp = max(temp, operand >> 2)
+            if instruction.op == Op.LABEL or instruction.op in JUMPS:
+                label = max(label, *instruction.labels())
+        return temp + 1, label + 1
+
+    def inline_calls(self, body, caller, keep_positions=False):
+        """Instructions of `body` with inlinable calls expanded.
+
+        With keep_positions the result is one list per instruction of
+        `body`, so top-level statements can be put back between the
+        functions they were written around.
+        """
+        current = size(body)
+        read = {}
+        for instruction in body:
+            for operand in instruction.uses():
+                read[operand] = True
+        expanded = []
+        for instruction in body:
+            copy = None
+            if instruction.op == Op.CALL and operand_kind(instruction.arg1) == NAME:
+                callee = self.code.operand_text(instruction.arg1)
+                copy = self.expansion(instruction, callee, caller, current, instruction.result in read)
+            if copy is None:
+                copy = [instruction]
+            else:
+                current += size(copy) - 1
+                self.inlined += 1
+            if keep_positions:
+                expanded.append(copy)
+            else:
+                expanded.extend(copy)
+        return expanded
+
+    def expansion(self, call, callee, caller, current, result_read):
+        """Instructions replacing `call`, or None if it is not inlined"""
+        if callee not in self.candidates or callee == caller:
+            return None
+        header, body = self.functions[callee]
+        if len(header.args) != len(call.args):
+            return None
+        callee_size = size(body)
+        if callee_size > self.max_callee_size or current + callee_size > self.max_function_size:
+            return None
+        returns_value = bool(body) and body[-1].op == Op.RETURN and all(
+            instruction.arg1 != NO_OPERAND for instruction in body if instruction.op == Op.RETURN)
+        if result_read and not returns_value:
+            return None
+
+        self.sites += 1
+        strings = self.code.strings
+        prefix = f'{callee}.{self.sites}.'
+        names = {}
+        temps = {}
+
+        def rename(operand):
+            if operand == NO_OPERAND:
+                return operand
+            kind = operand_kind(operand)
+            if kind == NAME:
+                renamed = names.get(operand)
+                if renamed is None:
+                    renamed = names[operand] = strings.intern(prefix + strings.strings[operand >> 2]) << 2 | NAME
+                return renamed
+            if kind == TEMP:
+                renamed = temps.get(operand)
+                if renamed is None:
+                    renamed = temps[operand] = temp_operand(self.next_temp)
+                    self.next_temp += 1
+                return renamed
+            return operand
+
+        labels = {}
+        for instruction in body:
+            if instruction.op == Op.LABEL:
+                labels[instruction.target] = self.next_label
+                self.next_label += 1
+        end = self.next_label
+        self.next_label += 1
+
+        copy = [Instruction(Op.COPY, rename(param), arg) for param, arg in zip(header.args, call.args)]
+        zero = self.code.const('0')
+        copy += [Instruction(Op.COPY, rename(name), zero) for name in unset_reads(body, header.args)]
+        for instruction in body:
+            if instruction.op == Op.RETURN:
+                if instruction.arg1 != NO_OPERAND:
+                    copy.append(Instruction(Op.COPY, call.result, rename(instruction.arg1)))
+                copy.append(Instruction(Op.GOTO, target=end))
+                continue
+            args = instruction.args
+            if instruction.op == Op.CALL:
+                args = [rename(arg) for arg in args]
+            elif args is not None:
+                args = list(args)
+            arg1 = instruction.arg1 if instruction.op == Op.CALL else rename(instruction.arg1)
+            cloned = Instruction(instruction.op, rename(instruction.result), arg1, rename(instruction.arg2),
+                                 instruction.operator, instruction.target, args)
+            if instruction.op == Op.LABEL or instruction.op in JUMPS:
+                cloned.retarget(labels)
+            copy.append(cloned)
+        copy.append(Instruction(Op.LABEL, target=end))
+        return copy
+
+
+def main(argv):
+    with open(argv[0]) as source_file:
+        code = compile_source(source_file.read())
+    inliner = Inliner()
+    inlined = inliner.run(code)
+    print(inlined)
+    print(f'\n{inliner.inlined} calls inlined, {len(code)} -> {len(inlined)} instructions', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
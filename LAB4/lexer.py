@@ -1,5 +1,7 @@
 import re
 import enum
+import array
+import collections
 
 class TokenType(enum.Enum):
     # Keywords
@@ -56,6 +58,8 @@ class TokenType(enum.Enum):
     EOF = 'EOF'
 
 class Token:
+    __slots__ = ('type', 'value', 'line', 'column')
+
     def __init__(self, type, value, line=0, column=0):
         self.type = type
         self.value = value
@@ -65,39 +69,241 @@ class Token:
     def __repr__(self):
         return f'Token({self.type}, {self.value}, Line: {self.line}, Column: {self.column})'
 
-class Lexer:
+# Token kinds are stored as small integers in TokenArray.
+TOKEN_KINDS = list(TokenType)
+TOKEN_KIND_INDEX = {token_type: index for index, token_type in enumerate(TOKEN_KINDS)}
+
+
+class TokenArray:
+    """Token stream stored as parallel typed arrays.
+
+    Each token costs a few bytes (kind, start offset, length, line and
+    column) instead of a full Token object; values are sliced from the
+    source and Token objects are only built when a token is read.
+    """
+
     def __init__(self, source_code):
         self.source_code = source_code
+        self.kinds = array.array('B')
+        self.starts = array.array('I')
+        self.lengths = array.array('I')
+        self.lines = array.array('I')
+        self.columns = array.array('I')
+
+    def append(self, token_type, start, length, line, column):
+        self.kinds.append(TOKEN_KIND_INDEX[token_type])
+        self.starts.append(start)
+        self.lengths.append(length)
+        self.lines.append(line)
+        self.columns.append(column)
+
+    def type(self, index):
+        return TOKEN_KINDS[self.kinds[index]]
+
+    def value(self, index):
+        start = self.starts[index]
+        return self.source_code[start:start + self.lengths[index]]
+
+    def nbytes(self):
+        """Bytes used by the token arrays, excluding the shared source"""
+        return sum(column.itemsize * len(column) for column in
+                   (self.kinds, self.starts, self.lengths, self.lines, self.columns))
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        return Token(self.type(index), self.value(index), self.lines[index], self.columns[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+# Lookup tables shared by both tokenizer engines, built once at import time.
+KEYWORDS = {
+    'int': TokenType.INT,
+    'float': TokenType.FLOAT,
+    'bool': TokenType.BOOL,
+    'if': TokenType.IF,
+    'else': TokenType.ELSE,
+    'while': TokenType.WHILE,
+    'return': TokenType.RETURN,
+    'function': TokenType.FUNCTION,
+    'case': TokenType.CASE,
+    'default': TokenType.DEFAULT,
+    'break': TokenType.BREAK,
+    'switch': TokenType.SWITCH,
+    'continue': TokenType.CONTINUE
+}
+
+SINGLE_CHAR_TOKENS = {
+    '+': TokenType.PLUS,
+    '-': TokenType.MINUS,
+    '*': TokenType.MULTIPLY,
+    '/': TokenType.DIVIDE,
+    '(': TokenType.LPAREN,
+    ')': TokenType.RPAREN,
+    '{': TokenType.LBRACE,
+    '}': TokenType.RBRACE,
+    '[': TokenType.LBRACKET,
+    ']': TokenType.RBRACKET,
+    ';': TokenType.SEMICOLON,
+    ',': TokenType.COMMA,
+    ':': TokenType.COLON
+}
+
+TWO_CHAR_OPERATORS = {
+    '==': TokenType.EQUAL,
+    '!=': TokenType.NOT_EQUAL,
+    '<=': TokenType.LESS_EQUAL,
+    '>=': TokenType.GREATER_EQUAL,
+    '&&': TokenType.AND,
+    '||': TokenType.OR
+}
+
+ONE_CHAR_OPERATORS = {
+    '=': TokenType.ASSIGN,
+    '<': TokenType.LESS_THAN,
+    '>': TokenType.GREATER_THAN,
+    '!': TokenType.NOT
+}
+
+OPERATORS = {**SINGLE_CHAR_TOKENS, **ONE_CHAR_OPERATORS, **TWO_CHAR_OPERATORS}
+
+# Master pattern for the regex engine.  The alternatives are tried in the
+# same order as the branches of the character scanner, so both engines
+# agree on every token boundary.
+TOKEN_PATTERN = re.compile(r'''
+    (?P<WHITESPACE>\s+)
+  | (?P<COMMENT>//[^\n]*)
+  | (?P<OPERATOR>==|!=|<=|>=|&&|\|\||[-+*/=<>!(){}\[\];,:])
+  | (?P<NUMBER>\d+(?:\.\d*)?|\.\d+)
+  | (?P<IDENTIFIER>[^\W\d]\w*)
+  | (?P<MISMATCH>.)
+''', re.VERBOSE | re.DOTALL)
+
+class Lexer:
+    ENGINES = ('regex', 'scan')
+
+    def __init__(self, source_code, engine='regex'):
+        if engine not in self.ENGINES:
+            raise ValueError(f'Unknown lexer engine: {engine}')
+        self.source_code = source_code
+        self.engine = engine
         self.tokens = []
         self.current = 0
         self.line = 1
         self.column = 1
 
-    def add_token(self, token_type, value=None):
-        """Helper method to add a token to the tokens list"""
+    def make_token(self, token_type, value=None):
+        """Helper method to build a token and advance past it"""
         if value is None:
             value = token_type.value
-        self.tokens.append(Token(token_type, value, self.line, self.column))
-        self.current += 1
+        token = Token(token_type, value, self.line, self.column)
+        self.current += len(value)
         self.column += len(str(value))
+        return token
 
     def tokenize(self):
-        keywords = {
-            'int': TokenType.INT,
-            'float': TokenType.FLOAT,
-            'bool': TokenType.BOOL,
-            'if': TokenType.IF,
-            'else': TokenType.ELSE,
-            'while': TokenType.WHILE,
-            'return': TokenType.RETURN,
-            'function': TokenType.FUNCTION,
-            'case': TokenType.CASE,
-            'default': TokenType.DEFAULT,
-            'break': TokenType.BREAK,
-            'switch': TokenType.SWITCH,
-            'continue': TokenType.CONTINUE
-        }
+        self.tokens.extend(self.iter_tokens())
+        return self.tokens
+
+    def iter_tokens(self):
+        """Yield tokens lazily, ending with EOF, without building a list"""
+        if self.engine == 'regex':
+            return self.iter_regex_tokens()
+        return self.iter_scan_tokens()
+
+    def iter_regex_tokens(self):
+        """Tokenize with the precompiled master pattern in a single pass"""
+        source = self.source_code
+        keywords = KEYWORDS
+        operators = OPERATORS
+        identifier = TokenType.IDENTIFIER
+        number = TokenType.NUMBER
+        line = self.line
+        line_start = self.current - self.column + 1
+        match = None
+
+        for match in TOKEN_PATTERN.finditer(source, self.current):
+            kind = match.lastgroup
+            if kind == 'IDENTIFIER':
+                value = match.group()
+                yield Token(keywords.get(value, identifier), value, line, match.start() - line_start + 1)
+            elif kind == 'OPERATOR':
+                value = match.group()
+                yield Token(operators[value], value, line, match.start() - line_start + 1)
+            elif kind == 'WHITESPACE':
+                newlines = match.group().count('\n')
+                if newlines:
+                    line += newlines
+                    line_start = source.rindex('\n', match.start(), match.end()) + 1
+            elif kind == 'NUMBER':
+                yield Token(number, match.group(), line, match.start() - line_start + 1)
+            elif kind == 'MISMATCH':
+                raise ValueError(f'Unexpected character: {match.group()} at line {line}, '
+                                 f'column {match.start() - line_start + 1}')
+
+        # Comments do not advance the column, so a trailing comment leaves
+        # the EOF token where the comment started.
+        end = len(source)
+        if match is not None and match.lastgroup == 'COMMENT':
+            end = match.start()
+        self.current = len(source)
+        self.line = line
+        self.column = end - line_start + 1
+        yield Token(TokenType.EOF, '', self.line, self.column)
+
+    def tokenize_compact(self, stop=None):
+        """Tokenize into a TokenArray instead of a list of Token objects.
+
+        Lexing starts at the current position and ends at offset `stop`
+        (default: end of source) with an EOF token placed there.
+        """
+        source = self.source_code
+        if stop is None:
+            stop = len(source)
+        tokens = TokenArray(source)
+        append = tokens.append
+        keywords = KEYWORDS
+        operators = OPERATORS
+        identifier = TokenType.IDENTIFIER
+        number = TokenType.NUMBER
+        line = self.line
+        line_start = self.current - self.column + 1
+        match = None
 
+        for match in TOKEN_PATTERN.finditer(source, self.current, stop):
+            kind = match.lastgroup
+            start, end = match.span()
+            if kind == 'IDENTIFIER':
+                append(keywords.get(match.group(), identifier), start, end - start, line, start - line_start + 1)
+            elif kind == 'OPERATOR':
+                append(operators[match.group()], start, end - start, line, start - line_start + 1)
+            elif kind == 'WHITESPACE':
+                newlines = match.group().count('\n')
+                if newlines:
+                    line += newlines
+                    line_start = source.rindex('\n', start, end) + 1
+            elif kind == 'NUMBER':
+                append(number, start, end - start, line, start - line_start + 1)
+            elif kind == 'MISMATCH':
+                raise ValueError(f'Unexpected character: {match.group()} at line {line}, '
+                                 f'column {start - line_start + 1}')
+
+        end = stop
+        if match is not None and match.lastgroup == 'COMMENT':
+            end = match.start()
+        self.current = stop
+        self.line = line
+        self.column = end - line_start + 1
+        append(TokenType.EOF, self.current, 0, self.line, self.column)
+        return tokens
+
+    def iter_scan_tokens(self):
+        """Tokenize by walking the source one character at a time"""
         while self.current < len(self.source_code):
             char = self.source_code[self.current]
 
@@ -118,77 +324,42 @@ class Lexer:
                 continue
 
             # Handle multi-character operators first
-            if char in '=!<>':
-                matched = self.tokenize_multi_char_operator()
-                if matched:
+            if char in '=!<>&|':
+                token = self.tokenize_multi_char_operator()
+                if token:
+                    yield token
                     continue
 
             # Handle numbers (integers and floats)
             if char.isdigit() or (char == '.' and self.peek().isdigit()):
-                self.tokenize_number()
+                yield self.tokenize_number()
                 continue
 
             # Handle identifiers and keywords
             if char.isalpha() or char == '_':
-                self.tokenize_identifier(keywords)
+                yield self.tokenize_identifier(KEYWORDS)
                 continue
 
             # Handle single character tokens
-            single_char_tokens = {
-                '+': TokenType.PLUS,
-                '-': TokenType.MINUS,
-                '*': TokenType.MULTIPLY,
-                '/': TokenType.DIVIDE,
-                '(': TokenType.LPAREN,
-                ')': TokenType.RPAREN,
-                '{': TokenType.LBRACE,
-                '}': TokenType.RBRACE,
-                '[': TokenType.LBRACKET,
-                ']': TokenType.RBRACKET,
-                ';': TokenType.SEMICOLON,
-                ',': TokenType.COMMA,
-                ':': TokenType.COLON
-            }
-
-            if char in single_char_tokens:
-                self.add_token(single_char_tokens[char])
+            if char in SINGLE_CHAR_TOKENS:
+                yield self.make_token(SINGLE_CHAR_TOKENS[char])
                 continue
 
             raise ValueError(f'Unexpected character: {char} at line {self.line}, column {self.column}')
 
-        self.tokens.append(Token(TokenType.EOF, '', self.line, self.column))
-        return self.tokens
+        yield Token(TokenType.EOF, '', self.line, self.column)
 
     def tokenize_multi_char_operator(self):
         """Handle multi-character operators like ==, !=, <=, >=, &&, ||"""
-        if self.current + 1 < len(self.source_code):
-            two_char = self.source_code[self.current:self.current+2]
-            operators = {
-                '==': TokenType.EQUAL,
-                '!=': TokenType.NOT_EQUAL,
-                '<=': TokenType.LESS_EQUAL,
-                '>=': TokenType.GREATER_EQUAL,
-                '&&': TokenType.AND,
-                '||': TokenType.OR
-            }
-            if two_char in operators:
-                self.add_token(operators[two_char])
-                self.current += 2
-                self.column += 2
-                return True
+        two_char = self.source_code[self.current:self.current+2]
+        if two_char in TWO_CHAR_OPERATORS:
+            return self.make_token(TWO_CHAR_OPERATORS[two_char])
 
         # Handle single character operators if no multi-char match
-        operators = {
-            '=': TokenType.ASSIGN,
-            '<': TokenType.LESS_THAN,
-            '>': TokenType.GREATER_THAN,
-            '!': TokenType.NOT
-        }
-        if self.source_code[self.current] in operators:
-            self.add_token(operators[self.source_code[self.current]])
-            return True
+        if self.source_code[self.current] in ONE_CHAR_OPERATORS:
+            return self.make_token(ONE_CHAR_OPERATORS[self.source_code[self.current]])
         
-        return False
+        return None
 
     def tokenize_number(self):
         """Tokenize integers and floating point numbers"""
@@ -208,7 +379,7 @@ class Lexer:
                 break
 
         value = self.source_code[start:self.current]
-        self.tokens.append(Token(TokenType.NUMBER, value, self.line, self.column - len(value)))
+        return Token(TokenType.NUMBER, value, self.line, self.column - len(value))
 
     def tokenize_identifier(self, keywords):
         """Tokenize identifiers and keywords"""
@@ -223,11 +394,39 @@ class Lexer:
 
         value = self.source_code[start:self.current]
         token_type = keywords.get(value, TokenType.IDENTIFIER)
-        self.tokens.append(Token(token_type, value, self.line, self.column - len(value)))
+        return Token(token_type, value, self.line, self.column - len(value))
 
     def peek(self, distance=1):
         """Look ahead in the source code without consuming characters"""
         peek_pos = self.current + distance
         if peek_pos >= len(self.source_code):
             return '\0'
-        return self.source_code[peek_pos]
\ No newline at end of file
+        return self.source_code[peek_pos]
+
+
+class TokenStream:
+    """Buffered lookahead over a token iterator.
+
+    Only tokens that have been peeked at but not yet consumed are kept, so
+    memory stays bounded by the parser's lookahead instead of the file size.
+    """
+
+    def __init__(self, tokens):
+        self.source = iter(tokens)
+        self.buffer = collections.deque()
+
+    def peek(self, distance=0):
+        """Return the token `distance` places ahead, or None past the end"""
+        buffer = self.buffer
+        while len(buffer) <= distance:
+            token = next(self.source, None)
+            if token is None:
+                return None
+            buffer.append(token)
+        return buffer[distance]
+
+    def advance(self):
+        """Consume and return the current token"""
+        if not self.buffer and self.peek() is None:
+            raise ValueError('Unexpected end of input')
+        return self.buffer.popleft()
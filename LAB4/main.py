@@ -1,9 +1,10 @@
 from lexer import Lexer
+from optimizer import Optimizer
 from parser import compile_source
+from ssa import eliminate_redundancy
 
-def main():
-    # Sample source code
-    source_code = """
+# Sample source code
+SAMPLE_SOURCE = """
     function expressions() {
     int a = 10, b = 20;
     float c = 3.5;
@@ -24,16 +25,29 @@ def main():
     // Function call
     int z = factorial(a);
     }
-    """
+"""
+
+
+def main():
+    source_code = SAMPLE_SOURCE
 
     
     print("Source Code:")
     print(source_code)
     
     print("\nThree-Address Codes:")
-    three_address_codes = compile_source(source_code)
+    warnings = []
+    three_address_codes = compile_source(source_code, warnings)
     for code in three_address_codes:
         print(code)
+    for warning in warnings:
+        print(f"Warning: {warning}")
+
+    optimizer = Optimizer()
+    optimized_codes = optimizer.run(eliminate_redundancy(three_address_codes))
+    print(f"\nOptimized Three-Address Codes ({optimizer.before} -> {optimizer.after} instructions):")
+    for code in optimized_codes:
+        print(code)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,102 @@
+"""Measure bytes per token and per AST node for each representation.
+
+Usage: python3 memory_report.py [file.sk ...]
+
+The "before" rows swap the old __dict__-based classes back into the lexer
+and parser modules, so every row is measured on the same code path.
+"""
+import sys
+import tracemalloc
+
+import lexer
+import parser
+from lexer import Lexer
+from parser import Parser
+
+original_token = lexer.Token
+original_node = parser.ASTNode
+
+
+class DictToken:
+    def __init__(self, type, value, line=0, column=0):
+        self.type = type
+        self.value = value
+        self.line = line
+        self.column = column
+
+
+class DictASTNode:
+    def __init__(self, type, value=None, left=None, right=None):
+        self.type = type
+        self.value = value
+        self.left = left
+        self.right = right
+        self.children = []
+
+    def add_child(self, child):
+        self.children.append(child)
+
+
+def measure(build):
+    """Return (result, bytes still allocated after build())"""
+    tracemalloc.start()
+    result = build()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, allocated
+
+
+def count_nodes(root):
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            continue
+        count += 1
+        stack.append(node.left)
+        stack.append(node.right)
+        stack.extend(node.children)
+    return count
+
+
+def report(source_code):
+    rows = []
+
+    lexer.Token = DictToken
+    tokens, size = measure(lambda: Lexer(source_code).tokenize())
+    lexer.Token = original_token
+    rows.append(('Token (__dict__, before)', size, len(tokens)))
+    del tokens
+
+    tokens, size = measure(lambda: Lexer(source_code).tokenize())
+    rows.append(('Token (__slots__)', size, len(tokens)))
+
+    compact, size = measure(lambda: Lexer(source_code).tokenize_compact())
+    rows.append(('TokenArray', size, len(compact)))
+
+    parser.ASTNode = DictASTNode
+    ast, size = measure(lambda: Parser(tokens).parse())
+    parser.ASTNode = original_node
+    rows.append(('ASTNode (__dict__ + list, before)', size, count_nodes(ast)))
+    del ast
+
+    ast, size = measure(lambda: Parser(tokens).parse())
+    rows.append(('ASTNode (__slots__)', size, count_nodes(ast)))
+
+    return rows
+
+
+def main(paths):
+    if paths:
+        source_code = '\n'.join(open(path).read() for path in paths)
+    else:
+        source_code = '\n'.join([open('t2.sk').read()] * 500)
+
+    print(f'{"representation":<36}{"count":>10}{"bytes":>14}{"bytes/item":>12}')
+    for name, size, count in report(source_code):
+        print(f'{name:<36}{count:>10}{size:>14}{size / count:>12.1f}')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
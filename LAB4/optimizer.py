@@ -0,0 +1,251 @@
+"""Peephole and local optimizations over three-address code.
+
+    code = compile_source(source)
+    optimizer = Optimizer()
+    code = optimizer.run(code)
+    print(optimizer.before, '->', optimizer.after)
+
+Each pass takes a list of Instruction objects and returns the rewritten
+list and whether it changed anything.  Optimizer.run applies the passes
+in order, repeating the whole pipeline until none of them makes progress,
+since removing a jump often exposes work for another pass.
+"""
+from parser import NEGATED_COMPARISONS
+from tac import (JUMPS, NAME, NO_OPERAND, OPERATOR_INDEX, TYPE_PREFIXES, Op, QuadBuffer, VALUE_DEFINITIONS,
+                 is_temp, operand_kind, typed_operator)
+
+# Instructions that begin a new basic block.
+BLOCK_STARTS = (Op.LABEL, Op.FUNCTION, Op.END_FUNCTION)
+# Instructions after which control never falls through.
+UNCONDITIONAL = (Op.GOTO, Op.RETURN, Op.JUMP_TABLE)
+NEGATED_OPERATORS = {}
+for operator, negated in NEGATED_COMPARISONS.items():
+    NEGATED_OPERATORS[OPERATOR_INDEX[operator]] = OPERATOR_INDEX[negated]
+    for type in TYPE_PREFIXES:
+        NEGATED_OPERATORS[typed_operator(operator, type)] = typed_operator(negated, type)
+
+
+def next_real(instructions, index):
+    """Index of the first instruction at or after `index` that is not a label"""
+    while index < len(instructions) and instructions[index].op == Op.LABEL:
+        index += 1
+    return index
+
+
+def merge_labels(instructions):
+    """Collapse runs of adjacent labels into the first one"""
+    alias = {}
+    kept = []
+    for instruction in instructions:
+        if instruction.op == Op.LABEL and kept and kept[-1].op == Op.LABEL:
+            alias[instruction.target] = kept[-1].target
+            continue
+        kept.append(instruction)
+    if not alias:
+        return instructions, False
+    for instruction in kept:
+        if instruction.op in JUMPS:
+            instruction.retarget(alias)
+    return kept, True
+
+
+def thread_jumps(instructions):
+    """Retarget jumps to a label that is followed by `goto M` straight to M"""
+    forward = {}
+    for index, instruction in enumerate(instructions):
+        if instruction.op == Op.LABEL:
+            following = next_real(instructions, index + 1)
+            if following < len(instructions) and instructions[following].op == Op.GOTO:
+                forward[instruction.target] = instructions[following].target
+
+    def resolve(label):
+        seen = {label}
+        while label in forward and forward[label] not in seen:
+            label = forward[label]
+            seen.add(label)
+        return label
+
+    changed = False
+    for instruction in instructions:
+        if instruction.op in JUMPS:
+            mapping = {}
+            for label in instruction.labels():
+                if label in forward and resolve(label) != label:
+                    mapping[label] = resolve(label)
+            if mapping:
+                instruction.retarget(mapping)
+                changed = True
+    return instructions, changed
+
+
+def invert_branches(instructions):
+    """Rewrite `if c goto L1; goto L2; label L1` as `if !c goto L2; label L1`"""
+    kept = []
+    index = 0
+    while index < len(instructions):
+        instruction = instructions[index]
+        if (instruction.op == Op.IF_GOTO and index + 2 < len(instructions)
+                and instructions[index + 1].op == Op.GOTO
+                and instructions[index + 2].op == Op.LABEL
+                and instructions[index + 2].target == instruction.target):
+            instruction.operator = NEGATED_OPERATORS[instruction.operator]
+            instruction.target = instructions[index + 1].target
+            kept.append(instruction)
+            index += 2
+            continue
+        kept.append(instruction)
+        index += 1
+    return kept, len(kept) != len(instructions)
+
+
+def remove_jumps_to_next(instructions):
+    """Drop jumps whose target label is reached by falling through anyway"""
+    kept = []
+    for index, instruction in enumerate(instructions):
+        if instruction.op == Op.GOTO or instruction.op == Op.IF_GOTO:
+            following = index + 1
+            while following < len(instructions) and instructions[following].op == Op.LABEL:
+                if instructions[following].target == instruction.target:
+                    break
+                following += 1
+            else:
+                kept.append(instruction)
+            continue
+        kept.append(instruction)
+    return kept, len(kept) != len(instructions)
+
+
+def remove_dead_code(instructions):
+    """Drop unreferenced labels and code that follows a goto or return"""
+    referenced = {label for instruction in instructions if instruction.op in JUMPS
+                  for label in instruction.labels()}
+    kept = []
+    reachable = True
+    for instruction in instructions:
+        op = instruction.op
+        if op == Op.LABEL:
+            if instruction.target not in referenced:
+                continue
+            reachable = True
+        elif op == Op.FUNCTION or op == Op.END_FUNCTION:
+            reachable = True
+        if not reachable:
+            continue
+        kept.append(instruction)
+        if op in UNCONDITIONAL:
+            reachable = False
+    return kept, len(kept) != len(instructions)
+
+
+def propagate_copies(instructions):
+    """Replace uses of `x = y` copies with `y` until x or y is reassigned.
+
+    Local to each basic block.  A call may assign any named variable, so
+    it forgets every copy that involves a name.
+    """
+    copies = {}
+    # Source operand -> destinations currently copied from it.
+    sources = {}
+    changed = False
+
+    def forget(operand):
+        source = copies.pop(operand, None)
+        if source is not None:
+            destinations = sources[source]
+            destinations.discard(operand)
+            if not destinations:
+                del sources[source]
+        for destination in sources.pop(operand, ()):
+            del copies[destination]
+
+    for instruction in instructions:
+        op = instruction.op
+        if op in BLOCK_STARTS:
+            copies.clear()
+            sources.clear()
+        if copies and instruction.replace_uses(copies):
+            changed = True
+        if op == Op.CALL:
+            for destination in [destination for destination, source in copies.items()
+                                if operand_kind(destination) == NAME or operand_kind(source) == NAME]:
+                forget(destination)
+        defined = instruction.defined()
+        if defined != NO_OPERAND:
+            forget(defined)
+            if op == Op.COPY and instruction.arg1 != defined:
+                copies[defined] = instruction.arg1
+                sources.setdefault(instruction.arg1, set()).add(defined)
+        if op in JUMPS or op == Op.RETURN:
+            copies.clear()
+            sources.clear()
+    return instructions, changed
+
+
+def count_temps(instructions):
+    """Number of definitions and uses of every temp"""
+    definitions = {}
+    uses = {}
+    for instruction in instructions:
+        defined = instruction.defined()
+        if is_temp(defined):
+            definitions[defined] = definitions.get(defined, 0) + 1
+        for operand in instruction.uses():
+            if is_temp(operand):
+                uses[operand] = uses.get(operand, 0) + 1
+    return definitions, uses
+
+
+def coalesce_copies(instructions):
+    """Fold `t = a op b; x = t` into `x = a op b` when t is used only there"""
+    definitions, uses = count_temps(instructions)
+    kept = []
+    for instruction in instructions:
+        if (instruction.op == Op.COPY and is_temp(instruction.arg1) and kept
+                and kept[-1].op in VALUE_DEFINITIONS and kept[-1].result == instruction.arg1
+                and definitions[instruction.arg1] == 1 and uses[instruction.arg1] == 1):
+            kept[-1].result = instruction.result
+            continue
+        kept.append(instruction)
+    return kept, len(kept) != len(instructions)
+
+
+def remove_dead_temps(instructions):
+    """Drop side-effect-free instructions whose temp result is never read"""
+    _, uses = count_temps(instructions)
+    kept = [instruction for instruction in instructions
+            if not (instruction.op in VALUE_DEFINITIONS and instruction.op != Op.CALL
+                    and is_temp(instruction.result) and instruction.result not in uses)]
+    return kept, len(kept) != len(instructions)
+
+
+PASSES = (merge_labels, thread_jumps, invert_branches, remove_jumps_to_next, remove_dead_code,
+          propagate_copies, coalesce_copies, remove_dead_temps)
+
+
+class Optimizer:
+    def __init__(self, passes=PASSES, max_rounds=10):
+        self.passes = passes
+        self.max_rounds = max_rounds
+        self.before = 0
+        self.after = 0
+        self.rounds = 0
+
+    def run(self, code):
+        """Return an optimized copy of the QuadBuffer `code`"""
+        instructions = code.instructions()
+        self.before = len(instructions)
+        self.rounds = 0
+        while self.rounds < self.max_rounds:
+            self.rounds += 1
+            progress = False
+            for optimization in self.passes:
+                instructions, changed = optimization(instructions)
+                progress = progress or changed
+            if not progress:
+                break
+        self.after = len(instructions)
+        return QuadBuffer.from_instructions(instructions, code.strings)
+
+
+def optimize(code):
+    return Optimizer().run(code)
@@ -1,5 +1,30 @@
-from lexer import Lexer, TokenType
+from lexer import Lexer, TokenStream, TokenType
+from symbols import ARRAY, VARIABLE, SymbolTable
+from tac import (BOOLEAN_LITERALS, CONST, NO_OPERAND, OPERATOR_INDEX, Op, QuadBuffer, operand_kind, temp_operand,
+                 typed_operator)
 import enum
+import math
+from decimal import Decimal
+from types import GeneratorType, MethodType
+
+EQUALS = OPERATOR_INDEX['==']
+INT, FLOAT, BOOL = 'int', 'float', 'bool'
+NUMERIC = (INT, FLOAT)
+# Initial element value of a declared array, by element type.
+ARRAY_FILL = {'int': '0', 'float': '0.0', 'bool': 'false'}
+# Switch lowering: a jump table when at least TABLE_MIN_CASES distinct int
+# cases fill at least TABLE_DENSITY of their range, else a binary search
+# over at least SEARCH_MIN_CASES cases, else a chain of equality tests.
+TABLE_DENSITY = 0.5
+TABLE_MIN_CASES = 4
+SEARCH_MIN_CASES = 6
+# Cases tested one by one at the leaves of a binary search.
+SEARCH_LEAF_CASES = 3
+NEGATED_COMPARISONS = {
+    '==': '!=', '!=': '==',
+    '<': '>=', '>=': '<',
+    '>': '<=', '<=': '>'
+}
 
 
 class NodeType(enum.Enum):
@@ -27,233 +52,1100 @@ class NodeType(enum.Enum):
     PARAMETERS = 'PARAMETERS'
     FUNCTION_PARAM = 'FUNCTION_PARAM'
 
+# Binary operators by token: (precedence, node type).  Unary `!` and `-`
+# bind tighter than all of them.
+BINARY_OPERATORS = {
+    TokenType.AND: (1, NodeType.LOGICAL_OPERATION),
+    TokenType.OR: (1, NodeType.LOGICAL_OPERATION),
+    TokenType.EQUAL: (2, NodeType.COMPARISON_OPERATION),
+    TokenType.NOT_EQUAL: (2, NodeType.COMPARISON_OPERATION),
+    TokenType.LESS_THAN: (2, NodeType.COMPARISON_OPERATION),
+    TokenType.GREATER_THAN: (2, NodeType.COMPARISON_OPERATION),
+    TokenType.LESS_EQUAL: (2, NodeType.COMPARISON_OPERATION),
+    TokenType.GREATER_EQUAL: (2, NodeType.COMPARISON_OPERATION),
+    TokenType.PLUS: (3, NodeType.BINARY_OPERATION),
+    TokenType.MINUS: (3, NodeType.BINARY_OPERATION),
+    TokenType.MULTIPLY: (4, NodeType.BINARY_OPERATION),
+    TokenType.DIVIDE: (4, NodeType.BINARY_OPERATION)
+}
+UNARY_OPERATORS = (TokenType.NOT, TokenType.MINUS)
+UNARY_PRECEDENCE = 5
+
 class ASTNode:
+    __slots__ = ('type', 'value', 'left', 'right', 'children')
+
     def __init__(self, type, value=None, left=None, right=None):
         self.type = type
         self.value = value
         self.left = left
         self.right = right
-        self.children = []
+        # Leaves share one empty tuple; a list is only allocated on the
+        # first add_child call.
+        self.children = ()
+
+    def add_child(self, child):
+        if not self.children:
+            self.children = [child]
+        else:
+            self.children.append(child)
+
+
+def drive(visit, node):
+    """Run the handler `visit(node)` returns and the ones it asks for.
+
+    Handlers are generators: they yield the child nodes (or nested
+    generators) they need and are resumed with the result.  This loop
+    drives them from an explicit stack, so nesting depth is bounded by
+    memory rather than by the Python recursion limit.  Leaf handlers
+    return their result directly.
+    """
+    value = visit(node)
+    if not isinstance(value, GeneratorType):
+        return value
+
+    stack = [value]
+    value = None
+    while stack:
+        try:
+            request = stack[-1].send(value)
+        except StopIteration as done:
+            stack.pop()
+            value = done.value
+            continue
+        value = request if isinstance(request, GeneratorType) else visit(request)
+        if isinstance(value, GeneratorType):
+            stack.append(value)
+            value = None
+    return value
+
 
 class ThreeAddressCodeGenerator:
-    def __init__(self):
+    # Handler method for each node type; types not listed here fall back
+    # to generate_children.  Subclasses may override the methods, and
+    # register_handler() swaps handlers on a single instance.
+    HANDLERS = {
+        NodeType.NUMBER: 'generate_number',
+        NodeType.IDENTIFIER: 'generate_identifier',
+        NodeType.BINARY_OPERATION: 'generate_binary_operation',
+        NodeType.UNARY_OPERATION: 'generate_unary_operation',
+        NodeType.COMPARISON_OPERATION: 'generate_comparison_operation',
+        NodeType.LOGICAL_OPERATION: 'generate_logical_operation',
+        NodeType.ASSIGNMENT: 'generate_assignment',
+        NodeType.ARRAY_ACCESS: 'generate_array_access',
+        NodeType.FUNCTION_CALL: 'generate_function_call',
+        NodeType.IF_STATEMENT: 'generate_if_statement',
+        NodeType.WHILE_STATEMENT: 'generate_while_statement',
+        NodeType.SWITCH_STATEMENT: 'generate_switch_statement',
+        NodeType.BREAK_STATEMENT: 'generate_break_statement',
+        NodeType.CONTINUE_STATEMENT: 'generate_continue_statement',
+        NodeType.RETURN_STATEMENT: 'generate_return_statement',
+        NodeType.FUNCTION_DECLARATION: 'generate_function_declaration',
+        NodeType.VARIABLE_DECLARATION: 'generate_variable_declaration',
+        NodeType.ARRAY_DECLARATION: 'generate_array_declaration',
+        NodeType.PROGRAM: 'generate_block'
+    }
+
+    def __init__(self, table_density=TABLE_DENSITY, table_min_cases=TABLE_MIN_CASES,
+                 search_min_cases=SEARCH_MIN_CASES):
         self.temp_counter = 0
         self.label_counter = 0
-        self.code = []
-        self.symbol_table = {}
-        self.pending_jumps = {}
+        self.table_density = table_density
+        self.table_min_cases = table_min_cases
+        self.search_min_cases = search_min_cases
+        self.code = QuadBuffer()
+        self.symbol_table = SymbolTable()
+        # id(expression node) -> 'int', 'float', 'bool' or None, from the
+        # TypeChecker; typed operators are emitted where both operands
+        # have a numeric type.
+        self.types = {}
+        self.warnings = []
+        # Jump lists for `break` (one per enclosing loop/switch) and the
+        # label `continue` jumps to (one per enclosing loop).
+        self.break_lists = []
+        self.continue_labels = []
+        self.handlers = self.handler_table()
 
     def new_temp(self):
         self.temp_counter += 1
-        return f't{self.temp_counter}'
+        return temp_operand(self.temp_counter)
 
     def new_label(self):
         self.label_counter += 1
-        return f'L{self.label_counter}'
+        return self.label_counter
 
-    def backpatch(self, label, locations):
+    def backpatch(self, locations, label):
+        """Point every jump in `locations` at `label` and release the list"""
         for loc in locations:
-            if '?' in self.code[loc]:
-                self.code[loc] = self.code[loc].replace('?', label)
+            self.code.patch(loc, label)
+        locations.clear()
+
+    def merge(self, first, second):
+        """Concatenate two jump lists, extending the longer one in place"""
+        if len(first) < len(second):
+            first, second = second, first
+        first.extend(second)
+        return first
+
+    def place_label(self, locations, label=None):
+        """Emit `label` (default a fresh one) here and backpatch `locations` to it"""
+        if label is None:
+            label = self.new_label()
+        self.backpatch(locations, label)
+        self.code.emit(Op.LABEL, target=label)
+        return label
+
+    def generate_condition(self, node, sense):
+        """Emit jumping code for a condition.
+
+        Control falls through when the condition is not `sense`; the
+        returned list holds the unfilled jumps taken when it is.
+        """
+        code = self.code
+
+        if node.type == NodeType.LOGICAL_OPERATION:
+            # `a && b` is false as soon as `a` is, `a || b` is true as
+            # soon as `a` is; those jumps merge with the ones from `b`.
+            short_circuit = node.value == '||'
+            if sense == short_circuit:
+                left_jumps = yield self.generate_condition(node.left, sense)
+                right_jumps = yield self.generate_condition(node.right, sense)
+                return self.merge(left_jumps, right_jumps)
+            skip = yield self.generate_condition(node.left, short_circuit)
+            holes = yield self.generate_condition(node.right, sense)
+            self.place_label(skip)
+            return holes
+
+        if node.type == NodeType.UNARY_OPERATION and node.value == '!':
+            return (yield self.generate_condition(node.left, not sense))
+
+        if node.type == NodeType.COMPARISON_OPERATION:
+            left_temp = yield node.left
+            right_temp = yield node.right
+            operator = node.value if sense else NEGATED_COMPARISONS[node.value]
+            left_temp, right_temp, operator = self.compare(node, left_temp, right_temp, operator)
+            return [code.emit(Op.IF_GOTO, arg1=left_temp, arg2=right_temp, operator=operator)]
+
+        value_temp = yield node
+        truth = code.const('true' if sense else 'false')
+        return [code.emit(Op.IF_GOTO, arg1=value_temp, arg2=truth, operator=EQUALS)]
+
+    def type_of(self, node):
+        return self.types.get(id(node))
+
+    def convert(self, operand, source, target, result=None):
+        """`operand`, of type `source` (None if unknown), as a `target` value.
+
+        Writes into `result` if given (a plain copy if no conversion is
+        needed), else into a new temp when a conversion is emitted.
+        """
+        code = self.code
+        operator = None
+        if target in NUMERIC and source != target and source != BOOL:
+            operator = OPERATOR_INDEX['itof' if target == FLOAT else 'ftoi']
+            if operand_kind(operand) == CONST:
+                spelling = converted_constant(code.operand_text(operand), target)
+                if spelling is not None:
+                    operand = code.const(spelling)
+                    operator = None
+        if operator is None:
+            if result is not None:
+                code.emit(Op.COPY, result, operand)
+                return result
+            return operand
+        if result is None:
+            result = self.new_temp()
+        code.emit(Op.UNARY, result, operand, operator=operator)
+        return result
+
+    def compare(self, node, left, right, operator):
+        """Operands and operator index for `left operator right`, typed if both are numbers"""
+        left_type, right_type = self.type_of(node.left), self.type_of(node.right)
+        if left_type in NUMERIC and right_type in NUMERIC:
+            common = FLOAT if FLOAT in (left_type, right_type) else INT
+            return (self.convert(left, left_type, common), self.convert(right, right_type, common),
+                    typed_operator(operator, common))
+        return left, right, OPERATOR_INDEX[operator]
 
     def generate_code(self, node):
+        """Generate code for `node` and return the operand holding its value.
+
+        A TypeChecker runs over `node` first; it raises ValueError for
+        ill-typed code, and its warnings are kept in self.warnings.
+        Handlers run through drive().
+        """
+        checker = TypeChecker()
+        self.types = checker.check(node)
+        self.warnings = checker.warnings
+        return drive(self.visit, node)
+
+    def visit(self, node):
+        """Dispatch `node` to its handler.
+
+        Leaf handlers return an operand directly; the rest return a
+        generator for generate_code to drive.
+        """
         if not node:
-            return None
+            return NO_OPERAND
+        return self.handlers[node.type](node)
 
-        if node.type == NodeType.BINARY_OPERATION:
-            left_temp = self.generate_code(node.left)
-            right_temp = self.generate_code(node.right)
-            result_temp = self.new_temp()
-            self.code.append(f'{result_temp} = {left_temp} {node.value} {right_temp}')
-            return result_temp
+    def handler_table(self):
+        """Map every NodeType to this generator's bound handler method"""
+        table = {node_type: self.generate_children for node_type in NodeType}
+        for node_type, name in self.HANDLERS.items():
+            table[node_type] = getattr(self, name)
+        return table
 
-        if node.type == NodeType.UNARY_OPERATION:
-            operand_temp = self.generate_code(node.left)
-            result_temp = self.new_temp()
-            self.code.append(f'{result_temp} = {node.value}{operand_temp}')
-            return result_temp
+    def register_handler(self, node_type, handler):
+        """Install `handler(generator, node)` for `node_type` on this generator"""
+        self.handlers[node_type] = MethodType(handler, self)
 
-        if node.type == NodeType.COMPARISON_OPERATION:
-            left_temp = self.generate_code(node.left)
-            right_temp = self.generate_code(node.right)
-            result_temp = self.new_temp()
-            self.code.append(f'{result_temp} = {left_temp} {node.value} {right_temp}')
-            return result_temp
+    def generate_number(self, node):
+        return self.code.const(node.value)
 
-        if node.type == NodeType.LOGICAL_OPERATION:
-            left_temp = self.generate_code(node.left)
-            false_label = self.new_label()
-            end_label = self.new_label()
-            
-            if node.value == '&&':
-                loc = len(self.code)
-                self.code.append(f'if {left_temp} == false goto ?')
-                self.pending_jumps.setdefault(false_label, []).append(loc)
-                right_temp = self.generate_code(node.right)
-                result_temp = self.new_temp()
-                self.code.append(f'{result_temp} = {right_temp}')
-                self.code.append(f'goto {end_label}')
-                self.backpatch(false_label, self.pending_jumps[false_label])
-                self.code.append(f'label {false_label}')
-                self.code.append(f'{result_temp} = false')
-                self.code.append(f'label {end_label}')
-                return result_temp
-            else:  # OR operation
-                true_label = self.new_label()
-                loc = len(self.code)
-                self.code.append(f'if {left_temp} == true goto ?')
-                self.pending_jumps.setdefault(true_label, []).append(loc)
-                right_temp = self.generate_code(node.right)
-                result_temp = self.new_temp()
-                self.code.append(f'{result_temp} = {right_temp}')
-                self.code.append(f'goto {end_label}')
-                self.backpatch(true_label, self.pending_jumps[true_label])
-                self.code.append(f'label {true_label}')
-                self.code.append(f'{result_temp} = true')
-                self.code.append(f'label {end_label}')
-                return result_temp
-
-        if node.type == NodeType.ASSIGNMENT:
-            value_temp = self.generate_code(node.right)
-            if node.left.type == NodeType.ARRAY_ACCESS:
-                index_temp = self.generate_code(node.left.left)
-                self.code.append(f'{node.left.value}[{index_temp}] = {value_temp}')
-            else:
-                self.code.append(f'{node.left.value} = {value_temp}')
-            return node.left.value
+    def generate_identifier(self, node):
+        if node.value in BOOLEAN_LITERALS:
+            return self.code.const(node.value)
+        return self.code.name(self.symbol_table.resolve(node.value).unique)
 
-        if node.type == NodeType.IF_STATEMENT:
-            condition_temp = self.generate_code(node.left)
-            false_label = self.new_label()
-            end_label = self.new_label()
-            
-            # If condition false, jump to else/false_label
-            loc = len(self.code)
-            self.code.append(f'if {condition_temp} == false goto ?')
-            self.pending_jumps.setdefault(false_label, []).append(loc)
-            
-            # Generate true block
-            self.generate_code(node.right)
-            
-            # If there's an else, jump over it
-            if len(node.children) > 0:
-                self.code.append(f'goto {end_label}')
-            
-            # Backpatch the false label
-            self.backpatch(false_label, self.pending_jumps[false_label])
-            self.code.append(f'label {false_label}')
-            
-            # Generate else block if exists
-            if len(node.children) > 0:
-                self.generate_code(node.children[0])
-                self.code.append(f'label {end_label}')
-            
-            return None
+    def generate_binary_operation(self, node):
+        code = self.code
+        left_temp = yield node.left
+        right_temp = yield node.right
+        result_type = self.type_of(node)
+        operator = OPERATOR_INDEX[node.value]
+        if result_type in NUMERIC:
+            left_temp = self.convert(left_temp, self.type_of(node.left), result_type)
+            right_temp = self.convert(right_temp, self.type_of(node.right), result_type)
+            operator = typed_operator(node.value, result_type)
+        result_temp = self.new_temp()
+        code.emit(Op.BINARY, result_temp, left_temp, right_temp, operator)
+        return result_temp
 
-        if node.type == NodeType.WHILE_STATEMENT:
-            start_label = self.new_label()
-            condition_label = self.new_label()
-            end_label = self.new_label()
-            
-            self.code.append(f'label {start_label}')
-            self.code.append(f'goto {condition_label}')
-            self.code.append(f'label {condition_label}')
-            
-            condition_temp = self.generate_code(node.left)
-            loc = len(self.code)
-            self.code.append(f'if {condition_temp} == false goto ?')
-            self.pending_jumps.setdefault(end_label, []).append(loc)
-            
-            self.generate_code(node.right)
-            self.code.append(f'goto {start_label}')
-            self.code.append(f'label {end_label}')
-            
-            return None
+    def generate_unary_operation(self, node):
+        code = self.code
+        operand_temp = yield node.left
+        result_type = self.type_of(node)
+        operator = OPERATOR_INDEX[node.value]
+        if node.value == '-' and result_type in NUMERIC:
+            operator = typed_operator('-', result_type, unary=True)
+        result_temp = self.new_temp()
+        code.emit(Op.UNARY, result_temp, operand_temp, operator=operator)
+        return result_temp
+
+    def generate_comparison_operation(self, node):
+        code = self.code
+        left_temp = yield node.left
+        right_temp = yield node.right
+        left_temp, right_temp, operator = self.compare(node, left_temp, right_temp, node.value)
+        result_temp = self.new_temp()
+        code.emit(Op.BINARY, result_temp, left_temp, right_temp, operator)
+        return result_temp
+
+    def generate_logical_operation(self, node):
+        code = self.code
+        # Materialize the jumping code as a boolean value.
+        false_jumps = yield self.generate_condition(node, False)
+        result_temp = self.new_temp()
+        end_label = self.new_label()
+        code.emit(Op.COPY, result_temp, code.const('true'))
+        code.emit(Op.GOTO, target=end_label)
+        self.place_label(false_jumps)
+        code.emit(Op.COPY, result_temp, code.const('false'))
+        code.emit(Op.LABEL, target=end_label)
+        return result_temp
+
+    def generate_variable_declaration(self, node):
+        code = self.code
+        # The name is in scope from its declarator on, as in C.
+        symbol = self.symbol_table.declare(node.children[0].value, VARIABLE, node.value)
+        if len(node.children) < 2:
+            return NO_OPERAND
+        value_temp = yield node.children[1]
+        return self.convert(value_temp, self.type_of(node.children[1]), symbol.type, code.name(symbol.unique))
+
+    def generate_array_declaration(self, node):
+        code = self.code
+        name_node, size_node = node.children[:2]
+        if len(node.children) - 2 > float(size_node.value):
+            raise ValueError(f'Too many initializers for array {name_node.value}[{size_node.value}]')
+        symbol = self.symbol_table.declare(name_node.value, ARRAY, node.value, int(float(size_node.value)))
+        target = code.name(symbol.unique)
+        code.emit(Op.ARRAY, target, code.const(size_node.value), code.const(ARRAY_FILL[node.value]))
+        for index, element in enumerate(node.children[2:]):
+            value_temp = yield element
+            value_temp = self.convert(value_temp, self.type_of(element), symbol.type)
+            code.emit(Op.STORE, target, code.const(str(index)), value_temp)
+        return target
 
-        if node.type == NodeType.SWITCH_STATEMENT:
-            expr_temp = self.generate_code(node.left)
+    def generate_assignment(self, node):
+        code = self.code
+        value_temp = yield node.right
+        symbol = self.symbol_table.resolve(node.left.value)
+        target = code.name(symbol.unique)
+        if node.left.type == NodeType.ARRAY_ACCESS:
+            element_type = symbol.type if symbol.kind == ARRAY else None
+            value_temp = self.convert(value_temp, self.type_of(node.right), element_type)
+            index_temp = yield node.left.left
+            code.emit(Op.STORE, target, index_temp, value_temp)
+            return target
+        return self.convert(value_temp, self.type_of(node.right), symbol.type, target)
+
+    def generate_if_statement(self, node):
+        code = self.code
+        # If condition false, jump to else/false label
+        false_jumps = yield self.generate_condition(node.left, False)
+
+        # Generate true block
+        yield node.right
+
+        if len(node.children) > 0:
+            # Jump over the else block
             end_label = self.new_label()
-            case_labels = []
-            
-            for case_node in node.children:
-                if case_node.type == NodeType.CASE_STATEMENT:
-                    case_label = self.new_label()
-                    case_labels.append(case_label)
-                    case_value = self.generate_code(case_node)
-                    loc = len(self.code)
-                    self.code.append(f'if {expr_temp} == {case_value} goto ?')
-                    self.pending_jumps.setdefault(case_label, []).append(loc)
-            
-            # Default case if exists
-            default_label = None
-            if len(node.children) > len(case_labels):
-                default_label = self.new_label()
-                self.code.append(f'goto {default_label}')
-            
-            # Generate case blocks
-            for i, case_node in enumerate(node.children):
-                if case_node.type == NodeType.CASE_STATEMENT:
-                    self.backpatch(case_labels[i], self.pending_jumps[case_labels[i]])
-                    self.code.append(f'label {case_labels[i]}')
-                    self.generate_code(case_node.children[0])
-                    self.code.append(f'goto {end_label}')
-                elif case_node.type == NodeType.DEFAULT_CASE:
-                    if default_label:
-                        self.code.append(f'label {default_label}')
-                        self.generate_code(case_node.children[0])
-            
-            self.code.append(f'label {end_label}')
+            code.emit(Op.GOTO, target=end_label)
+            self.place_label(false_jumps)
+            yield node.children[0]
+            code.emit(Op.LABEL, target=end_label)
+        else:
+            self.place_label(false_jumps)
+
+        return NO_OPERAND
+
+    def generate_while_statement(self, node):
+        code = self.code
+        start_label = self.new_label()
+        condition_label = self.new_label()
+
+        code.emit(Op.LABEL, target=start_label)
+        code.emit(Op.GOTO, target=condition_label)
+        code.emit(Op.LABEL, target=condition_label)
+
+        exit_jumps = yield self.generate_condition(node.left, False)
+
+        self.break_lists.append(exit_jumps)
+        self.continue_labels.append(start_label)
+        yield node.right
+        self.continue_labels.pop()
+        self.break_lists.pop()
+
+        code.emit(Op.GOTO, target=start_label)
+        self.place_label(exit_jumps)
+
+        return NO_OPERAND
+
+    def generate_switch_statement(self, node):
+        code = self.code
+        expr_temp = yield node.left
+        cases = [case_node for case_node in node.children if case_node.type == NodeType.CASE_STATEMENT]
+        case_jumps = [[] for _ in cases]
+        case_labels = [None] * len(cases)
+        # Jumps taken when no case matches
+        missed = []
+
+        subject_type = self.type_of(node.left)
+        entries = self.switch_entries(subject_type, cases)
+        if entries is not None and self.use_jump_table(subject_type, entries):
+            self.generate_jump_table(expr_temp, entries, case_labels, missed)
+        elif entries is not None and len(entries) >= self.search_min_cases:
+            self.generate_case_search(expr_temp, subject_type, entries, case_jumps, missed)
+        else:
+            self.generate_case_chain(expr_temp, subject_type, cases, case_jumps, missed)
+
+        # Default case if exists, otherwise no match leaves the switch
+        default_jumps = []
+        end_jumps = []
+        if len(node.children) > len(cases):
+            default_jumps = missed
+        else:
+            end_jumps = missed
+
+        # Generate case blocks
+        self.break_lists.append(end_jumps)
+        i = 0
+        for case_node in node.children:
+            if case_node.type == NodeType.CASE_STATEMENT:
+                self.place_label(case_jumps[i], case_labels[i])
+                yield case_node.children[0]
+                end_jumps.append(code.emit(Op.GOTO))
+                i += 1
+            elif case_node.type == NodeType.DEFAULT_CASE:
+                self.place_label(default_jumps)
+                yield case_node.children[0]
+        self.break_lists.pop()
+
+        self.place_label(end_jumps)
+        return NO_OPERAND
+
+    def switch_entries(self, subject_type, cases):
+        """Sorted (value, constant spelling, case index) of each distinct case value.
+
+        None unless the subject is numeric and every case a literal that
+        compares in its domain, so the cases can be ordered; an int subject
+        with a float case keeps the chain, which compares as floats.
+        """
+        if subject_type not in NUMERIC:
             return None
+        entries = {}
+        for i, case_node in enumerate(cases):
+            case_type = literal_type(case_node.value)
+            if case_type is None or (subject_type == INT and case_type == FLOAT):
+                return None
+            spelling = case_node.value
+            if subject_type == FLOAT:
+                spelling = converted_constant(spelling, FLOAT)
+                if spelling is None:
+                    return None
+                value = float(spelling)
+            else:
+                value = int(spelling)
+            # The first of several equal cases is the one a chain would take.
+            if value not in entries:
+                entries[value] = (value, spelling, i)
+        return sorted(entries.values())
+
+    def use_jump_table(self, subject_type, entries):
+        if subject_type != INT or len(entries) < self.table_min_cases:
+            return False
+        span = entries[-1][0] - entries[0][0] + 1
+        return len(entries) >= self.table_density * span
+
+    def generate_jump_table(self, subject, entries, case_labels, missed):
+        """`goto table[subject - min]`; holes and out-of-range values miss"""
+        code = self.code
+        low = entries[0][0]
+        index = subject
+        if low != 0:
+            index = self.new_temp()
+            code.emit(Op.BINARY, index, subject, code.const(str(low)), typed_operator('-', INT))
+        miss = self.new_label()
+        table = [miss] * (entries[-1][0] - low + 1)
+        for value, _, case in entries:
+            case_labels[case] = self.new_label()
+            table[value - low] = case_labels[case]
+        code.emit_jump_table(index, table, miss)
+        code.emit(Op.LABEL, target=miss)
+        missed.append(code.emit(Op.GOTO))
 
-        if node.type == NodeType.NUMBER:
-            return node.value
+    def generate_case_search(self, subject, subject_type, entries, case_jumps, missed):
+        """Binary search over the sorted case values, equality tests at the leaves"""
+        code = self.code
+        equals = typed_operator('==', subject_type)
+        at_least = typed_operator('>=', subject_type)
+        # (first, end) ranges of entries still to emit, and the jumps to them
+        pending = [(0, len(entries), [])]
+        while pending:
+            first, end, jumps = pending.pop()
+            if jumps:
+                self.place_label(jumps)
+            if end - first <= SEARCH_LEAF_CASES:
+                for _, spelling, case in entries[first:end]:
+                    case_jumps[case].append(code.emit(Op.IF_GOTO, arg1=subject, arg2=code.const(spelling),
+                                                      operator=equals))
+                missed.append(code.emit(Op.GOTO))
+                continue
+            middle = (first + end) // 2
+            upper = [code.emit(Op.IF_GOTO, arg1=subject, arg2=code.const(entries[middle][1]), operator=at_least)]
+            pending.append((middle, end, upper))
+            pending.append((first, middle, []))
 
-        if node.type == NodeType.IDENTIFIER:
-            return node.value
+    def generate_case_chain(self, subject, subject_type, cases, case_jumps, missed):
+        """One equality test per case, in source order"""
+        code = self.code
+        float_subject = None
+        for i, case_node in enumerate(cases):
+            case_value = code.const(case_node.value)
+            operand = subject
+            operator = EQUALS
+            case_type = literal_type(case_node.value)
+            if subject_type in NUMERIC and case_type is not None:
+                common = FLOAT if FLOAT in (subject_type, case_type) else INT
+                if common != subject_type:
+                    if float_subject is None:
+                        float_subject = self.convert(subject, subject_type, FLOAT)
+                    operand = float_subject
+                case_value = self.convert(case_value, case_type, common)
+                operator = typed_operator('==', common)
+            case_jumps[i].append(code.emit(Op.IF_GOTO, arg1=operand, arg2=case_value, operator=operator))
+        missed.append(code.emit(Op.GOTO))
 
-        if node.type == NodeType.ARRAY_ACCESS:
-            index_temp = self.generate_code(node.left)
-            temp = self.new_temp()
-            self.code.append(f'{temp} = {node.value}[{index_temp}]')
-            return temp
+    def generate_break_statement(self, node):
+        if not self.break_lists:
+            raise ValueError('break outside of a loop or switch')
+        self.break_lists[-1].append(self.code.emit(Op.GOTO))
+        return NO_OPERAND
 
-        if node.type == NodeType.FUNCTION_CALL:
-            arg_temps = [self.generate_code(child) for child in node.children]
-            result_temp = self.new_temp()
-            self.code.append(f'{result_temp} = call {node.value}({", ".join(arg_temps)})')
-            return result_temp
+    def generate_continue_statement(self, node):
+        if not self.continue_labels:
+            raise ValueError('continue outside of a loop')
+        self.code.emit(Op.GOTO, target=self.continue_labels[-1])
+        return NO_OPERAND
 
-        if node.type == NodeType.RETURN_STATEMENT:
-            if node.left:
-                value_temp = self.generate_code(node.left)
-                self.code.append(f'return {value_temp}')
+    def generate_array_access(self, node):
+        code = self.code
+        index_temp = yield node.left
+        temp = self.new_temp()
+        code.emit(Op.LOAD, temp, code.name(self.symbol_table.resolve(node.value).unique), index_temp)
+        return temp
+
+    def generate_function_call(self, node):
+        code = self.code
+        arg_temps = []
+        for child in node.children:
+            arg_temps.append((yield child))
+        result_temp = self.new_temp()
+        code.emit_call(result_temp, code.name(node.value), arg_temps)
+        return result_temp
+
+    def generate_return_statement(self, node):
+        code = self.code
+        if node.left:
+            value_temp = yield node.left
+            code.emit(Op.RETURN, arg1=value_temp)
+        else:
+            code.emit(Op.RETURN)
+        return NO_OPERAND
+
+    def generate_function_declaration(self, node):
+        code = self.code
+        params_node, body = node.children
+        table = self.symbol_table
+        # Parameters and the outermost declarations of the body share a scope.
+        table.enter_function(node.value, function_parameters(node))
+        symbols = [table.lookup(param.children[0].value) for param in params_node.children]
+        params = [code.name(symbol.unique) for symbol in symbols]
+        code.emit_function(code.name(node.value), params)
+        # Callers' arguments have no static type; convert scalars on entry.
+        for symbol, param in zip(symbols, params):
+            if symbol.type in NUMERIC:
+                self.convert(param, None, symbol.type, param)
+        for child in body.children:
+            yield child
+        code.emit(Op.END_FUNCTION)
+        table.exit_function()
+        return NO_OPERAND
+
+    def generate_block(self, node):
+        table = self.symbol_table
+        if table.current is table.global_scope:
+            table.enter_top_level()
+        else:
+            table.enter()
+        for child in node.children:
+            yield child
+        table.exit()
+        return NO_OPERAND
+
+    def generate_children(self, node):
+        """Default handler: generate each child in order"""
+        for child in node.children:
+            yield child
+        return NO_OPERAND
+
+def literal_type(text):
+    """INT or FLOAT for the spelling of a number, else None"""
+    if not text[:1].isdigit() and not (text[:1] == '-' and text[1:2].isdigit()):
+        return None
+    try:
+        int(text)
+        return INT
+    except ValueError:
+        pass
+    try:
+        float(text)
+        return FLOAT
+    except ValueError:
+        return None
+
+
+def converted_constant(text, target):
+    """Spelling of the number `text` converted to `target`, or None if no literal spells it"""
+    if literal_type(text) is None:
+        return None
+    if target == INT:
+        value = float(text)
+        return str(int(value)) if math.isfinite(value) else None
+    spelling = repr(float(text))
+    return spelling if '.' in spelling and 'e' not in spelling else None
+
+
+def function_parameters(node):
+    """(name, type) of each parameter of the FUNCTION_DECLARATION `node`.
+
+    A parameter the body indexes is an array passed by reference; its
+    type is None, so it is not converted on entry and its elements are
+    only checked at run time.
+    """
+    params_node, body = node.children
+    names = {param.children[0].value for param in params_node.children}
+    indexed = set()
+    # (node, parameter names not shadowed there)
+    stack = [(body, names)]
+    while stack:
+        node, visible = stack.pop()
+        if node is None or not visible:
+            continue
+        if node.type == NodeType.ARRAY_ACCESS and node.value in visible:
+            indexed.add(node.value)
+        if node.type == NodeType.PROGRAM:
+            for child in node.children:
+                stack.append((child, visible))
+                if (child is not None and child.type in (NodeType.VARIABLE_DECLARATION, NodeType.ARRAY_DECLARATION)
+                        and child.children[0].value in visible):
+                    # Later statements of this block see the new declaration.
+                    visible = visible - {child.children[0].value}
+            continue
+        stack.append((node.left, visible))
+        stack.append((node.right, visible))
+        stack.extend((child, visible) for child in node.children)
+    return [(param.children[0].value, None if param.children[0].value in indexed else param.value)
+            for param in params_node.children]
+
+
+def count_nodes(root):
+    """Number of nodes in the tree under `root`"""
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            continue
+        count += 1
+        stack.append(node.left)
+        stack.append(node.right)
+        stack.extend(node.children)
+    return count
+
+
+def number_value(text):
+    """int for a plain integer spelling, float for any other"""
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def number_spelling(value):
+    """Literal spelling of `value`; floats always get a '.' and never an exponent"""
+    if isinstance(value, int):
+        return str(value)
+    spelling = format(Decimal(repr(value)), 'f')
+    return spelling if '.' in spelling else spelling + '.0'
+
+
+def literal_value(node):
+    """Python value of a NUMBER or true/false node, else None"""
+    if node is None:
+        return None
+    if node.type == NodeType.NUMBER:
+        return number_value(node.value)
+    if node.type == NodeType.IDENTIFIER and node.value in BOOLEAN_LITERALS:
+        return node.value == 'true'
+    return None
+
+
+def is_number(value):
+    return value is not None and not isinstance(value, bool)
+
+
+def is_int_literal(node, value):
+    return node.type == NodeType.NUMBER and type(number_value(node.value)) is int and int(node.value) == value
+
+
+def is_boolean_valued(node):
+    if node.type in (NodeType.COMPARISON_OPERATION, NodeType.LOGICAL_OPERATION):
+        return True
+    if node.type == NodeType.UNARY_OPERATION:
+        return node.value == '!'
+    return isinstance(literal_value(node), bool)
+
+
+def constant_node(value):
+    if isinstance(value, bool):
+        return ASTNode(NodeType.IDENTIFIER, 'true' if value else 'false')
+    return ASTNode(NodeType.NUMBER, number_spelling(value))
+
+
+def evaluate_arithmetic(operator, left, right):
+    """Fold `left operator right`, or return None if it must wait for run time"""
+    if operator == '+':
+        return left + right
+    if operator == '-':
+        return left - right
+    if operator == '*':
+        return left * right
+    if right == 0:
+        return None
+    if isinstance(left, int) and isinstance(right, int):
+        # Integer division truncates toward zero.
+        quotient = abs(left) // abs(right)
+        return quotient if (left < 0) == (right < 0) else -quotient
+    return left / right
+
+
+COMPARISONS = {
+    '==': lambda left, right: left == right,
+    '!=': lambda left, right: left != right,
+    '<': lambda left, right: left < right,
+    '>': lambda left, right: left > right,
+    '<=': lambda left, right: left <= right,
+    '>=': lambda left, right: left >= right
+}
+
+
+class ConstantFolder:
+    """Evaluate constant subexpressions and prune constant branches.
+
+    Runs on the AST between Parser.parse and ThreeAddressCodeGenerator.
+    Arithmetic is only folded between numbers and logic only between
+    true/false, since the language leaves mixed cases to run time.
+    A subexpression is only dropped (`x || true`) when it contains no
+    call, array access or division, any of which may fail at run time.
+    """
+
+    def fold(self, root):
+        """Fold the tree in place and return its (possibly replaced) root"""
+        # id -> node for subtrees that may fail at run time; holding the
+        # nodes keeps their ids from being reused by folded replacements.
+        impure = {}
+        # Post-order walk: (node, parent, slot in parent, children done).
+        stack = [(root, None, None, False)]
+        while stack:
+            node, parent, slot, done = stack.pop()
+            if not done:
+                stack.append((node, parent, slot, True))
+                for index in range(len(node.children) - 1, -1, -1):
+                    stack.append((node.children[index], node, index, False))
+                if node.right is not None:
+                    stack.append((node.right, node, 'right', False))
+                if node.left is not None:
+                    stack.append((node.left, node, 'left', False))
+                continue
+
+            if node.type == NodeType.PROGRAM and None in node.children:
+                node.children = [child for child in node.children if child is not None]
+            if (node.type in (NodeType.FUNCTION_CALL, NodeType.ARRAY_ACCESS)
+                    or node.type == NodeType.BINARY_OPERATION and node.value == '/'
+                    or id(node.left) in impure or id(node.right) in impure
+                    or any(id(child) in impure for child in node.children)):
+                impure[id(node)] = node
+
+            replacement = self.simplify(node, impure)
+            if replacement is node:
+                continue
+            if parent is None:
+                root = replacement
+            elif slot == 'left':
+                parent.left = replacement
+            elif slot == 'right':
+                parent.right = replacement
             else:
-                self.code.append('return')
+                # None marks a pruned statement for the enclosing block.
+                parent.children[slot] = replacement
+        return root
+
+    def simplify(self, node, impure):
+        node_type = node.type
+        if node_type == NodeType.BINARY_OPERATION:
+            return self.simplify_arithmetic(node)
+        if node_type == NodeType.COMPARISON_OPERATION:
+            left, right = literal_value(node.left), literal_value(node.right)
+            if (is_number(left) and is_number(right)) or (
+                    isinstance(left, bool) and isinstance(right, bool) and node.value in ('==', '!=')):
+                return constant_node(COMPARISONS[node.value](left, right))
+            return node
+        if node_type == NodeType.UNARY_OPERATION:
+            operand = literal_value(node.left)
+            if node.value == '-' and is_number(operand):
+                return constant_node(-operand)
+            if node.value == '!' and isinstance(operand, bool):
+                return constant_node(not operand)
+            return node
+        if node_type == NodeType.LOGICAL_OPERATION:
+            return self.simplify_logical(node, impure)
+        if node_type == NodeType.IF_STATEMENT:
+            condition = literal_value(node.left)
+            if not isinstance(condition, bool):
+                return node
+            if condition:
+                return node.right
+            return node.children[0] if node.children else None
+        if node_type == NodeType.WHILE_STATEMENT and literal_value(node.left) is False:
             return None
+        return node
 
-        # Recursive code generation for children
-        if hasattr(node, 'children'):
-            for child in node.children:
-                self.generate_code(child)
+    def simplify_arithmetic(self, node):
+        left, right = literal_value(node.left), literal_value(node.right)
+        operator = node.value
+        if is_number(left) and is_number(right):
+            value = evaluate_arithmetic(operator, left, right)
+            if value is not None and (isinstance(value, int) or math.isfinite(value)):
+                return constant_node(value)
+            return node
+        # Identities, restricted to integer literals so a float operand
+        # never changes the type of the result.
+        if operator == '+' and is_int_literal(node.left, 0):
+            return node.right
+        if operator in ('+', '-') and is_int_literal(node.right, 0):
+            return node.left
+        if operator == '*' and is_int_literal(node.left, 1):
+            return node.right
+        if operator in ('*', '/') and is_int_literal(node.right, 1):
+            return node.left
+        return node
+
+    def simplify_logical(self, node, impure):
+        short_circuit = node.value == '||'
+        left, right = literal_value(node.left), literal_value(node.right)
+        if isinstance(left, bool):
+            # `false && x` / `true || x` never evaluate x.
+            if left == short_circuit:
+                return constant_node(left)
+            if is_boolean_valued(node.right):
+                return node.right
+        elif isinstance(right, bool):
+            if right == short_circuit and id(node.left) not in impure:
+                return constant_node(right)
+            if right != short_circuit and is_boolean_valued(node.left):
+                return node.left
+        return node
+
+
+class TypeChecker:
+    """Infer the type of every expression and reject ill-typed code.
+
+    Runs on the folded AST before the code generator and walks scopes
+    the same way it does.  Types come from variable, array and parameter
+    declarations: 'int', 'float' or 'bool'.  Implicit variables, call
+    results, whole arrays and array parameters (see function_parameters)
+    have no static type (None); values computed from them are only
+    checked at run time, as before.
+
+    An int converts to float wherever a float is expected.  A float
+    stored into an int variable is truncated with a warning, into an int
+    array element it is an error, and bool never mixes with numbers.
+    """
+    HANDLERS = {
+        NodeType.NUMBER: 'check_number',
+        NodeType.IDENTIFIER: 'check_identifier',
+        NodeType.BINARY_OPERATION: 'check_binary_operation',
+        NodeType.UNARY_OPERATION: 'check_unary_operation',
+        NodeType.COMPARISON_OPERATION: 'check_comparison_operation',
+        NodeType.LOGICAL_OPERATION: 'check_logical_operation',
+        NodeType.ASSIGNMENT: 'check_assignment',
+        NodeType.ARRAY_ACCESS: 'check_array_access',
+        NodeType.IF_STATEMENT: 'check_conditional',
+        NodeType.WHILE_STATEMENT: 'check_conditional',
+        NodeType.SWITCH_STATEMENT: 'check_switch_statement',
+        NodeType.FUNCTION_DECLARATION: 'check_function_declaration',
+        NodeType.VARIABLE_DECLARATION: 'check_variable_declaration',
+        NodeType.ARRAY_DECLARATION: 'check_array_declaration',
+        NodeType.PROGRAM: 'check_block'
+    }
+
+    def __init__(self):
+        self.symbol_table = SymbolTable()
+        # id(expression node) -> its type.
+        self.types = {}
+        self.warnings = []
+        self.handlers = {node_type: getattr(self, self.HANDLERS.get(node_type, 'check_children'))
+                         for node_type in NodeType}
+
+    def check(self, root):
+        """Check the tree under `root` and return its types by node id"""
+        drive(self.visit, root)
+        return self.types
+
+    def visit(self, node):
+        if not node:
+            return None
+        return self.handlers[node.type](node)
+
+    def typed(self, node, type):
+        self.types[id(node)] = type
+        return type
+
+    def store(self, name, target, value, element=False):
+        """Check storing a `value`-typed value into a `target`-typed variable or element"""
+        if target is None or value is None or target == value:
+            return
+        if BOOL in (target, value):
+            raise ValueError(f'Cannot assign a {value} value to {target} {name}')
+        if target == INT:
+            if element:
+                raise ValueError(f'Cannot store a float value in int array {name}')
+            self.warnings.append(f'float value truncated to int in assignment to {name}')
+
+    def element_type(self, symbol):
+        """Element type of the array `symbol`; None if it is untyped"""
+        if symbol.kind == ARRAY:
+            return symbol.type
+        if symbol.type is not None:
+            raise ValueError(f'{symbol.name} is not an array')
+        return None
+
+    def index(self, index_type):
+        if index_type in (FLOAT, BOOL):
+            raise ValueError(f'Array index must be int, not {index_type}')
+
+    def check_number(self, node):
+        return self.typed(node, literal_type(node.value))
+
+    def check_identifier(self, node):
+        if node.value in BOOLEAN_LITERALS:
+            return self.typed(node, BOOL)
+        symbol = self.symbol_table.resolve(node.value)
+        return self.typed(node, None if symbol.kind == ARRAY else symbol.type)
+
+    def check_binary_operation(self, node):
+        left = yield node.left
+        right = yield node.right
+        if BOOL in (left, right):
+            raise ValueError(f"Operator '{node.value}' needs numbers, not bool")
+        result = None
+        if left in NUMERIC and right in NUMERIC:
+            result = FLOAT if FLOAT in (left, right) else INT
+        return self.typed(node, result)
+
+    def check_unary_operation(self, node):
+        operand = yield node.left
+        if node.value == '!':
+            if operand in NUMERIC:
+                raise ValueError(f"Operator '!' needs bool, not {operand}")
+            return self.typed(node, BOOL)
+        if operand == BOOL:
+            raise ValueError(f"Operator '{node.value}' needs a number, not bool")
+        return self.typed(node, operand)
+
+    def check_comparison_operation(self, node):
+        left = yield node.left
+        right = yield node.right
+        if node.value in ('==', '!='):
+            if BOOL in (left, right) and (left in NUMERIC or right in NUMERIC):
+                raise ValueError(f"Cannot compare bool with a number using '{node.value}'")
+        elif BOOL in (left, right):
+            raise ValueError(f"Operator '{node.value}' needs numbers, not bool")
+        return self.typed(node, BOOL)
+
+    def check_logical_operation(self, node):
+        left = yield node.left
+        right = yield node.right
+        for operand in (left, right):
+            if operand in NUMERIC:
+                raise ValueError(f"Operator '{node.value}' needs bool, not {operand}")
+        return self.typed(node, BOOL)
+
+    def check_assignment(self, node):
+        value = yield node.right
+        name = node.left.value
+        symbol = self.symbol_table.resolve(name)
+        if node.left.type == NodeType.ARRAY_ACCESS:
+            target = self.element_type(symbol)
+            self.index((yield node.left.left))
+            self.store(name, target, value, element=True)
+        elif symbol.kind == ARRAY:
+            raise ValueError(f'Cannot assign to array {name}')
+        else:
+            self.store(name, symbol.type, value)
+        return None
+
+    def check_array_access(self, node):
+        symbol = self.symbol_table.resolve(node.value)
+        element = self.element_type(symbol)
+        self.index((yield node.left))
+        return self.typed(node, element)
+
+    def check_conditional(self, node):
+        condition = yield node.left
+        if condition in NUMERIC:
+            raise ValueError(f'Condition must be bool, not {condition}')
+        yield node.right
+        for child in node.children:
+            yield child
+        return None
+
+    def check_switch_statement(self, node):
+        yield node.left
+        for case_node in node.children:
+            yield case_node.children[0]
+        return None
+
+    def check_function_declaration(self, node):
+        body = node.children[1]
+        table = self.symbol_table
+        table.enter_function(node.value, function_parameters(node))
+        for child in body.children:
+            yield child
+        table.exit_function()
+        return None
 
+    def check_variable_declaration(self, node):
+        symbol = self.symbol_table.declare(node.children[0].value, VARIABLE, node.value)
+        if len(node.children) > 1:
+            self.store(symbol.name, symbol.type, (yield node.children[1]))
         return None
 
+    def check_array_declaration(self, node):
+        name_node, size_node = node.children[:2]
+        symbol = self.symbol_table.declare(name_node.value, ARRAY, node.value, int(float(size_node.value)))
+        for element in node.children[2:]:
+            self.store(symbol.name, symbol.type, (yield element), element=True)
+        return None
+
+    def check_block(self, node):
+        table = self.symbol_table
+        if table.current is table.global_scope:
+            table.enter_top_level()
+        else:
+            table.enter()
+        for child in node.children:
+            yield child
+        table.exit()
+        return None
+
+    def check_children(self, node):
+        if node.left is not None:
+            yield node.left
+        for child in node.children:
+            yield child
+        return None
+
+
 class Parser:
     def __init__(self, tokens):
-        self.tokens = tokens
+        self.tokens = TokenStream(tokens)
         self.current = 0
         self.code_generator = ThreeAddressCodeGenerator()
 
     def parse(self):
-        return self.program()
+        return self.run(self.program())
+
+    def run(self, production):
+        """Drive a statement-level production and return its node.
+
+        Productions that contain nested statements are generators that
+        yield the sub-productions they need and are resumed with the
+        parsed node, so block nesting does not grow the Python stack.
+        """
+        stack = [production]
+        value = None
+        while True:
+            try:
+                request = stack[-1].send(value)
+            except StopIteration as done:
+                stack.pop()
+                if not stack:
+                    return done.value
+                value = done.value
+                continue
+            stack.append(request)
+            value = None
 
     def program(self):
         program_node = ASTNode(NodeType.PROGRAM)
-        while self.current < len(self.tokens) and self.tokens[self.current].type != TokenType.EOF:
-            if self.tokens[self.current].type == TokenType.FUNCTION:
-                program_node.children.append(self.function_declaration())
+        while self.peek(0) is not None and self.peek(0).type != TokenType.EOF:
+            if self.peek(0).type == TokenType.FUNCTION:
+                program_node.add_child((yield self.function_declaration()))
             else:
-                program_node.children.append(self.statement())
+                self.add_statement(program_node, (yield self.statement()))
         return program_node
 
     def function_declaration(self):
@@ -262,48 +1154,58 @@ class Parser:
         
         self.consume(TokenType.LPAREN)
         params_node = ASTNode(NodeType.PARAMETERS)
-        while self.tokens[self.current].type != TokenType.RPAREN:
+        while self.peek(0).type != TokenType.RPAREN:
             param_type = self.consume([TokenType.INT, TokenType.FLOAT, TokenType.BOOL])
             param_name = self.consume(TokenType.IDENTIFIER)
             param_node = ASTNode(NodeType.FUNCTION_PARAM, param_type.value)
-            param_node.children.append(ASTNode(NodeType.IDENTIFIER, param_name.value))
-            params_node.children.append(param_node)
+            param_node.add_child(ASTNode(NodeType.IDENTIFIER, param_name.value))
+            params_node.add_child(param_node)
             
-            if self.tokens[self.current].type == TokenType.COMMA:
+            if self.peek(0).type == TokenType.COMMA:
                 self.consume(TokenType.COMMA)
         self.consume(TokenType.RPAREN)
         
         func_node = ASTNode(NodeType.FUNCTION_DECLARATION, name.value)
-        func_node.children.append(params_node)
-        func_node.children.append(self.block())
+        func_node.add_child(params_node)
+        func_node.add_child((yield self.block()))
         return func_node
 
     def block(self):
         self.consume(TokenType.LBRACE)
         block_node = ASTNode(NodeType.PROGRAM)
         
-        while self.tokens[self.current].type != TokenType.RBRACE:
-            block_node.children.append(self.statement())
+        while self.peek(0).type != TokenType.RBRACE:
+            self.add_statement(block_node, (yield self.statement()))
         
         self.consume(TokenType.RBRACE)
         return block_node
 
+    def add_statement(self, block_node, statement):
+        """Append a parsed statement, splicing in multi-declarator lists"""
+        if isinstance(statement, list):
+            for declaration in statement:
+                block_node.add_child(declaration)
+        else:
+            block_node.add_child(statement)
+
     def statement(self):
-        token = self.tokens[self.current]
+        token = self.peek(0)
         
         if token.type in [TokenType.INT, TokenType.FLOAT, TokenType.BOOL]:
+            if self.peek(1).type == TokenType.LBRACKET:
+                return self.array_declaration()
             if self.peek(1).type == TokenType.IDENTIFIER and self.peek(2).type == TokenType.LBRACKET:
                 return self.array_declaration()
             return self.variable_declaration()
         
         if token.type == TokenType.IF:
-            return self.if_statement()
+            return (yield self.if_statement())
         
         if token.type == TokenType.WHILE:
-            return self.while_statement()
+            return (yield self.while_statement())
         
         if token.type == TokenType.SWITCH:
-            return self.switch_statement()
+            return (yield self.switch_statement())
         
         if token.type == TokenType.BREAK:
             return self.break_statement()
@@ -326,22 +1228,29 @@ class Parser:
         raise ValueError(f'Unexpected token: {token}')
 
     def array_declaration(self):
+        """Parse `type name[size]` or `type[size] name`, with an optional initializer"""
         type_token = self.consume([TokenType.INT, TokenType.FLOAT, TokenType.BOOL])
-        name = self.consume(TokenType.IDENTIFIER)
-        self.consume(TokenType.LBRACKET)
-        size = self.consume(TokenType.NUMBER)
-        self.consume(TokenType.RBRACKET)
+        if self.peek(0).type == TokenType.LBRACKET:
+            self.consume(TokenType.LBRACKET)
+            size = self.consume(TokenType.NUMBER)
+            self.consume(TokenType.RBRACKET)
+            name = self.consume(TokenType.IDENTIFIER)
+        else:
+            name = self.consume(TokenType.IDENTIFIER)
+            self.consume(TokenType.LBRACKET)
+            size = self.consume(TokenType.NUMBER)
+            self.consume(TokenType.RBRACKET)
         
         decl_node = ASTNode(NodeType.ARRAY_DECLARATION, type_token.value)
-        decl_node.children.append(ASTNode(NodeType.IDENTIFIER, name.value))
-        decl_node.children.append(ASTNode(NodeType.NUMBER, size.value))
+        decl_node.add_child(ASTNode(NodeType.IDENTIFIER, name.value))
+        decl_node.add_child(ASTNode(NodeType.NUMBER, size.value))
         
-        if self.tokens[self.current].type == TokenType.ASSIGN:
+        if self.peek(0).type == TokenType.ASSIGN:
             self.consume(TokenType.ASSIGN)
             self.consume(TokenType.LBRACE)
-            while self.tokens[self.current].type != TokenType.RBRACE:
-                decl_node.children.append(self.expression())
-                if self.tokens[self.current].type == TokenType.COMMA:
+            while self.peek(0).type != TokenType.RBRACE:
+                decl_node.add_child(self.expression())
+                if self.peek(0).type == TokenType.COMMA:
                     self.consume(TokenType.COMMA)
             self.consume(TokenType.RBRACE)
         
@@ -362,18 +1271,26 @@ class Parser:
                       right=value)
 
     def variable_declaration(self):
+        """Parse `type a [= x], b [= y];`, returning a list if there are several declarators"""
         type_token = self.consume([TokenType.INT, TokenType.FLOAT, TokenType.BOOL])
-        name = self.consume(TokenType.IDENTIFIER)
-        
-        decl_node = ASTNode(NodeType.VARIABLE_DECLARATION, type_token.value)
-        decl_node.children.append(ASTNode(NodeType.IDENTIFIER, name.value))
+        declarations = []
         
-        if self.tokens[self.current].type == TokenType.ASSIGN:
-            self.consume(TokenType.ASSIGN)
-            decl_node.children.append(self.expression())
+        while True:
+            name = self.consume(TokenType.IDENTIFIER)
+            decl_node = ASTNode(NodeType.VARIABLE_DECLARATION, type_token.value)
+            decl_node.add_child(ASTNode(NodeType.IDENTIFIER, name.value))
+            
+            if self.peek(0).type == TokenType.ASSIGN:
+                self.consume(TokenType.ASSIGN)
+                decl_node.add_child(self.expression())
+            declarations.append(decl_node)
+            
+            if self.peek(0).type != TokenType.COMMA:
+                break
+            self.consume(TokenType.COMMA)
         
         self.consume(TokenType.SEMICOLON)
-        return decl_node
+        return declarations[0] if len(declarations) == 1 else declarations
 
     def assignment(self):
         left = self.consume(TokenType.IDENTIFIER)
@@ -388,14 +1305,14 @@ class Parser:
     def if_statement(self):
         self.consume(TokenType.IF)
         self.consume(TokenType.LPAREN)
-        condition = self.logical_expression()
+        condition = self.expression()
         self.consume(TokenType.RPAREN)
         
-        true_block = self.block()
+        true_block = yield self.block()
         
-        if self.tokens[self.current].type == TokenType.ELSE:
+        if self.peek(0).type == TokenType.ELSE:
             self.consume(TokenType.ELSE)
-            false_block = self.block()
+            false_block = yield self.block()
         else:
             false_block = None
         
@@ -403,17 +1320,17 @@ class Parser:
                          left=condition, 
                          right=true_block)
         if false_block:
-            if_node.children.append(false_block)
+            if_node.add_child(false_block)
         
         return if_node
 
     def while_statement(self):
         self.consume(TokenType.WHILE)
         self.consume(TokenType.LPAREN)
-        condition = self.logical_expression()
+        condition = self.expression()
         self.consume(TokenType.RPAREN)
         
-        body = self.block()
+        body = yield self.block()
         
         return ASTNode(NodeType.WHILE_STATEMENT, 
                       left=condition, 
@@ -429,18 +1346,18 @@ class Parser:
         cases = []
         default_case = None
         
-        while self.tokens[self.current].type == TokenType.CASE:
-            cases.append(self.case_statement())
+        while self.peek(0).type == TokenType.CASE:
+            cases.append((yield self.case_statement()))
         
-        if self.tokens[self.current].type == TokenType.DEFAULT:
-            default_case = self.default_case()
+        if self.peek(0).type == TokenType.DEFAULT:
+            default_case = yield self.default_case()
         
         self.consume(TokenType.RBRACE)
         
         switch_node = ASTNode(NodeType.SWITCH_STATEMENT, left=expr)
         switch_node.children = cases
         if default_case:
-            switch_node.children.append(default_case)
+            switch_node.add_child(default_case)
         
         return switch_node
 
@@ -449,15 +1366,13 @@ class Parser:
         value = self.expression()
         self.consume(TokenType.COLON)
         
-        statements = []
-        while (self.tokens[self.current].type not in 
+        block_node = ASTNode(NodeType.PROGRAM)
+        while (self.peek(0).type not in 
                [TokenType.CASE, TokenType.DEFAULT, TokenType.RBRACE]):
-            statements.append(self.statement())
+            self.add_statement(block_node, (yield self.statement()))
         
         case_node = ASTNode(NodeType.CASE_STATEMENT, value=value.value)
-        block_node = ASTNode(NodeType.PROGRAM)
-        block_node.children = statements
-        case_node.children.append(block_node)
+        case_node.add_child(block_node)
         
         return case_node
 
@@ -465,14 +1380,12 @@ class Parser:
         self.consume(TokenType.DEFAULT)
         self.consume(TokenType.COLON)
         
-        statements = []
-        while self.tokens[self.current].type != TokenType.RBRACE:
-            statements.append(self.statement())
+        block_node = ASTNode(NodeType.PROGRAM)
+        while self.peek(0).type != TokenType.RBRACE:
+            self.add_statement(block_node, (yield self.statement()))
         
         default_node = ASTNode(NodeType.DEFAULT_CASE)
-        block_node = ASTNode(NodeType.PROGRAM)
-        block_node.children = statements
-        default_node.children.append(block_node)
+        default_node.add_child(block_node)
         
         return default_node
 
@@ -488,7 +1401,7 @@ class Parser:
 
     def return_statement(self):
         self.consume(TokenType.RETURN)
-        if self.tokens[self.current].type != TokenType.SEMICOLON:
+        if self.peek(0).type != TokenType.SEMICOLON:
             expr = self.expression()
             self.consume(TokenType.SEMICOLON)
             return ASTNode(NodeType.RETURN_STATEMENT, left=expr)
@@ -500,9 +1413,9 @@ class Parser:
         self.consume(TokenType.LPAREN)
         
         args_node = ASTNode(NodeType.PARAMETERS)
-        while self.tokens[self.current].type != TokenType.RPAREN:
-            args_node.children.append(self.expression())
-            if self.tokens[self.current].type == TokenType.COMMA:
+        while self.peek(0).type != TokenType.RPAREN:
+            args_node.add_child(self.expression())
+            if self.peek(0).type == TokenType.COMMA:
                 self.consume(TokenType.COMMA)
         
         self.consume(TokenType.RPAREN)
@@ -513,115 +1426,167 @@ class Parser:
         return call_node
 
     def expression(self):
-        return self.logical_expression()
+        """Parse an expression by operator-precedence climbing.
 
-    def logical_expression(self):
-        left = self.comparison_expression()
-        
-        while self.current < len(self.tokens) and self.tokens[self.current].type in [TokenType.AND, TokenType.OR]:
-            op = self.consume([TokenType.AND, TokenType.OR])
-            right = self.comparison_expression()
-            left = ASTNode(NodeType.LOGICAL_OPERATION, op.value, left=left, right=right)
-        
-        return left
+        Operands and pending operators live on explicit stacks, and every
+        open '(', '[' or call argument list pushes a frame, so long
+        operator chains and deep nesting never recurse.
+        """
+        operands = []
+        operators = []
+        frames = []
+        base = 0
+        comparison_seen = False
+        expect_operand = True
 
-    def comparison_expression(self):
-        left = self.additive_expression()
-        
-        comparison_ops = [
-            TokenType.EQUAL, TokenType.NOT_EQUAL,
-            TokenType.LESS_THAN, TokenType.GREATER_THAN,
-            TokenType.LESS_EQUAL, TokenType.GREATER_EQUAL
-        ]
-        
-        if self.current < len(self.tokens) and self.tokens[self.current].type in comparison_ops:
-            op = self.consume(comparison_ops)
-            right = self.additive_expression()
-            return ASTNode(NodeType.COMPARISON_OPERATION, op.value, left=left, right=right)
-        
-        return left
+        while True:
+            token = self.peek(0)
 
-    def additive_expression(self):
-        left = self.multiplicative_expression()
-        
-        while self.current < len(self.tokens) and self.tokens[self.current].type in [TokenType.PLUS, TokenType.MINUS]:
-            op = self.consume([TokenType.PLUS, TokenType.MINUS])
-            right = self.multiplicative_expression()
-            left = ASTNode(NodeType.BINARY_OPERATION, op.value, left=left, right=right)
-        
-        return left
+            if expect_operand:
+                if token.type in UNARY_OPERATORS:
+                    self.consume(token.type)
+                    operators.append((UNARY_PRECEDENCE, NodeType.UNARY_OPERATION, token.value))
+                    continue
 
-    def multiplicative_expression(self):
-        left = self.unary_expression()
-        
-        while self.current < len(self.tokens) and self.tokens[self.current].type in [TokenType.MULTIPLY, TokenType.DIVIDE]:
-            op = self.consume([TokenType.MULTIPLY, TokenType.DIVIDE])
-            right = self.unary_expression()
-            left = ASTNode(NodeType.BINARY_OPERATION, op.value, left=left, right=right)
-        
-        return left
+                if token.type == TokenType.NUMBER:
+                    self.consume(TokenType.NUMBER)
+                    operands.append(ASTNode(NodeType.NUMBER, token.value))
+                    expect_operand = False
+                elif token.type == TokenType.IDENTIFIER:
+                    self.consume(TokenType.IDENTIFIER)
+                    opener = self.peek(0).type
+                    if opener in (TokenType.LPAREN, TokenType.LBRACKET):
+                        self.consume(opener)
+                        args = [] if opener == TokenType.LPAREN else None
+                        frames.append((opener, token.value, args, base, comparison_seen))
+                        base = len(operators)
+                        comparison_seen = False
+                        if opener == TokenType.LPAREN and self.peek(0).type == TokenType.RPAREN:
+                            expect_operand = False
+                            operands.append(None)
+                    else:
+                        operands.append(ASTNode(NodeType.IDENTIFIER, token.value))
+                        expect_operand = False
+                elif token.type == TokenType.LPAREN:
+                    self.consume(TokenType.LPAREN)
+                    frames.append((TokenType.LPAREN, None, None, base, comparison_seen))
+                    base = len(operators)
+                    comparison_seen = False
+                else:
+                    raise ValueError(f'Unexpected token in primary expression: {token}')
+                continue
 
-    def unary_expression(self):
-        if self.tokens[self.current].type in [TokenType.NOT, TokenType.MINUS]:
-            op = self.consume([TokenType.NOT, TokenType.MINUS])
-            operand = self.unary_expression()
-            return ASTNode(NodeType.UNARY_OPERATION, op.value, left=operand)
-        return self.primary_expression()
+            # Binary operator: reduce everything that binds at least as
+            # tightly, then shift it.  Comparisons are non-associative, so
+            # a second one ends the operand of the enclosing && / ||.
+            entry = BINARY_OPERATORS.get(token.type) if token is not None else None
+            if entry is not None and not (comparison_seen and entry[1] == NodeType.COMPARISON_OPERATION):
+                precedence, node_type = entry
+                self.reduce(operands, operators, base, precedence)
+                if node_type == NodeType.COMPARISON_OPERATION:
+                    comparison_seen = True
+                elif node_type == NodeType.LOGICAL_OPERATION:
+                    comparison_seen = False
+                self.consume(token.type)
+                operators.append((precedence, node_type, token.value))
+                expect_operand = True
+                continue
 
-    def primary_expression(self):
-        token = self.tokens[self.current]
-        
-        if token.type == TokenType.NUMBER:
-            self.consume(TokenType.NUMBER)
-            return ASTNode(NodeType.NUMBER, token.value)
-        
-        if token.type == TokenType.IDENTIFIER:
-            if self.peek(1).type == TokenType.LPAREN:
-                return self.function_call()
-            elif self.peek(1).type == TokenType.LBRACKET:
-                name = self.consume(TokenType.IDENTIFIER)
-                self.consume(TokenType.LBRACKET)
-                index = self.expression()
+            # Anything else ends the expression in the innermost frame.
+            self.reduce(operands, operators, base, 0)
+            if not frames:
+                return operands.pop()
+
+            opener, name, args, base, comparison_seen = frames[-1]
+            node = operands.pop()
+            if opener == TokenType.LBRACKET:
                 self.consume(TokenType.RBRACKET)
-                return ASTNode(NodeType.ARRAY_ACCESS, name.value, left=index)
+                operands.append(ASTNode(NodeType.ARRAY_ACCESS, name, left=node))
+            elif name is None:
+                self.consume(TokenType.RPAREN)
+                operands.append(node)
             else:
-                name = self.consume(TokenType.IDENTIFIER)
-                return ASTNode(NodeType.IDENTIFIER, name.value)
-        
-        if token.type == TokenType.LPAREN:
-            self.consume(TokenType.LPAREN)
-            expr = self.expression()
-            self.consume(TokenType.RPAREN)
-            return expr
-        
-        raise ValueError(f'Unexpected token in primary expression: {token}')
+                if node is not None:
+                    args.append(node)
+                    if self.peek(0).type == TokenType.COMMA:
+                        self.consume(TokenType.COMMA)
+                if self.peek(0).type != TokenType.RPAREN:
+                    # Another argument follows in the same frame.
+                    base = len(operators)
+                    comparison_seen = False
+                    expect_operand = True
+                    continue
+                self.consume(TokenType.RPAREN)
+                call_node = ASTNode(NodeType.FUNCTION_CALL, name)
+                call_node.children = args
+                operands.append(call_node)
+            frames.pop()
+
+    def reduce(self, operands, operators, base, precedence):
+        """Fold pending operators above `base` that bind at least as tightly as `precedence`"""
+        while len(operators) > base and operators[-1][0] >= precedence:
+            _, node_type, value = operators.pop()
+            operand = operands.pop()
+            if node_type == NodeType.UNARY_OPERATION:
+                operands.append(ASTNode(node_type, value, left=operand))
+            else:
+                operands.append(ASTNode(node_type, value, left=operands.pop(), right=operand))
 
     def consume(self, types):
+        token = self.peek(0)
+        if token is None:
+            raise ValueError(f'Expected {types}, got end of input')
         if isinstance(types, list):
-            if self.tokens[self.current].type not in types:
-                raise ValueError(f'Expected one of {types}, got {self.tokens[self.current]}')
+            if token.type not in types:
+                raise ValueError(f'Expected one of {types}, got {token}')
         else:
-            if self.tokens[self.current].type != types:
-                raise ValueError(f'Expected {types}, got {self.tokens[self.current]}')
+            if token.type != types:
+                raise ValueError(f'Expected {types}, got {token}')
         
-        token = self.tokens[self.current]
         self.current += 1
-        return token
+        return self.tokens.advance()
 
     def peek(self, distance=1):
-        peek_pos = self.current + distance
-        if peek_pos >= len(self.tokens):
-            return None
-        return self.tokens[peek_pos]
+        return self.tokens.peek(distance)
+
+def compile_source(source_code, warnings=None, profile=None):
+    """TAC for `source_code`; type warnings are added to the list `warnings`.
 
-def compile_source(source_code):
+    With a profiler.CompileProfile as `profile`, each phase runs on its
+    own and is timed and counted; lexing is then done up front instead of
+    streaming into the parser.
+    """
+    if profile is not None:
+        return profile_compile(source_code, warnings, profile)
     lexer = Lexer(source_code)
-    tokens = lexer.tokenize()
+    tokens = lexer.iter_tokens()
     
     parser = Parser(tokens)
-    ast = parser.parse()
+    ast = ConstantFolder().fold(parser.parse())
     
     code_generator = ThreeAddressCodeGenerator()
     code_generator.generate_code(ast)
+    if warnings is not None:
+        warnings.extend(code_generator.warnings)
     
+    return code_generator.code
+
+
+def profile_compile(source_code, warnings, profile):
+    with profile.phase('lex', 'tokens') as phase:
+        tokens = Lexer(source_code).tokenize()
+    phase.items = len(tokens)
+    with profile.phase('parse', 'nodes') as phase:
+        ast = Parser(tokens).parse()
+    del tokens
+    phase.items = count_nodes(ast)
+    with profile.phase('fold', 'nodes') as phase:
+        ast = ConstantFolder().fold(ast)
+    phase.items = count_nodes(ast)
+    code_generator = ThreeAddressCodeGenerator()
+    with profile.phase('codegen', 'instructions') as phase:
+        code_generator.generate_code(ast)
+    phase.items = len(code_generator.code)
+    if warnings is not None:
+        warnings.extend(code_generator.warnings)
     return code_generator.code
\ No newline at end of file
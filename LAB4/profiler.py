@@ -0,0 +1,148 @@
+"""Per-phase timing and memory of a compile.
+
+Usage: python3 profiler.py [--json FILE] [--no-memory] FILE.sk...
+
+    profile = CompileProfile('prog.sk')
+    code = compile_source(source, profile=profile)
+    print(profile.report())
+    json.dump(profile.as_dict(), out)
+
+compile_source times each phase (lex, parse, fold, codegen) under
+CompileProfile.phase, which records wall time, the number of tokens,
+nodes or instructions the phase produced and, unless memory=False, the
+peak memory tracemalloc saw while it ran.  Tracing allocations slows
+Python down several times, so the times are only comparable between
+profiles taken with the same setting.  Without a profile compile_source
+takes its usual streaming path and pays nothing.
+"""
+import argparse
+import contextlib
+import json
+import sys
+import time
+import tracemalloc
+
+from parser import compile_source
+
+
+class PhaseStats:
+    """Measurements of one compiler phase"""
+    __slots__ = ('name', 'unit', 'seconds', 'items', 'peak_bytes')
+
+    def __init__(self, name, unit, seconds=0.0, items=0, peak_bytes=None):
+        self.name = name
+        self.unit = unit
+        self.seconds = seconds
+        self.items = items
+        # None when memory was not traced
+        self.peak_bytes = peak_bytes
+
+    @property
+    def rate(self):
+        """Items per second"""
+        return self.items / self.seconds if self.seconds > 0 else 0.0
+
+    def as_dict(self):
+        return {'name': self.name, 'unit': self.unit, 'seconds': self.seconds, 'items': self.items,
+                'per_second': self.rate, 'peak_bytes': self.peak_bytes}
+
+
+class CompileProfile:
+    def __init__(self, path=None, memory=True):
+        self.path = path
+        self.memory = memory
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name, unit):
+        """Time the body as phase `name`; the caller sets the yielded stats' items"""
+        stats = PhaseStats(name, unit)
+        self.phases.append(stats)
+        started = False
+        if self.memory:
+            # Leave tracing that someone else started running, measuring
+            # only what this phase adds on top of it.
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats.seconds = time.perf_counter() - start
+            if self.memory:
+                stats.peak_bytes = tracemalloc.get_traced_memory()[1] - baseline
+                if started:
+                    tracemalloc.stop()
+
+    @property
+    def seconds(self):
+        return sum(stats.seconds for stats in self.phases)
+
+    def as_dict(self):
+        """JSON-ready stats of this compile"""
+        return {'path': self.path, 'seconds': self.seconds,
+                'phases': [stats.as_dict() for stats in self.phases]}
+
+    def report(self):
+        return format_phases(self.phases)
+
+
+def format_phases(phases):
+    lines = [f'{"phase":<10}{"seconds":>10}{"items":>10} {"unit":<14}{"per second":>12}{"peak KiB":>10}']
+    for stats in phases:
+        peak = f'{stats.peak_bytes / 1024:.1f}' if stats.peak_bytes is not None else '-'
+        lines.append(f'{stats.name:<10}{stats.seconds:>10.4f}{stats.items:>10} {stats.unit:<14}'
+                     f'{stats.rate:>12.0f}{peak:>10}')
+    return '\n'.join(lines)
+
+
+def aggregate(profiles):
+    """Sum the as_dict() stats of many compiles phase by phase.
+
+    Times and item counts add up; the peak is the largest of any file.
+    """
+    totals = {}
+    for profile in profiles:
+        for phase in profile['phases']:
+            stats = totals.get(phase['name'])
+            if stats is None:
+                stats = totals[phase['name']] = PhaseStats(phase['name'], phase['unit'])
+            stats.seconds += phase['seconds']
+            stats.items += phase['items']
+            if phase['peak_bytes'] is not None:
+                stats.peak_bytes = max(stats.peak_bytes or 0, phase['peak_bytes'])
+    return list(totals.values())
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Profile the compiler phases on .sk files.')
+    arg_parser.add_argument('paths', nargs='+', help='.sk files to compile')
+    arg_parser.add_argument('--json', metavar='FILE', help='write per-file stats to FILE as JSON')
+    arg_parser.add_argument('--no-memory', action='store_true', help='do not trace memory (faster, truer times)')
+    args = arg_parser.parse_args(argv)
+
+    profiles = []
+    for path in args.paths:
+        with open(path) as source_file:
+            source_code = source_file.read()
+        profile = CompileProfile(path, memory=not args.no_memory)
+        try:
+            compile_source(source_code, profile=profile)
+        except ValueError as error:
+            print(f'{path}: error: {error}', file=sys.stderr)
+            continue
+        profiles.append(profile.as_dict())
+        print(f'{path}\n{profile.report()}\n')
+    if len(profiles) > 1:
+        print(f'all {len(profiles)} files\n{format_phases(aggregate(profiles))}')
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(profiles, json_file, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,535 @@
+"""Compile .sk functions to Python functions.
+
+Usage: python3 pybackend.py FILE.sk [FUNCTION [ARGS...]]
+
+Each function declaration of the folded AST becomes the source of one
+Python function: variables are Python locals, while/if become Python
+while/if, and a switch becomes an if/elif chain (inside a one-pass
+`while True` when a case breaks out of it).  Conditions test exactly
+what the jumps ThreeAddressCodeGenerator emits for them test, and division, array
+allocation and calls follow vm.py, so both backends compute the same
+results.  The generator's TypeChecker types pick the same int/float
+conversions and typed divisions the TAC has.
+
+Simple counted array loops also get a NumPy path in front of their
+scalar loop (see vectorize.py).
+
+The generated code objects are cached by a hash of the .sk source; a
+PythonProgram only binds them to its builtins.  A function whose Python
+cannot be generated or compiled (nesting too deep for CPython) runs on
+the VirtualMachine instead.
+"""
+import hashlib
+import sys
+import time
+
+from lexer import Lexer
+from parser import (ARRAY_FILL, BOOL, FLOAT, INT, NEGATED_COMPARISONS, NUMERIC, ASTNode, ConstantFolder,
+                    NodeType, Parser, ThreeAddressCodeGenerator, compile_source, function_parameters, literal_type)
+from symbols import ARRAY, PARAMETER, VARIABLE, SymbolTable
+from tac import BOOLEAN_LITERALS
+from vectorize import analyze_loop, numpy
+from vm import BUILTINS, VirtualMachine, constant_value, divide, float_divide, int_divide
+
+CACHE_LIMIT = 128
+# (sha256 of a source, vectorize) -> its CompiledSource.
+compiled_sources = {}
+
+VALUE_NODES = (NodeType.NUMBER, NodeType.IDENTIFIER, NodeType.BINARY_OPERATION, NodeType.UNARY_OPERATION,
+               NodeType.COMPARISON_OPERATION, NodeType.LOGICAL_OPERATION, NodeType.ARRAY_ACCESS,
+               NodeType.FUNCTION_CALL)
+TOP_LEVEL = '<top level>'
+
+
+def python_name(prefix, name):
+    """Python identifier for an .sk name; others, such as the `x.2` of a
+    shadowing declaration, are hex-encoded"""
+    if name.isascii() and name.isidentifier():
+        return f'{prefix}_{name}'
+    return f'{prefix}x_{name.encode().hex()}'
+
+
+def function_name(name):
+    return '_top_level' if name == TOP_LEVEL else python_name('f', name)
+
+
+def negative_index(index):
+    raise IndexError(index)
+
+
+def undefined_function(name):
+    def call(*args):
+        raise ValueError(f'Call to undefined function {name}')
+    return call
+
+
+class FunctionEmitter:
+    """Python source of one function body"""
+
+    def __init__(self, name, params, body, types, vectorize=False):
+        self.name = name
+        # (name, type) pairs.
+        self.params = params
+        self.body = body
+        # id(expression node) -> type, from the TypeChecker.
+        self.types = types
+        self.vectorize = vectorize
+        # Resolves names to the unique ones the TAC generator gives them.
+        self.symbols = SymbolTable()
+        # Runtime name -> LoopPlan of each loop given a vector path.
+        self.vector_loops = {}
+        self.lines = []
+        self.counter = 0
+        # Callee name -> argument counts it is called with.
+        self.calls = {}
+        self.breakables = 0
+        # What `continue` does at each enclosing loop or wrapped switch:
+        # None for a loop, the switch's continue flag otherwise.
+        self.continue_targets = []
+
+    def new_name(self, prefix):
+        self.counter += 1
+        return f'_{prefix}{self.counter}'
+
+    def emit(self, depth, line):
+        self.lines.append('    ' * depth + line)
+
+    def source(self):
+        """Text of the `def` statement"""
+        scope = self.symbols.enter_function(self.name, self.params)
+        params = ', '.join(self.variable(name) for name, _ in self.params)
+        self.emit(0, f'def {function_name(self.name)}({params}):')
+        for name, param_type in self.params:
+            if param_type in NUMERIC:
+                variable = self.variable(name)
+                self.emit(1, f'{variable} = {self.convert(variable, None, param_type)}')
+        # Parameters and the outermost declarations of the body share a scope.
+        for child in self.body.children:
+            self.statement(child, 1)
+        if len(self.lines) == 1:
+            self.emit(1, 'pass')
+        local_names = sorted(symbol.unique for symbol in scope.all_symbols() if symbol.kind != PARAMETER)
+        if local_names:
+            self.lines.insert(1, '    ' + ' = '.join(python_name('v', name) for name in local_names) + ' = 0')
+        self.symbols.exit_function()
+        return '\n'.join(self.lines) + '\n'
+
+    def variable(self, name):
+        """Python name of the variable `name` refers to here"""
+        return python_name('v', self.symbols.resolve(name).unique)
+
+    def type_of(self, node):
+        return self.types.get(id(node))
+
+    def convert(self, value, source, target):
+        """Python expression `value`, of type `source`, converted as the TAC converts it to `target`"""
+        if target not in NUMERIC or source == target or source == BOOL:
+            return value
+        return f'float({value})' if target == FLOAT else f'int({value})'
+
+    def converted(self, node, target):
+        return self.convert(self.value(node), self.type_of(node), target)
+
+    def element_type(self, name):
+        symbol = self.symbols.lookup(name)
+        return symbol.type if symbol is not None and symbol.kind == ARRAY else None
+
+    def stores_unconverted(self, plan):
+        """True if no store of the LoopPlan `plan` needs an int/float conversion"""
+        for name, _, value in plan.statements:
+            element = self.element_type(name)
+            if element is not None and element != self.type_of(value):
+                return False
+        return True
+
+    # Statements
+
+    def statements(self, block, depth):
+        """Emit the statements of a block, or `pass` if it has none"""
+        start = len(self.lines)
+        if block is not None:
+            self.statement(block, depth)
+        if len(self.lines) == start:
+            self.emit(depth, 'pass')
+
+    def statement(self, node, depth):
+        node_type = node.type
+        if node_type == NodeType.PROGRAM:
+            self.symbols.enter()
+            for child in node.children:
+                self.statement(child, depth)
+            self.symbols.exit()
+        elif node_type == NodeType.VARIABLE_DECLARATION:
+            symbol = self.symbols.declare(node.children[0].value, VARIABLE, node.value)
+            if len(node.children) > 1:
+                self.emit(depth, f'{python_name("v", symbol.unique)} = {self.converted(node.children[1], symbol.type)}')
+        elif node_type == NodeType.ARRAY_DECLARATION:
+            self.array_declaration(node, depth)
+        elif node_type == NodeType.ASSIGNMENT:
+            self.assignment(node, depth)
+        elif node_type == NodeType.IF_STATEMENT:
+            self.emit(depth, f'if {self.condition(node.left)}:')
+            self.statements(node.right, depth + 1)
+            if node.children:
+                self.emit(depth, 'else:')
+                self.statements(node.children[0], depth + 1)
+        elif node_type == NodeType.WHILE_STATEMENT:
+            plan = analyze_loop(node) if self.vectorize else None
+            if plan is not None and self.stores_unconverted(plan):
+                depth = self.vector_loop(node, plan, depth)
+            self.emit(depth, f'while {self.condition(node.left)}:')
+            self.breakables += 1
+            self.continue_targets.append(None)
+            self.statements(node.right, depth + 1)
+            self.continue_targets.pop()
+            self.breakables -= 1
+        elif node_type == NodeType.SWITCH_STATEMENT:
+            self.switch(node, depth)
+        elif node_type == NodeType.BREAK_STATEMENT:
+            if not self.breakables:
+                raise ValueError('break outside of a loop or switch')
+            self.emit(depth, 'break')
+        elif node_type == NodeType.CONTINUE_STATEMENT:
+            self.continue_statement(depth)
+        elif node_type == NodeType.RETURN_STATEMENT:
+            self.emit(depth, f'return {self.value(node.left)}' if node.left else 'return None')
+        elif node_type in VALUE_NODES:
+            self.emit(depth, self.value(node))
+        else:
+            for child in node.children:
+                self.statement(child, depth)
+
+    def vector_loop(self, node, plan, depth):
+        """Emit the call to a loop's vector path; return the depth of its scalar loop"""
+        runtime_name = f'vector_loop_{function_name(self.name)}_{len(self.vector_loops) + 1}'
+        self.vector_loops[runtime_name] = plan
+        result = self.new_name('r')
+        induction = self.variable(plan.induction)
+        scalars = ''.join(f'{self.variable(name)}, ' for name in plan.scalars)
+        arrays = ''.join(f'{self.variable(name)}, ' for name in plan.arrays)
+        self.emit(depth, f'{result} = {runtime_name}({induction}, {self.value(node.left.right)}, '
+                         f'({scalars}), ({arrays}))')
+        self.emit(depth, f'if {result} is not None:')
+        self.emit(depth + 1, f'{induction} = {result}')
+        self.emit(depth, 'else:')
+        return depth + 1
+
+    def array_declaration(self, node, depth):
+        name_node, size_node = node.children[:2]
+        if len(node.children) - 2 > float(size_node.value):
+            raise ValueError(f'Too many initializers for array {name_node.value}[{size_node.value}]')
+        symbol = self.symbols.declare(name_node.value, ARRAY, node.value, int(float(size_node.value)))
+        array = python_name('v', symbol.unique)
+        fill = constant_value(ARRAY_FILL[node.value])
+        self.emit(depth, f'{array} = [{fill!r}] * {constant_value(size_node.value)!r}')
+        for index, element in enumerate(node.children[2:]):
+            self.emit(depth, f'{array}[{index}] = {self.converted(element, symbol.type)}')
+
+    def assignment(self, node, depth):
+        # The value is evaluated (and its names resolved) before the target.
+        value = self.value(node.right)
+        symbol = self.symbols.resolve(node.left.value)
+        target = python_name('v', symbol.unique)
+        if node.left.type != NodeType.ARRAY_ACCESS:
+            self.emit(depth, f'{target} = {self.convert(value, self.type_of(node.right), symbol.type)}')
+            return
+        element = symbol.type if symbol.kind == ARRAY else None
+        value = self.convert(value, self.type_of(node.right), element)
+        # The value is evaluated before the index, as in the TAC.
+        temp = self.new_name('v')
+        index = self.new_name('i')
+        self.emit(depth, f'{temp} = {value}')
+        self.emit(depth, f'{index} = {self.value(node.left.left)}')
+        self.emit(depth, f'if {index} < 0: negative_index({index})')
+        self.emit(depth, f'{target}[{index}] = {temp}')
+
+    def switch(self, node, depth):
+        subject = self.new_name('s')
+        subject_type = self.type_of(node.left)
+        self.emit(depth, f'{subject} = {self.value(node.left)}')
+        wrapped = any(breaks_out(case.children[0]) for case in node.children)
+        flag = None
+        if wrapped:
+            if self.continue_targets and any(continues_out(case.children[0]) for case in node.children):
+                flag = self.new_name('c')
+                self.emit(depth, f'{flag} = False')
+            self.emit(depth, 'while True:')
+            depth += 1
+        self.breakables += 1
+        if flag is not None:
+            self.continue_targets.append(flag)
+        keyword = 'if'
+        for case in node.children:
+            if case.type == NodeType.CASE_STATEMENT:
+                test = subject
+                case_value = constant_value(case.value)
+                if subject_type in NUMERIC and literal_type(case.value) is not None:
+                    if subject_type == INT and literal_type(case.value) == FLOAT:
+                        test = f'float({subject})'
+                    elif subject_type == FLOAT:
+                        case_value = float(case_value)
+                self.emit(depth, f'{keyword} {test} == {case_value!r}:')
+                keyword = 'elif'
+            elif keyword == 'if':
+                # A default with no cases always runs.
+                self.emit(depth, 'if True:')
+            else:
+                self.emit(depth, 'else:')
+            self.statements(case.children[0], depth + 1)
+        if flag is not None:
+            self.continue_targets.pop()
+        self.breakables -= 1
+        if wrapped:
+            self.emit(depth, 'break')
+            depth -= 1
+            if flag is not None:
+                self.emit(depth, f'if {flag}:')
+                self.continue_statement(depth + 1)
+
+    def continue_statement(self, depth):
+        """`continue` the innermost loop, leaving any wrapped switches first"""
+        if not self.continue_targets:
+            raise ValueError('continue outside of a loop')
+        innermost = self.continue_targets[-1]
+        if innermost is None:
+            self.emit(depth, 'continue')
+        else:
+            self.emit(depth, f'{innermost} = True')
+            self.emit(depth, 'break')
+
+    # Expressions
+
+    def jumps(self, node, sense):
+        """Python test for generate_condition(node, sense) taking its jump"""
+        if node.type == NodeType.LOGICAL_OPERATION:
+            short_circuit = node.value == '||'
+            if sense == short_circuit:
+                return f'({self.jumps(node.left, sense)} or {self.jumps(node.right, sense)})'
+            return f'(not {self.jumps(node.left, short_circuit)} and {self.jumps(node.right, sense)})'
+        if node.type == NodeType.UNARY_OPERATION and node.value == '!':
+            return self.jumps(node.left, not sense)
+        if node.type == NodeType.COMPARISON_OPERATION:
+            operator = node.value if sense else NEGATED_COMPARISONS[node.value]
+            return f'({self.comparison(node, operator)})'
+        return f'({self.value(node)} == {sense!r})'
+
+    def condition(self, node):
+        """Python test for entering an if or while body"""
+        return f'not {self.jumps(node, False)}'
+
+    def operands(self, node):
+        """Python operands of a binary node, converted to the type the TAC computes in"""
+        left, right = self.value(node.left), self.value(node.right)
+        left_type, right_type = self.type_of(node.left), self.type_of(node.right)
+        if left_type in NUMERIC and right_type in NUMERIC:
+            common = FLOAT if FLOAT in (left_type, right_type) else INT
+            return self.convert(left, left_type, common), self.convert(right, right_type, common), common
+        return left, right, None
+
+    def comparison(self, node, operator):
+        left, right, _ = self.operands(node)
+        return f'{left} {operator} {right}'
+
+    def value(self, node):
+        node_type = node.type
+        if node_type == NodeType.NUMBER:
+            return repr(constant_value(node.value))
+        if node_type == NodeType.IDENTIFIER:
+            if node.value in BOOLEAN_LITERALS:
+                return repr(node.value == 'true')
+            return self.variable(node.value)
+        if node_type == NodeType.BINARY_OPERATION:
+            left, right, common = self.operands(node)
+            if node.value == '/':
+                helper = {INT: 'int_divide', FLOAT: 'float_divide'}.get(common, 'divide')
+                return f'{helper}({left}, {right})'
+            return f'({left} {node.value} {right})'
+        if node_type == NodeType.COMPARISON_OPERATION:
+            return f'({self.comparison(node, node.value)})'
+        if node_type == NodeType.UNARY_OPERATION:
+            operator = 'not ' if node.value == '!' else '-'
+            return f'({operator}{self.value(node.left)})'
+        if node_type == NodeType.LOGICAL_OPERATION:
+            return f'({self.condition(node)})'
+        if node_type == NodeType.ARRAY_ACCESS:
+            array = self.variable(node.value)
+            index = self.value(node.left)
+            if node.left.type == NodeType.NUMBER and constant_value(node.left.value) >= 0:
+                return f'{array}[{index}]'
+            return f'({array}[_i] if (_i := {index}) >= 0 else negative_index(_i))'
+        if node_type == NodeType.FUNCTION_CALL:
+            self.calls.setdefault(node.value, set()).add(len(node.children))
+            args = ', '.join(self.value(child) for child in node.children)
+            return f'{python_name("f", node.value)}({args})'
+        raise ValueError(f'Cannot compile {node_type.value} as a value')
+
+
+def breaks_out(block):
+    """True if `block` has a break that leaves the switch it belongs to"""
+    return any_outside_loops(block, (NodeType.BREAK_STATEMENT,), (NodeType.WHILE_STATEMENT, NodeType.SWITCH_STATEMENT))
+
+
+def continues_out(block):
+    return any_outside_loops(block, (NodeType.CONTINUE_STATEMENT,), (NodeType.WHILE_STATEMENT,))
+
+
+def any_outside_loops(block, wanted, barriers):
+    stack = [block]
+    while stack:
+        node = stack.pop()
+        if node is None or node.type in barriers:
+            continue
+        if node.type in wanted:
+            return True
+        stack.append(node.left)
+        stack.append(node.right)
+        stack.extend(node.children)
+    return False
+
+
+class CompiledSource:
+    """Code objects generated for one .sk source"""
+    __slots__ = ('functions', 'fallbacks', 'calls', 'vector_loops', 'python_source')
+
+    def __init__(self, source_code, vectorize=False):
+        tokens = Lexer(source_code).tokenize_compact()
+        program_node = ConstantFolder().fold(Parser(tokens).parse())
+        # Checks types, break/continue placement and everything else the
+        # TAC generator rejects.
+        generator = ThreeAddressCodeGenerator()
+        generator.generate_code(program_node)
+
+        declarations = {}
+        top_level = []
+        for node in program_node.children:
+            if node.type == NodeType.FUNCTION_DECLARATION:
+                if node.value in declarations:
+                    raise ValueError(f'Function {node.value} is defined twice')
+                declarations[node.value] = node
+            else:
+                top_level.append(node)
+
+        # Function name -> (parameter names, code object).  Code that
+        # could not be compiled is listed in fallbacks.
+        self.functions = {}
+        self.fallbacks = []
+        self.calls = {}
+        self.vector_loops = {}
+        sources = []
+        units = [(name, function_parameters(node), node.children[1]) for name, node in declarations.items()]
+        if top_level:
+            body = ASTNode(NodeType.PROGRAM)
+            body.children = top_level
+            units.append((TOP_LEVEL, [], body))
+        for name, params, body in units:
+            emitter = FunctionEmitter(name, params, body, generator.types, vectorize)
+            try:
+                text = emitter.source()
+                code = compile(text, f'<sk {name}>', 'exec')
+            except (RecursionError, MemoryError, SyntaxError):
+                self.fallbacks.append(name)
+                continue
+            self.functions[name] = ([param for param, _ in params], code)
+            self.vector_loops.update(emitter.vector_loops)
+            for callee, counts in emitter.calls.items():
+                self.calls.setdefault(callee, set()).update(counts)
+            sources.append(text)
+        self.python_source = '\n'.join(sources)
+
+        for callee, counts in self.calls.items():
+            if callee in declarations:
+                expected = len(declarations[callee].children[0].children)
+                for count in counts - {expected}:
+                    raise ValueError(f'{callee} takes {expected} arguments, called with {count}')
+
+
+def compile_cached(source_code, vectorize=False):
+    """CompiledSource for `source_code`, reusing one compiled from the same text"""
+    key = (hashlib.sha256(source_code.encode()).hexdigest(), vectorize)
+    compiled = compiled_sources.get(key)
+    if compiled is None:
+        compiled = CompiledSource(source_code, vectorize)
+        if len(compiled_sources) >= CACHE_LIMIT:
+            del compiled_sources[next(iter(compiled_sources))]
+        compiled_sources[key] = compiled
+    return compiled
+
+
+class PythonProgram:
+    def __init__(self, source_code, builtins=None, vectorize=True):
+        """Compile `source_code` (or reuse its cached code) and bind it to `builtins`.
+
+        With `vectorize`, qualifying array loops get a NumPy path (see
+        vectorize.py) when NumPy is installed.
+        """
+        self.source_code = source_code
+        self.builtins = BUILTINS if builtins is None else builtins
+        self.compiled = compile_cached(source_code, vectorize and numpy is not None)
+        self.machine = None
+        namespace = {'__builtins__': {}, 'divide': divide, 'int_divide': int_divide, 'float_divide': float_divide,
+                     'float': float, 'int': int, 'negative_index': negative_index}
+        for runtime_name, plan in self.compiled.vector_loops.items():
+            namespace[runtime_name] = plan.run
+        for callee in self.compiled.calls:
+            if callee in self.builtins:
+                namespace[python_name('f', callee)] = self.builtins[callee]
+            else:
+                namespace[python_name('f', callee)] = undefined_function(callee)
+        self.functions = {}
+        for name, (params, code) in self.compiled.functions.items():
+            exec(code, namespace)
+            self.functions[name] = namespace[function_name(name)]
+        for name in self.compiled.fallbacks:
+            self.functions[name] = namespace[function_name(name)] = self.fallback(name)
+
+    def fallback(self, name):
+        def call(*args):
+            if self.machine is None:
+                self.machine = VirtualMachine(compile_source(self.source_code), self.builtins)
+            if name == TOP_LEVEL:
+                return self.machine.run()
+            return self.machine.call(name, *args)
+        return call
+
+    def call(self, name, *args):
+        """Call function `name` with Python values and return its result"""
+        function = self.functions.get(name)
+        if function is None or name == TOP_LEVEL:
+            raise ValueError(f'No function named {name}')
+        return self.invoke(function, args)
+
+    def run(self):
+        """Execute the top-level statements"""
+        function = self.functions.get(TOP_LEVEL)
+        return None if function is None else self.invoke(function, ())
+
+    def invoke(self, function, args):
+        try:
+            return function(*args)
+        except (TypeError, OverflowError) as error:
+            # Wrong argument count or an operand of the wrong kind.
+            raise ValueError(f'Bad operand: {error}') from None
+        except IndexError:
+            raise ValueError('Array index out of range') from None
+        except RecursionError:
+            raise ValueError('Call stack overflow') from None
+
+
+def main(argv):
+    with open(argv[0]) as source_file:
+        program = PythonProgram(source_file.read())
+    start = time.perf_counter()
+    if len(argv) > 1:
+        result = program.call(argv[1], *(constant_value(arg) for arg in argv[2:]))
+    elif 'main' in program.functions:
+        result = program.call('main')
+    else:
+        result = program.run()
+    elapsed = time.perf_counter() - start
+    if result is not None:
+        print(result)
+    print(f'ran in {elapsed:.3f} s', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,74 @@
+"""Compare the Python backend with the VM on the t*.sk programs.
+
+Usage: python3 pybackend_bench.py [iterations]
+
+Each program is scaled up by a driver function that calls every
+parameterless function in it `iterations` times.  Return types in
+declarations (`function int f(...)`) are dropped, since the grammar has
+none, and the functions the programs call without defining are given
+as builtins.  Programs the compiler rejects, such as the deliberate type
+errors in t1.sk and t4.sk, are reported and skipped.
+"""
+import glob
+import math
+import os
+import re
+import sys
+import time
+
+from parser import compile_source
+from pybackend import PythonProgram, compiled_sources
+from vm import VirtualMachine
+
+DECLARATION = re.compile(r'function\s+(?:(?:int|float|bool|void)\s+)?(\w+)\s*\(([^)]*)\)')
+BENCH_BUILTINS = {'print': lambda *values: None, 'printResult': lambda value: None, 'sqrt': math.sqrt}
+DRIVER = """
+function bench(int n) {
+    int i = 0;
+    while (i < n) {
+%s
+        i = i + 1;
+    }
+    return i;
+}
+"""
+
+
+def scaled_source(path):
+    with open(path) as source_file:
+        source_code = source_file.read()
+    entry_points = [match.group(1) for match in DECLARATION.finditer(source_code) if not match.group(2).strip()]
+    source_code = DECLARATION.sub(lambda match: f'function {match.group(1)}({match.group(2)})', source_code)
+    calls = '\n'.join(f'        {name}();' for name in entry_points)
+    return source_code + DRIVER % calls
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def main(iterations):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    print(f'{iterations} iterations of each program\n')
+    print(f'{"program":<10}{"vm s":>9}{"python s":>10}{"speedup":>9}{"compile ms":>12}{"cached ms":>11}')
+    for path in sorted(glob.glob(os.path.join(directory, 't*.sk'))):
+        source_code = scaled_source(path)
+        try:
+            machine = VirtualMachine(compile_source(source_code), BENCH_BUILTINS)
+        except ValueError as error:
+            print(f'{os.path.basename(path):<10}rejected: {error}')
+            continue
+        compiled_sources.clear()
+        compile_time = timed(lambda: PythonProgram(source_code, BENCH_BUILTINS))
+        cached_time = timed(lambda: PythonProgram(source_code, BENCH_BUILTINS))
+        program = PythonProgram(source_code, BENCH_BUILTINS)
+        vm_time = timed(lambda: machine.call('bench', iterations))
+        python_time = timed(lambda: program.call('bench', iterations))
+        print(f'{os.path.basename(path):<10}{vm_time:>9.3f}{python_time:>10.3f}{vm_time / python_time:>8.1f}x'
+              f'{compile_time * 1e3:>12.2f}{cached_time * 1e3:>11.2f}')
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,218 @@
+"""Linear-scan allocation of temps to a bounded set of registers.
+
+Usage: python3 regalloc.py FILE.sk [-r REGISTERS]
+
+The code generator never reuses a temp, so a function with N
+subexpressions has N temps.  For each function, liveness over its CFG
+gives every temp one live interval: the span from the first to the last
+point where it holds a value.  Points are numbered two per instruction,
+uses before definitions, so an instruction may write its result into
+the register of an operand that dies there.  Intervals are then
+allocated in order of their start (Poletto and Sarkar's linear scan):
+when all registers are busy, the interval that ends last is spilled.
+
+Register r becomes temp t(r + 1).  A spilled temp becomes a frame
+variable `$sN`, which no source name can collide with; spill slots are
+reused once their intervals end.  Named variables are left alone.
+"""
+import argparse
+import bisect
+import sys
+
+from cfg import build_cfgs, liveness
+from parser import compile_source
+from tac import Op, QuadBuffer, is_temp, temp_operand
+
+
+class Interval:
+    __slots__ = ('temp', 'start', 'end', 'register', 'spill')
+
+    def __init__(self, temp, point):
+        self.temp = temp
+        self.start = point
+        self.end = point
+        self.register = None
+        self.spill = None
+
+    def cover(self, point):
+        if point < self.start:
+            self.start = point
+        elif point > self.end:
+            self.end = point
+
+
+class FunctionAllocation:
+    """Allocation report for one function"""
+    __slots__ = ('name', 'temps', 'max_live', 'registers', 'spilled')
+
+    def __init__(self, name, temps, max_live, registers, spilled):
+        self.name = name
+        self.temps = temps
+        # Most temps live at the same point.
+        self.max_live = max_live
+        self.registers = registers
+        self.spilled = spilled
+
+
+def set_bits(bits):
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+def live_intervals(graph):
+    """Live interval of every temp in the ControlFlowGraph `graph`"""
+    index, live_in, live_out = liveness(graph, is_temp)
+    temps = [None] * len(index)
+    for temp, bit in index.items():
+        temps[bit] = temp
+    intervals = {}
+
+    def cover(temp, point):
+        interval = intervals.get(temp)
+        if interval is None:
+            intervals[temp] = Interval(temp, point)
+        else:
+            interval.cover(point)
+
+    position = 0
+    for block in graph.blocks:
+        first = position
+        for instruction in block.instructions:
+            for operand in instruction.uses():
+                if is_temp(operand):
+                    cover(operand, 2 * position)
+            defined = instruction.defined()
+            if is_temp(defined):
+                cover(defined, 2 * position + 1)
+            position += 1
+        last = max(position - 1, first)
+        for bit in set_bits(live_in[block.index]):
+            cover(temps[bit], 2 * first)
+        for bit in set_bits(live_out[block.index]):
+            cover(temps[bit], 2 * last + 1)
+    return list(intervals.values())
+
+
+def max_overlap(intervals):
+    events = []
+    for interval in intervals:
+        events.append((interval.start, 1))
+        events.append((interval.end + 1, -1))
+    events.sort()
+    live = most = 0
+    for _, change in events:
+        live += change
+        most = max(most, live)
+    return most
+
+
+def linear_scan(intervals, registers=None):
+    """Give each interval a register or, past `registers`, a spill slot"""
+    intervals.sort(key=lambda interval: interval.start)
+    # Active intervals ordered by end point.
+    active = []
+    free = []
+    used = 0
+    spilled = []
+    for interval in intervals:
+        while active and active[0].end < interval.start:
+            free.append(active.pop(0).register)
+        if free:
+            interval.register = free.pop()
+        elif registers is None or used < registers:
+            interval.register = used
+            used += 1
+        elif active and active[-1].end > interval.end:
+            # Spill whichever interval reaches furthest ahead.
+            victim = active.pop()
+            interval.register = victim.register
+            victim.register = None
+            spilled.append(victim)
+        else:
+            spilled.append(interval)
+            continue
+        bisect.insort(active, interval, key=lambda other: other.end)
+
+    # Spill slots are allocated the same way, without a limit.
+    spilled.sort(key=lambda interval: interval.start)
+    active = []
+    free = []
+    slots = 0
+    for interval in spilled:
+        while active and active[0].end < interval.start:
+            free.append(active.pop(0).spill)
+        if free:
+            interval.spill = free.pop()
+        else:
+            interval.spill = slots
+            slots += 1
+        bisect.insort(active, interval, key=lambda other: other.end)
+    return used, len(spilled)
+
+
+class RegisterAllocator:
+    def __init__(self, registers=None):
+        """Allocate temps to at most `registers` registers (None: as many as needed)"""
+        if registers is not None and registers < 1:
+            raise ValueError('At least one register is needed')
+        self.registers = registers
+        # FunctionAllocation per function of the last run, top level last.
+        self.functions = []
+
+    def run(self, code):
+        """Return a copy of the QuadBuffer `code` with temps allocated"""
+        result = QuadBuffer(code.strings)
+        self.functions = []
+        for graph in build_cfgs(code):
+            intervals = live_intervals(graph)
+            used, spilled = linear_scan(intervals, self.registers)
+            self.functions.append(FunctionAllocation(graph.name, len(intervals), max_overlap(intervals),
+                                                     used, spilled))
+            mapping = {}
+            for interval in intervals:
+                if interval.register is not None:
+                    mapping[interval.temp] = temp_operand(interval.register + 1)
+                else:
+                    mapping[interval.temp] = result.name(f'$s{interval.spill}')
+
+            if graph.name is not None:
+                result.emit_function(result.name(graph.name), graph.params)
+            for instruction in graph.instructions():
+                instruction.replace_uses(mapping)
+                defined = instruction.defined()
+                if defined in mapping:
+                    instruction.result = mapping[defined]
+                result.append(instruction)
+            if graph.name is not None:
+                result.emit(Op.END_FUNCTION)
+        return result
+
+
+def allocate_registers(code, registers=None):
+    return RegisterAllocator(registers).run(code)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Report live temps and allocate registers per function.')
+    arg_parser.add_argument('path', help='.sk file')
+    arg_parser.add_argument('-r', '--registers', type=int, default=None, help='registers available (default: unbounded)')
+    arg_parser.add_argument('-l', '--listing', action='store_true', help='print the allocated TAC')
+    args = arg_parser.parse_args(argv)
+
+    with open(args.path) as source_file:
+        code = compile_source(source_file.read())
+    allocator = RegisterAllocator(args.registers)
+    allocated = allocator.run(code)
+    print(f'{"function":<24}{"temps":>8}{"max live":>10}{"registers":>11}{"spilled":>9}')
+    for function in allocator.functions:
+        name = function.name if function.name is not None else '(top level)'
+        print(f'{name:<24}{function.temps:>8}{function.max_live:>10}{function.registers:>11}{function.spilled:>9}')
+    if args.listing:
+        print()
+        print(allocated)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,351 @@
+"""Binary files of tokens, ASTs and TAC, reopened through mmap.
+
+    save('prog.skb', code=code, ast=ast, tokens=tokens)
+    with Artifact('prog.skb') as artifact:
+        code = artifact.code()      # QuadBuffer viewing the mapped file
+        root = artifact.ast()       # MappedNode, decoded as it is walked
+        tokens = artifact.tokens()  # TokenArray
+    print(code)                     # still mapped: code holds a view
+
+A file is a header, a section directory and 8-byte aligned sections,
+all little-endian:
+
+    header      magic b'SKAR', format version, section count (u32 each)
+    directory   per section: 4-byte tag, 4 pad bytes, offset, size (u64)
+    STRO STRB   string table: u32 offsets into a UTF-8 blob, one past
+                each string; TAC operands and node fields index it
+    NODE KIDS   AST: six i32 per node (type name, value or -1, left,
+                right, first child slot in KIDS, child count); node 0 is
+                the root and KIDS lists child node indexes
+    QUAD ARGS   TAC: QuadBuffer.quads and arg_pool as stored in memory
+    SRC  TKKD TKST TKLN TKLI TKCO
+                tokens: the source text and TokenArray's columns
+
+Sections other than the string table are optional.  Loaded arrays are
+memoryviews of the map, so opening a file costs the same however large
+it is, and only what is read gets decoded.  They are read-only: code
+that rewrites a loaded QuadBuffer builds a new one, as the optimizer
+does.  On a big-endian machine the arrays are copied and byteswapped.
+
+The file stays mapped while anything taken from it is referenced, so
+leaving a `with` block only unmaps it once nothing is; otherwise that
+happens when the last of them is garbage collected.
+"""
+import array
+import mmap
+import struct
+import sys
+import weakref
+
+from lexer import TokenArray
+from parser import NodeType
+from tac import NO_OPERAND, QuadBuffer, StringTable
+
+MAGIC = b'SKAR'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sII')
+DIRECTORY_ENTRY = struct.Struct('<4s4xQQ')
+ALIGNMENT = 8
+NODE_WIDTH = 6
+# Field offsets within a node record
+TYPE, VALUE, LEFT, RIGHT, FIRST_CHILD, CHILD_COUNT = range(NODE_WIDTH)
+NO_NODE = -1
+# TokenArray column -> (section tag, array typecode)
+TOKEN_COLUMNS = (('kinds', b'TKKD', 'B'), ('starts', b'TKST', 'I'), ('lengths', b'TKLN', 'I'),
+                 ('lines', b'TKLI', 'I'), ('columns', b'TKCO', 'I'))
+
+
+def little_endian(values):
+    """Bytes of the array `values` in little-endian order"""
+    if sys.byteorder == 'big' and values.itemsize > 1:
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def string_table(strings):
+    """Plain StringTable holding `strings` in order"""
+    table = StringTable()
+    for text in strings:
+        table.intern(text)
+    return table
+
+
+def node_records(root, intern):
+    """NODE and KIDS arrays of the tree under `root`, numbered breadth-first"""
+    records = array.array('i')
+    kids = array.array('i')
+    nodes = [root]
+    index = 0
+    while index < len(nodes):
+        node = nodes[index]
+        index += 1
+        if node.value is not None and not isinstance(node.value, str):
+            raise ValueError(f'Cannot serialize {node.type.value} node value {node.value!r}')
+        value = intern(node.value) if node.value is not None else NO_OPERAND
+        left = right = NO_NODE
+        if node.left is not None:
+            left = len(nodes)
+            nodes.append(node.left)
+        if node.right is not None:
+            right = len(nodes)
+            nodes.append(node.right)
+        first = len(kids)
+        for child in node.children:
+            if child is None:
+                kids.append(NO_NODE)
+                continue
+            kids.append(len(nodes))
+            nodes.append(child)
+        records.extend((intern(node.type.value), value, left, right, first, len(node.children)))
+    return records, kids
+
+
+def dumps(code=None, ast=None, tokens=None):
+    """File contents for any of a QuadBuffer, an AST root and a TokenArray"""
+    # Keep the TAC's string indexes, since its operands carry them.
+    strings = string_table(code.strings.strings) if code is not None else StringTable()
+    sections = []
+    if ast is not None:
+        records, kids = node_records(ast, strings.intern)
+        sections += [(b'NODE', little_endian(records)), (b'KIDS', little_endian(kids))]
+    if code is not None:
+        sections += [(b'QUAD', little_endian(array.array('i', code.quads))),
+                     (b'ARGS', little_endian(array.array('i', code.arg_pool)))]
+    if tokens is not None:
+        if not isinstance(tokens, TokenArray):
+            raise ValueError('Only a TokenArray (Lexer.tokenize_compact) can be serialized')
+        sections.append((b'SRC ', tokens.source_code.encode()))
+        for column, tag, typecode in TOKEN_COLUMNS:
+            sections.append((tag, little_endian(array.array(typecode, getattr(tokens, column)))))
+    encoded = [text.encode() for text in strings.strings]
+    offsets = array.array('I')
+    end = 0
+    for data in encoded:
+        end += len(data)
+        offsets.append(end)
+    sections[:0] = [(b'STRO', little_endian(offsets)), (b'STRB', b''.join(encoded))]
+
+    parts = []
+    position = HEADER.size + DIRECTORY_ENTRY.size * len(sections)
+    directory = []
+    for tag, data in sections:
+        padding = -position % ALIGNMENT
+        parts.append(b'\0' * padding)
+        position += padding
+        directory.append(DIRECTORY_ENTRY.pack(tag, position, len(data)))
+        parts.append(data)
+        position += len(data)
+    return b''.join([HEADER.pack(MAGIC, FORMAT_VERSION, len(sections))] + directory + parts)
+
+
+def save(path, code=None, ast=None, tokens=None):
+    with open(path, 'wb') as artifact_file:
+        artifact_file.write(dumps(code, ast, tokens))
+
+
+class MappedStrings:
+    """Read-only sequence over a mapped string table, decoding entries on first use"""
+    __slots__ = ('offsets', 'blob', 'decoded')
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+        self.decoded = {}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        text = self.decoded.get(index)
+        if text is None:
+            if index < 0:
+                index += len(self.offsets)
+            start = self.offsets[index - 1] if index else 0
+            text = self.decoded[index] = str(self.blob[start:self.offsets[index]], 'utf-8')
+        return text
+
+    def __iter__(self):
+        for index in range(len(self.offsets)):
+            yield self[index]
+
+
+class MappedStringTable(StringTable):
+    """StringTable over a mapped file; the first intern() copies the strings out"""
+
+    def __init__(self, strings):
+        self.strings = strings
+        self.index = None
+
+    def intern(self, text):
+        if self.index is None:
+            self.strings = list(self.strings)
+            self.index = {entry: position for position, entry in enumerate(self.strings)}
+        return super().intern(text)
+
+    def __reduce__(self):
+        return string_table, (list(self.strings),)
+
+
+class MappedTree:
+    """The AST sections of an Artifact, shared by its MappedNodes"""
+    __slots__ = ('nodes', 'kids', 'strings', 'types')
+
+    def __init__(self, nodes, kids, strings):
+        self.nodes = nodes
+        self.kids = kids
+        self.strings = strings
+        self.types = {}
+
+    def node_type(self, index):
+        node_type = self.types.get(index)
+        if node_type is None:
+            node_type = self.types[index] = NodeType(self.strings.strings[index])
+        return node_type
+
+
+class MappedNode:
+    """Read-only ASTNode over one record of an Artifact"""
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    def field(self, offset):
+        return self.tree.nodes[self.index * NODE_WIDTH + offset]
+
+    def node(self, index):
+        return MappedNode(self.tree, index) if index != NO_NODE else None
+
+    @property
+    def type(self):
+        return self.tree.node_type(self.field(TYPE))
+
+    @property
+    def value(self):
+        value = self.field(VALUE)
+        return self.tree.strings.strings[value] if value != NO_OPERAND else None
+
+    @property
+    def left(self):
+        return self.node(self.field(LEFT))
+
+    @property
+    def right(self):
+        return self.node(self.field(RIGHT))
+
+    @property
+    def children(self):
+        first = self.field(FIRST_CHILD)
+        return [self.node(index) for index in self.tree.kids[first:first + self.field(CHILD_COUNT)]]
+
+
+class Artifact:
+    """A serialized file mapped into memory"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as artifact_file:
+            self.map = mmap.mmap(artifact_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.sections = self.read_directory()
+        self.open_views()
+
+    def open_views(self, strings=None):
+        """Views of the map kept by the artifact itself; `strings` reuses a string table"""
+        self.memory = memoryview(self.map)
+        if strings is None:
+            strings = MappedStringTable(MappedStrings(self.section(b'STRO', 'I'), self.section(b'STRB')))
+        self.strings = strings
+        nodes = self.section(b'NODE', 'i')
+        self.tree = MappedTree(nodes, self.section(b'KIDS', 'i'), strings) if nodes is not None and len(nodes) else None
+
+    def read_directory(self):
+        if len(self.map) < HEADER.size:
+            raise ValueError('Not a serialized artifact: file too short')
+        magic, version, count = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError('Not a serialized artifact: bad magic number')
+        if version != FORMAT_VERSION:
+            raise ValueError(f'Artifact format {version} is not supported (expected {FORMAT_VERSION})')
+        if len(self.map) < HEADER.size + DIRECTORY_ENTRY.size * count:
+            raise ValueError('Truncated artifact directory')
+        sections = {}
+        for position in range(HEADER.size, HEADER.size + DIRECTORY_ENTRY.size * count, DIRECTORY_ENTRY.size):
+            tag, offset, size = DIRECTORY_ENTRY.unpack_from(self.map, position)
+            if offset + size > len(self.map):
+                raise ValueError(f'Truncated artifact section {tag.decode()}')
+            sections[tag] = (offset, size)
+        return sections
+
+    def section(self, tag, typecode=None):
+        """View of section `tag` as an array of `typecode` (bytes if None), or None if absent"""
+        if self.map.closed:
+            raise ValueError('Artifact is closed')
+        if tag not in self.sections:
+            return None
+        offset, size = self.sections[tag]
+        view = self.memory[offset:offset + size]
+        if typecode is None:
+            return view
+        if sys.byteorder == 'big' and typecode not in 'bB':
+            values = array.array(typecode, view.tobytes())
+            values.byteswap()
+            return values
+        return view.cast(typecode)
+
+    def code(self):
+        """The TAC as a read-only QuadBuffer, or None if the file has none"""
+        quads = self.section(b'QUAD', 'i')
+        if quads is None:
+            return None
+        code = QuadBuffer(self.strings)
+        code.quads = quads
+        code.arg_pool = self.section(b'ARGS', 'i')
+        return code
+
+    def ast(self):
+        """Root MappedNode, or None if the file has no AST"""
+        if self.map.closed:
+            raise ValueError('Artifact is closed')
+        return MappedNode(self.tree, 0) if self.tree is not None else None
+
+    def tokens(self):
+        """The tokens as a TokenArray, or None if the file has none"""
+        source = self.section(b'SRC ')
+        if source is None:
+            return None
+        tokens = TokenArray(str(source, 'utf-8'))
+        for column, tag, typecode in TOKEN_COLUMNS:
+            setattr(tokens, column, self.section(tag, typecode))
+        return tokens
+
+    def close(self):
+        """Unmap the file.
+
+        Raises BufferError, leaving the artifact open and unchanged, while
+        code, tokens or nodes taken from it are still referenced.
+        """
+        if self.map.closed:
+            return
+        # The artifact's own views hold the map too; drop them to find out
+        # whether anything else does, keeping the string table that code
+        # taken from the artifact may share.
+        strings = weakref.ref(self.strings)
+        self.strings = self.tree = None
+        self.memory.release()
+        try:
+            self.map.close()
+        except BufferError:
+            self.open_views(strings())
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self.close()
+        except BufferError:
+            # Views taken inside the block are still in use; the map goes
+            # with the last of them.
+            pass
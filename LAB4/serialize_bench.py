@@ -0,0 +1,80 @@
+"""Saving and reopening large TAC: pickle against serialize.py.
+
+Usage: python3 serialize_bench.py [instructions]
+
+The TAC of compile_bench's expressions program is repeated until it has
+`instructions` instructions, then written and read back with pickle and
+with the mapped binary format.  "open + 1" reopens the file and renders
+one instruction in the middle; "open + all" decodes every instruction.
+"""
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+from compile_bench import generate
+from parser import compile_source
+from serialize import Artifact, save
+from tac import POOLED, QUAD_WIDTH, QuadBuffer
+
+
+def repeated_code(instructions):
+    code = compile_source(generate('expressions', 0.25))
+    result = QuadBuffer(code.strings)
+    while len(result) < instructions:
+        # Offsetting call arguments keeps every CALL pointing at its own.
+        offset = len(result.arg_pool)
+        for index in range(min(len(code), instructions - len(result))):
+            quad = code.quads[index * QUAD_WIDTH:(index + 1) * QUAD_WIDTH]
+            if quad[0] in POOLED:
+                quad[3] += offset
+            result.quads.extend(quad)
+        result.arg_pool.extend(code.arg_pool)
+    return result
+
+
+def timed(action):
+    start = time.perf_counter()
+    result = action()
+    return result, time.perf_counter() - start
+
+
+def main(instructions):
+    code = repeated_code(instructions)
+    middle = len(code) // 2
+    directory = tempfile.mkdtemp()
+    pickle_path = os.path.join(directory, 'code.pickle')
+    binary_path = os.path.join(directory, 'code.skb')
+
+    def pickle_save():
+        with open(pickle_path, 'wb') as pickle_file:
+            pickle.dump(code, pickle_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def pickle_open():
+        with open(pickle_path, 'rb') as pickle_file:
+            return pickle.load(pickle_file)
+
+    rows = []
+    for label, write, reopen, path in (('pickle', pickle_save, pickle_open, pickle_path),
+                                       ('serialize', lambda: save(binary_path, code),
+                                        lambda: Artifact(binary_path).code(), binary_path)):
+        _, saving = timed(write)
+        loaded, opening = timed(reopen)
+        if loaded.render(middle) != code.render(middle):
+            raise ValueError(f'{label}: instruction {middle} did not round-trip')
+        del loaded
+        _, one = timed(lambda: reopen().render(middle))
+        _, everything = timed(lambda: reopen().instructions())
+        rows.append((label, os.path.getsize(path), saving, opening, one, everything))
+        os.unlink(path)
+    os.rmdir(directory)
+
+    print(f'{len(code)} instructions\n')
+    print(f'{"format":<12}{"MiB":>8}{"save s":>10}{"open s":>10}{"open + 1 s":>12}{"open + all s":>14}')
+    for label, size, saving, opening, one, everything in rows:
+        print(f'{label:<12}{size / 2 ** 20:>8.1f}{saving:>10.4f}{opening:>10.4f}{one:>12.4f}{everything:>14.3f}')
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,347 @@
+"""SSA construction and dominator-based global value numbering.
+
+    code = eliminate_redundancy(compile_source(source))
+
+Each function's CFG is put into pruned SSA form: phis are placed on the
+iterated dominance frontier of a variable's definitions, but only in
+blocks where it is live on entry.  Renaming walks the dominator tree.
+Value numbering then walks the same tree with a scoped table of
+available expressions.  It folds constants, turns redundant
+computations into copies of the value computed earlier and rewrites
+uses to that earlier value.
+
+Out of SSA, every version maps back to the variable it came from.  That
+is only sound if no two versions of a variable are live at once, so a
+use is only redirected to a constant or to a variable with a single
+definition.  Versions of other variables never have their live ranges
+extended and can share one name again.  Variables are local to their
+function, so calls do not kill values held in names.  Array loads are
+only reused within a block and until the next store to that array.
+"""
+
+from cfg import build_cfgs, liveness
+from parser import COMPARISONS, evaluate_arithmetic, number_value
+from tac import (CONST, CONVERSIONS, GENERIC_OPERATORS, NAME, NO_OPERAND, OPERATORS, Op, QuadBuffer, TEMP,
+                 operand_kind, temp_operand)
+
+COMMUTATIVE = ('+', '*', '==', '!=', 'iadd', 'imul', 'ieq', 'ine', 'fadd', 'fmul', 'feq', 'fne')
+# Phi argument slot for the edge into the entry block from the caller.
+ENTRY_EDGE = -1
+
+
+def is_variable(operand):
+    return operand != NO_OPERAND and operand_kind(operand) in (TEMP, NAME)
+
+
+def plain(value):
+    """`value`, or None for a float that has no literal spelling"""
+    if isinstance(value, float):
+        spelling = repr(value)
+        if '.' not in spelling or 'e' in spelling:
+            return None
+    return value
+
+
+class Phi:
+    __slots__ = ('variable', 'result', 'args')
+
+    def __init__(self, variable):
+        self.variable = variable
+        self.result = variable
+        # Incoming value per predecessor block index.
+        self.args = {}
+
+
+class SSAFunction:
+    def __init__(self, graph, code, next_temp):
+        """SSA form of one ControlFlowGraph; new values are temps from `next_temp` up"""
+        self.graph = graph
+        self.code = code
+        self.next_temp = next_temp
+        self.phis = [[] for _ in graph.blocks]
+        # SSA value -> the variable it is a version of.
+        self.origin = {}
+        self.versions = {}
+        graph.compute_dominators()
+        self.children = graph.dominator_tree()
+        self.place_phis()
+        self.rename()
+
+    # Construction
+
+    def dominance_frontiers(self):
+        idom = self.graph.idom
+        frontiers = [set() for _ in self.graph.blocks]
+        for block in self.graph.blocks:
+            if len(block.predecessors) < 2 or idom[block.index] is None:
+                continue
+            for predecessor in block.predecessors:
+                runner = predecessor.index
+                while idom[runner] is not None and runner != idom[block.index]:
+                    frontiers[runner].add(block.index)
+                    if runner == idom[runner]:
+                        break
+                    runner = idom[runner]
+        return frontiers
+
+    def place_phis(self):
+        index, live, _ = liveness(self.graph, is_variable)
+        frontiers = self.dominance_frontiers()
+        definitions = {}
+        for block in self.graph.blocks:
+            for instruction in block.instructions:
+                defined = instruction.defined()
+                if is_variable(defined):
+                    definitions.setdefault(defined, set()).add(block.index)
+        for variable, blocks in definitions.items():
+            bit = 1 << index[variable]
+            placed = set()
+            worklist = list(blocks)
+            while worklist:
+                block = worklist.pop()
+                for frontier in frontiers[block]:
+                    if frontier in placed or not live[frontier] & bit:
+                        continue
+                    placed.add(frontier)
+                    self.phis[frontier].append(Phi(variable))
+                    if frontier not in blocks:
+                        worklist.append(frontier)
+
+    def new_value(self, variable):
+        self.next_temp += 1
+        value = temp_operand(self.next_temp)
+        self.origin[value] = variable
+        self.versions[variable] = self.versions.get(variable, 0) + 1
+        return value
+
+    def rename(self):
+        """Give every definition its own value, walking the dominator tree"""
+        blocks = self.graph.blocks
+        stacks = {}
+        initial_used = set()
+
+        def current(variable):
+            stack = stacks.get(variable)
+            if stack:
+                return stack[-1]
+            initial_used.add(variable)
+            return variable
+
+        for phi in self.phis[self.graph.entry.index]:
+            phi.args[ENTRY_EDGE] = current(phi.variable)
+
+        # (block index, definitions to pop), with None marking the exit.
+        work = [(self.graph.entry.index, None)]
+        while work:
+            index, pushed = work.pop()
+            if pushed is not None:
+                for variable in pushed:
+                    stacks[variable].pop()
+                continue
+            pushed = []
+            for phi in self.phis[index]:
+                phi.result = self.new_value(phi.variable)
+                stacks.setdefault(phi.variable, []).append(phi.result)
+                pushed.append(phi.variable)
+            for instruction in blocks[index].instructions:
+                mapping = {operand: current(operand) for operand in instruction.uses() if is_variable(operand)}
+                if mapping:
+                    instruction.replace_uses(mapping)
+                defined = instruction.defined()
+                if is_variable(defined):
+                    instruction.result = self.new_value(defined)
+                    stacks.setdefault(defined, []).append(instruction.result)
+                    pushed.append(defined)
+            for successor in blocks[index].successors:
+                for phi in self.phis[successor.index]:
+                    phi.args[index] = current(phi.variable)
+            work.append((index, pushed))
+            for child in reversed(self.children[index]):
+                work.append((child, None))
+
+        for variable in initial_used:
+            self.versions[variable] = self.versions.get(variable, 0) + 1
+
+    # Value numbering
+
+    def variable(self, value):
+        return self.origin.get(value, value)
+
+    def is_safe(self, operand):
+        """True if uses of any value may be redirected to `operand`"""
+        return operand_kind(operand) == CONST or self.versions.get(self.variable(operand), 0) <= 1
+
+    def constant(self, operand):
+        if operand_kind(operand) != CONST:
+            return None
+        text = self.code.operand_text(operand)
+        if text in ('true', 'false'):
+            return text == 'true'
+        return number_value(text)
+
+    def constant_operand(self, value):
+        if isinstance(value, bool):
+            return self.code.const('true' if value else 'false')
+        return self.code.const(repr(value))
+
+    def fold(self, instruction, leaders):
+        """Constant result of a BINARY/UNARY on constant operands, or None"""
+        operator = OPERATORS[instruction.operator]
+        left = self.constant(leaders[0])
+        if left is None:
+            return None
+        right = self.constant(leaders[1]) if instruction.op == Op.BINARY else None
+        if operator in GENERIC_OPERATORS:
+            # Typed operators only fold operands of their own type.
+            operand_type = float if operator[0] == 'f' else int
+            if type(left) is not operand_type or instruction.op == Op.BINARY and type(right) is not operand_type:
+                return None
+            operator = GENERIC_OPERATORS[operator]
+        if instruction.op == Op.UNARY:
+            if operator in CONVERSIONS:
+                if isinstance(left, bool):
+                    return None
+                try:
+                    return plain(float(left) if operator == 'itof' else int(left))
+                except OverflowError:
+                    return None
+            if operator == '-' and not isinstance(left, bool):
+                return plain(-left)
+            if operator == '!' and isinstance(left, bool):
+                return not left
+            return None
+        if right is None or isinstance(left, bool) != isinstance(right, bool):
+            return None
+        if operator in COMPARISONS:
+            if isinstance(left, bool) and operator not in ('==', '!='):
+                return None
+            return COMPARISONS[operator](left, right)
+        if isinstance(left, bool):
+            return None
+        value = evaluate_arithmetic(operator, left, right)
+        return None if value is None else plain(value)
+
+    def number_values(self):
+        """Dominator-based value numbering over the whole function"""
+        blocks = self.graph.blocks
+        leader = {}
+        table = {}
+
+        def lead(operand):
+            return leader.get(operand, operand)
+
+        work = [(self.graph.entry.index, None)]
+        while work:
+            index, added = work.pop()
+            if added is not None:
+                for key in added:
+                    del table[key]
+                continue
+            added = []
+            for phi in self.phis[index]:
+                incoming = {lead(value) for value in phi.args.values()}
+                if len(incoming) == 1:
+                    only = incoming.pop()
+                    if self.is_safe(only):
+                        leader[phi.result] = only
+                    continue
+                key = ('phi', index) + tuple(lead(phi.args[block]) for block in sorted(phi.args))
+                if key in table:
+                    leader[phi.result] = table[key]
+                elif self.is_safe(phi.result):
+                    table[key] = phi.result
+                    added.append(key)
+
+            array_versions = {}
+            for instruction in blocks[index].instructions:
+                mapping = {}
+                for operand in instruction.uses():
+                    operand_leader = lead(operand)
+                    if operand_leader != operand and self.is_safe(operand_leader):
+                        mapping[operand] = operand_leader
+                if mapping:
+                    instruction.replace_uses(mapping)
+                op = instruction.op
+                if op == Op.STORE or op == Op.ARRAY:
+                    array_versions[instruction.result] = array_versions.get(instruction.result, 0) + 1
+                    continue
+                if op == Op.COPY:
+                    source = lead(instruction.arg1)
+                    if self.is_safe(source):
+                        leader[instruction.result] = source
+                    continue
+                if op == Op.BINARY or op == Op.UNARY:
+                    leaders = (lead(instruction.arg1), lead(instruction.arg2))
+                    value = self.fold(instruction, leaders)
+                    if value is not None:
+                        self.make_copy(instruction, self.constant_operand(value))
+                        leader[instruction.result] = instruction.arg1
+                        continue
+                    if OPERATORS[instruction.operator] in COMMUTATIVE and leaders[1] < leaders[0]:
+                        leaders = (leaders[1], leaders[0])
+                    key = (op, instruction.operator) + leaders
+                elif op == Op.LOAD:
+                    array = instruction.arg1
+                    key = (op, index, array, array_versions.get(array, 0), lead(instruction.arg2))
+                else:
+                    continue
+                if key in table:
+                    self.make_copy(instruction, table[key])
+                    leader[instruction.result] = table[key]
+                elif self.is_safe(instruction.result):
+                    table[key] = instruction.result
+                    added.append(key)
+
+            work.append((index, added))
+            for child in reversed(self.children[index]):
+                work.append((child, None))
+
+    def make_copy(self, instruction, source):
+        instruction.op = Op.COPY
+        instruction.arg1 = source
+        instruction.arg2 = NO_OPERAND
+        instruction.operator = 0
+
+    # Out of SSA
+
+    def lower(self):
+        """Instructions with every value renamed back to its variable"""
+        lowered = []
+        for block in self.graph.blocks:
+            for instruction in block.instructions:
+                mapping = {operand: self.variable(operand) for operand in instruction.uses()
+                           if operand in self.origin}
+                if mapping:
+                    instruction.replace_uses(mapping)
+                defined = instruction.defined()
+                if defined in self.origin:
+                    instruction.result = self.origin[defined]
+                if instruction.op == Op.COPY and instruction.result == instruction.arg1:
+                    continue
+                lowered.append(instruction)
+        return lowered
+
+
+def largest_temp(instructions):
+    largest = 0
+    for instruction in instructions:
+        for operand in instruction.uses() + [instruction.defined()]:
+            if is_variable(operand) and operand_kind(operand) == TEMP:
+                largest = max(largest, operand >> 2)
+    return largest
+
+
+def eliminate_redundancy(code):
+    """Run SSA value numbering over every function of the QuadBuffer `code`"""
+    next_temp = largest_temp(code.instructions())
+    result = QuadBuffer(code.strings)
+    for graph in build_cfgs(code):
+        function = SSAFunction(graph, result, next_temp)
+        function.number_values()
+        if graph.name is not None:
+            result.emit_function(result.name(graph.name), graph.params)
+        for instruction in function.lower():
+            result.append(instruction)
+        if graph.name is not None:
+            result.emit(Op.END_FUNCTION)
+    return result
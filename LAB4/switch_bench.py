@@ -0,0 +1,63 @@
+"""VM cost of switch dispatch by lowering.
+
+Usage: python3 switch_bench.py [cases]
+
+A state machine with `cases` states steps through a switch a fixed
+number of times.  Its states are numbered densely (0, 1, 2, ...) and
+sparsely (0, 10, 20, ...), and each is compiled with the switch lowered
+to a chain of equality tests, a binary search and, where the values are
+dense enough, a jump table.
+"""
+import sys
+import time
+
+from lexer import Lexer
+from optimizer import optimize
+from parser import ConstantFolder, Parser, ThreeAddressCodeGenerator
+from vm import VirtualMachine
+
+STEPS = 20000
+# Generator arguments that force each lowering.
+LOWERINGS = (('chain', {'table_min_cases': sys.maxsize, 'search_min_cases': sys.maxsize}),
+             ('binary search', {'table_min_cases': sys.maxsize}),
+             ('default', {}))
+
+
+def state_machine(cases, spacing):
+    lines = ['function main() {', '    int state = 0;', '    int total = 0;', '    int step = 0;',
+             f'    while (step < {STEPS}) {{', '        switch (state) {']
+    for case in range(cases):
+        following = (case * 37 + 11) % cases
+        lines.append(f'            case {case * spacing}: state = {following * spacing}; total = total + {case % 7}; break;')
+    lines += ['            default: state = 0;', '        }', '        step = step + 1;', '    }',
+              '    return total;', '}']
+    return '\n'.join(lines)
+
+
+def compile_with(source, options):
+    ast = ConstantFolder().fold(Parser(Lexer(source).iter_tokens()).parse())
+    generator = ThreeAddressCodeGenerator(**options)
+    generator.generate_code(ast)
+    return optimize(generator.code)
+
+
+def main(cases):
+    print(f'{cases}-state machine, {STEPS} steps\n')
+    print(f'{"states":<8}{"lowering":<16}{"static":>8}{"executed":>12}{"seconds":>10}')
+    for states, spacing in (('dense', 1), ('sparse', 10)):
+        source = state_machine(cases, spacing)
+        expected = None
+        for label, options in LOWERINGS:
+            code = compile_with(source, options)
+            machine = VirtualMachine(code)
+            start = time.perf_counter()
+            total = machine.call('main')
+            elapsed = time.perf_counter() - start
+            if expected is not None and total != expected:
+                raise ValueError(f'{states} {label}: returned {total}, expected {expected}')
+            expected = total
+            print(f'{states:<8}{label:<16}{len(code):>8}{machine.executed:>12}{elapsed:>10.3f}')
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
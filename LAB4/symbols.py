@@ -0,0 +1,160 @@
+"""Scoped symbol table.
+
+Every function body, block and the top-level statements get a Scope, a
+hash map from interned names to Symbols that is kept after the scope is
+closed, so later passes can still walk the tree of scopes.  While the
+program is walked, `visible` maps each name to the stack of symbols that
+currently declare it, so a lookup is one dict access whatever the
+nesting depth.
+
+The first symbol called `name` in a function keeps that name; later
+ones, such as an inner `int x` shadowing an outer one, are given the
+unique name `name.N`, which the lexer cannot produce.  Code generators
+emit `unique`, so every declaration is a variable of its own.
+
+Names that are used without a declaration are declared implicitly in
+the enclosing function with no type, since undeclared variables have
+always been accepted.
+"""
+import sys
+
+VARIABLE = 'variable'
+ARRAY = 'array'
+PARAMETER = 'parameter'
+FUNCTION = 'function'
+IMPLICIT = 'implicit'
+
+
+class Symbol:
+    __slots__ = ('name', 'kind', 'type', 'size', 'params', 'unique', 'scope')
+
+    def __init__(self, name, kind, type=None, size=None, params=None):
+        self.name = name
+        self.kind = kind
+        # 'int', 'float' or 'bool'; None for implicit variables and functions.
+        self.type = type
+        # Element count of an array.
+        self.size = size
+        # Parameter types of a function.
+        self.params = params
+        self.unique = name
+        self.scope = None
+
+    def __repr__(self):
+        return f'Symbol({self.unique!r}, {self.kind}, {self.type})'
+
+
+class Scope:
+    __slots__ = ('parent', 'function', 'symbols', 'children', 'names')
+
+    def __init__(self, parent, function=False):
+        self.parent = parent
+        # The scope of the enclosing function: itself for a function or
+        # the top-level statements, else the parent's.
+        self.function = self if function or parent is None else parent.function
+        self.symbols = {}
+        self.children = []
+        # Name -> symbols called that so far, in a function's scope.
+        self.names = {}
+        if parent is not None:
+            parent.children.append(self)
+
+    def all_symbols(self):
+        """Symbols of this scope and every scope nested in it"""
+        found = []
+        stack = [self]
+        while stack:
+            scope = stack.pop()
+            found.extend(scope.symbols.values())
+            stack.extend(reversed(scope.children))
+        return found
+
+
+class SymbolTable:
+    def __init__(self):
+        self.global_scope = Scope(None, function=True)
+        self.current = self.global_scope
+        # Variable name -> symbols declaring it, innermost last.
+        self.visible = {}
+        # Function name (None for the top level) -> its Scope; the
+        # function Symbols are in global_scope.
+        self.functions = {}
+        # (current, visible) of the code around each open function.
+        self.saved = []
+
+    def enter(self, function=False):
+        self.current = Scope(self.current, function)
+        return self.current
+
+    def exit(self):
+        scope = self.current
+        for name in scope.symbols:
+            stack = self.visible[name]
+            stack.pop()
+            if not stack:
+                del self.visible[name]
+        self.current = scope.parent
+        return scope
+
+    def lookup(self, name):
+        """Innermost visible Symbol called `name`, or None"""
+        stack = self.visible.get(name)
+        return stack[-1] if stack else None
+
+    def declare(self, name, kind, type=None, size=None, scope=None):
+        """Add a variable to `scope` (default: the current one)"""
+        scope = scope or self.current
+        name = sys.intern(name)
+        symbol = scope.symbols.get(name)
+        if symbol is not None:
+            if symbol.kind != IMPLICIT:
+                raise ValueError(f'{name} is already declared in this scope')
+            # Used before its declaration: it is the same variable.
+            symbol.kind = kind
+            symbol.type = type
+            symbol.size = size
+            return symbol
+        symbol = Symbol(name, kind, type, size)
+        symbol.scope = scope
+        owner = scope.function
+        count = owner.names[name] = owner.names.get(name, 0) + 1
+        if count > 1:
+            symbol.unique = f'{name}.{count}'
+        scope.symbols[name] = symbol
+        self.visible.setdefault(name, []).append(symbol)
+        return symbol
+
+    def resolve(self, name):
+        """Symbol a use of `name` refers to, declaring it implicitly if needed"""
+        stack = self.visible.get(name)
+        if stack:
+            return stack[-1]
+        return self.declare(name, IMPLICIT, scope=self.current.function)
+
+    def enter_top_level(self):
+        """Open the scope of the top-level statements, which run as a function"""
+        scope = self.functions[None] = self.enter(function=True)
+        return scope
+
+    def enter_function(self, name, params):
+        """Declare function `name` with (name, type) params and open its scope
+
+        Functions live in the global scope, apart from variables, and see
+        none of the variables of the code around their declaration.  A
+        second definition replaces the first here; linking rejects it."""
+        name = sys.intern(name)
+        function = Symbol(name, FUNCTION, params=[param_type for _, param_type in params])
+        function.scope = self.global_scope
+        self.global_scope.symbols[name] = function
+        self.saved.append((self.current, self.visible))
+        self.current = self.global_scope
+        self.visible = {}
+        scope = self.functions[name] = self.enter(function=True)
+        for param_name, param_type in params:
+            self.declare(param_name, PARAMETER, param_type)
+        return scope
+
+    def exit_function(self):
+        scope = self.current
+        self.current, self.visible = self.saved.pop()
+        return scope
@@ -0,0 +1,407 @@
+"""Structured three-address code.
+
+Instructions are quadruples stored in one flat integer array, QUAD_WIDTH
+slots per instruction:
+
+    op      Op member
+    result  destination operand (array name for STORE)
+    arg1    first operand (array name for LOAD, callee for CALL)
+    arg2    second operand (index for LOAD, value for STORE,
+            first argument slot for CALL and FUNCTION)
+    oper    index into OPERATORS (argument count for CALL and FUNCTION)
+    target  label number for LABEL/GOTO/IF_GOTO (the default of a
+            JUMP_TABLE), NO_LABEL for a hole
+
+FUNCTION opens a function body (arg1 is its name, the argument slots
+hold its parameters) and END_FUNCTION closes it.  ARRAY allocates the
+array named by result with arg1 elements, each set to the constant arg2.
+JUMP_TABLE jumps to the arg1-th of its labels, which are kept in the
+argument slots like call arguments, or to target if arg1 is out of range.
+
+Operands are small integers: temps carry their number, names and
+constants carry an index into a string table shared by every buffer
+derived from the same compile.  Text is only produced when an
+instruction is printed.
+"""
+import array
+import enum
+
+
+class Op(enum.IntEnum):
+    BINARY = 0
+    UNARY = 1
+    COPY = 2
+    LOAD = 3
+    STORE = 4
+    CALL = 5
+    RETURN = 6
+    LABEL = 7
+    GOTO = 8
+    IF_GOTO = 9
+    FUNCTION = 10
+    END_FUNCTION = 11
+    ARRAY = 12
+    JUMP_TABLE = 13
+
+
+# Typed operators, `i`/`f` + name: both operands are known to be ints or
+# floats.  itof and ftoi convert (ftoi truncates toward zero).  Generic
+# operators remain for operands whose type is only known at run time.
+TYPED_NAMES = {'+': 'add', '-': 'sub', '*': 'mul', '/': 'div', '==': 'eq', '!=': 'ne',
+               '<': 'lt', '>': 'gt', '<=': 'le', '>=': 'ge'}
+TYPE_PREFIXES = {'int': 'i', 'float': 'f'}
+GENERIC_OPERATORS = {prefix + name: operator for prefix in TYPE_PREFIXES.values()
+                     for operator, name in TYPED_NAMES.items()}
+GENERIC_OPERATORS.update({'ineg': '-', 'fneg': '-'})
+CONVERSIONS = ('itof', 'ftoi')
+
+OPERATORS = (('+', '-', '*', '/', '==', '!=', '<', '>', '<=', '>=', '!', '&&', '||')
+             + tuple(GENERIC_OPERATORS) + CONVERSIONS)
+OPERATOR_INDEX = {operator: index for index, operator in enumerate(OPERATORS)}
+FIRST_TYPED = OPERATOR_INDEX['iadd']
+
+QUAD_WIDTH = 6
+RESULT, ARG1, ARG2, OPER, TARGET = 1, 2, 3, 4, 5
+
+# Operand encoding: (payload << 2) | kind.
+TEMP = 0
+NAME = 1
+CONST = 2
+NO_OPERAND = -1
+NO_LABEL = -1
+
+# The lexer has no boolean literals, so `true`/`false` arrive as
+# identifiers; they are interned as constants.
+BOOLEAN_LITERALS = ('true', 'false')
+
+
+# Instructions whose result operand receives a value.
+VALUE_DEFINITIONS = (Op.BINARY, Op.UNARY, Op.COPY, Op.LOAD, Op.CALL)
+JUMPS = (Op.GOTO, Op.IF_GOTO, Op.JUMP_TABLE)
+# Instructions whose argument slots are kept in the argument pool.
+POOLED = (Op.CALL, Op.FUNCTION, Op.JUMP_TABLE)
+
+
+def typed_operator(operator, type, unary=False):
+    """Index of the `type` ('int' or 'float') variant of a generic operator"""
+    return OPERATOR_INDEX[TYPE_PREFIXES[type] + ('neg' if unary else TYPED_NAMES[operator])]
+
+
+def temp_operand(number):
+    return number << 2 | TEMP
+
+
+def operand_kind(operand):
+    return operand & 3
+
+
+def is_temp(operand):
+    return operand >= 0 and operand & 3 == TEMP
+
+
+class StringTable:
+    """Interned names and constant spellings"""
+
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def intern(self, text):
+        index = self.index.get(text)
+        if index is None:
+            index = self.index[text] = len(self.strings)
+            self.strings.append(text)
+        return index
+
+
+class Instruction:
+    """One decoded, mutable instruction, for passes that rewrite code.
+
+    CALL and FUNCTION keep their argument operands in `args` instead of
+    the argument pool, and JUMP_TABLE its labels.
+    """
+    __slots__ = ('op', 'result', 'arg1', 'arg2', 'operator', 'target', 'args')
+
+    def __init__(self, op, result=NO_OPERAND, arg1=NO_OPERAND, arg2=NO_OPERAND,
+                 operator=0, target=NO_LABEL, args=None):
+        self.op = op
+        self.result = result
+        self.arg1 = arg1
+        self.arg2 = arg2
+        self.operator = operator
+        self.target = target
+        self.args = args
+
+    def defined(self):
+        """Operand this instruction assigns, or NO_OPERAND"""
+        return self.result if self.op in VALUE_DEFINITIONS else NO_OPERAND
+
+    def labels(self):
+        """Labels a jump may go to"""
+        if self.op == Op.JUMP_TABLE:
+            return self.args + [self.target]
+        return [self.target]
+
+    def retarget(self, mapping):
+        """Rewrite jump labels through `mapping`; return True if any changed"""
+        changed = False
+        if self.target in mapping:
+            self.target = mapping[self.target]
+            changed = True
+        if self.op == Op.JUMP_TABLE:
+            for position, label in enumerate(self.args):
+                if label in mapping:
+                    self.args[position] = mapping[label]
+                    changed = True
+        return changed
+
+    def uses(self):
+        """Value operands read by this instruction.
+
+        Array names (LOAD, STORE) and the callee of a CALL are not values
+        and are left out.
+        """
+        op = self.op
+        if op == Op.BINARY or op == Op.IF_GOTO:
+            operands = (self.arg1, self.arg2)
+        elif op == Op.UNARY or op == Op.COPY or op == Op.RETURN or op == Op.JUMP_TABLE:
+            operands = (self.arg1,)
+        elif op == Op.LOAD:
+            operands = (self.arg2,)
+        elif op == Op.STORE:
+            operands = (self.arg1, self.arg2)
+        elif op == Op.CALL:
+            operands = self.args
+        else:
+            return []
+        return [operand for operand in operands if operand != NO_OPERAND]
+
+    def replace_uses(self, mapping):
+        """Rewrite used operands through `mapping`; return True if any changed"""
+        op = self.op
+        changed = False
+        if op == Op.CALL:
+            for position, operand in enumerate(self.args):
+                if operand in mapping:
+                    self.args[position] = mapping[operand]
+                    changed = True
+            return changed
+        if (op in (Op.BINARY, Op.IF_GOTO, Op.UNARY, Op.COPY, Op.RETURN, Op.STORE, Op.JUMP_TABLE)
+                and self.arg1 in mapping):
+            self.arg1 = mapping[self.arg1]
+            changed = True
+        if op in (Op.BINARY, Op.IF_GOTO, Op.LOAD, Op.STORE) and self.arg2 in mapping:
+            self.arg2 = mapping[self.arg2]
+            changed = True
+        return changed
+
+
+class Quad:
+    """Read-only view of one instruction in a QuadBuffer"""
+    __slots__ = ('buffer', 'index')
+
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        self.index = index
+
+    def field(self, slot):
+        return self.buffer.quads[self.index * QUAD_WIDTH + slot]
+
+    @property
+    def op(self):
+        return Op(self.field(0))
+
+    @property
+    def result(self):
+        return self.field(RESULT)
+
+    @property
+    def arg1(self):
+        return self.field(ARG1)
+
+    @property
+    def arg2(self):
+        return self.field(ARG2)
+
+    @property
+    def operator(self):
+        return OPERATORS[self.field(OPER)]
+
+    @property
+    def target(self):
+        return self.field(TARGET)
+
+    @property
+    def args(self):
+        return self.buffer.call_args(self.index)
+
+    def __str__(self):
+        return self.buffer.render(self.index)
+
+    def __repr__(self):
+        return f'Quad({self.buffer.render(self.index)!r})'
+
+
+class QuadBuffer:
+    def __init__(self, strings=None):
+        self.quads = array.array('i')
+        self.arg_pool = array.array('i')
+        self.strings = strings if strings is not None else StringTable()
+
+    # Operand construction
+
+    def name(self, text):
+        kind = CONST if text in BOOLEAN_LITERALS else NAME
+        return self.strings.intern(text) << 2 | kind
+
+    def const(self, text):
+        return self.strings.intern(text) << 2 | CONST
+
+    def operand_text(self, operand):
+        if operand == NO_OPERAND:
+            return 'None'
+        if operand & 3 == TEMP:
+            return f't{operand >> 2}'
+        return self.strings.strings[operand >> 2]
+
+    # Emission
+
+    def emit(self, op, result=NO_OPERAND, arg1=NO_OPERAND, arg2=NO_OPERAND, operator=0, target=NO_LABEL):
+        """Append one instruction and return its index"""
+        self.quads.extend((op, result, arg1, arg2, operator, target))
+        return len(self.quads) // QUAD_WIDTH - 1
+
+    def emit_call(self, result, function, args):
+        start = len(self.arg_pool)
+        self.arg_pool.extend(args)
+        return self.emit(Op.CALL, result, function, start, len(args))
+
+    def emit_function(self, function, params):
+        start = len(self.arg_pool)
+        self.arg_pool.extend(params)
+        return self.emit(Op.FUNCTION, arg1=function, arg2=start, operator=len(params))
+
+    def emit_jump_table(self, index, labels, default=NO_LABEL):
+        """Jump to labels[index], or to `default` (patchable) outside the table"""
+        start = len(self.arg_pool)
+        self.arg_pool.extend(labels)
+        return self.emit(Op.JUMP_TABLE, arg1=index, arg2=start, operator=len(labels), target=default)
+
+    def append(self, instruction):
+        """Emit a decoded Instruction"""
+        if instruction.op == Op.CALL:
+            return self.emit_call(instruction.result, instruction.arg1, instruction.args)
+        if instruction.op == Op.FUNCTION:
+            return self.emit_function(instruction.arg1, instruction.args)
+        if instruction.op == Op.JUMP_TABLE:
+            return self.emit_jump_table(instruction.arg1, instruction.args, instruction.target)
+        return self.emit(instruction.op, instruction.result, instruction.arg1, instruction.arg2,
+                         instruction.operator, instruction.target)
+
+    def patch(self, index, label):
+        """Fill the jump target of instruction `index` if it is still a hole"""
+        slot = index * QUAD_WIDTH + TARGET
+        if self.quads[slot] == NO_LABEL:
+            self.quads[slot] = label
+
+    def call_args(self, index):
+        base = index * QUAD_WIDTH
+        start = self.quads[base + ARG2]
+        return list(self.arg_pool[start:start + self.quads[base + OPER]])
+
+    def instructions(self):
+        """Decode every instruction into a list of Instruction objects"""
+        quads = self.quads
+        decoded = []
+        for base in range(0, len(quads), QUAD_WIDTH):
+            op, result, arg1, arg2, operator, target = quads[base:base + QUAD_WIDTH]
+            op = Op(op)
+            if op in POOLED:
+                args = list(self.arg_pool[arg2:arg2 + operator])
+                decoded.append(Instruction(op, result, arg1, NO_OPERAND, 0, target, args))
+            else:
+                decoded.append(Instruction(op, result, arg1, arg2, operator, target))
+        return decoded
+
+    def __getstate__(self):
+        # Buffers loaded by serialize.Artifact view a mapped file; pickle copies.
+        state = self.__dict__.copy()
+        state['quads'] = array.array('i', self.quads)
+        state['arg_pool'] = array.array('i', self.arg_pool)
+        return state
+
+    @classmethod
+    def from_instructions(cls, instructions, strings=None):
+        buffer = cls(strings)
+        for instruction in instructions:
+            buffer.append(instruction)
+        return buffer
+
+    # Sequence protocol
+
+    def __len__(self):
+        return len(self.quads) // QUAD_WIDTH
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Quad(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('instruction index out of range')
+        return Quad(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield Quad(self, index)
+
+    # Text
+
+    def render(self, index):
+        op, result, arg1, arg2, operator, target = self.quads[index * QUAD_WIDTH:(index + 1) * QUAD_WIDTH]
+        text = self.operand_text
+        label = f'L{target}' if target != NO_LABEL else '?'
+        if op == Op.BINARY:
+            if operator >= FIRST_TYPED:
+                return f'{text(result)} = {OPERATORS[operator]} {text(arg1)}, {text(arg2)}'
+            return f'{text(result)} = {text(arg1)} {OPERATORS[operator]} {text(arg2)}'
+        if op == Op.UNARY:
+            if operator >= FIRST_TYPED:
+                return f'{text(result)} = {OPERATORS[operator]} {text(arg1)}'
+            return f'{text(result)} = {OPERATORS[operator]}{text(arg1)}'
+        if op == Op.COPY:
+            return f'{text(result)} = {text(arg1)}'
+        if op == Op.LOAD:
+            return f'{text(result)} = {text(arg1)}[{text(arg2)}]'
+        if op == Op.STORE:
+            return f'{text(result)}[{text(arg1)}] = {text(arg2)}'
+        if op == Op.CALL:
+            args = ', '.join(text(arg) for arg in self.call_args(index))
+            return f'{text(result)} = call {text(arg1)}({args})'
+        if op == Op.RETURN:
+            return f'return {text(arg1)}' if arg1 != NO_OPERAND else 'return'
+        if op == Op.LABEL:
+            return f'label {label}'
+        if op == Op.GOTO:
+            return f'goto {label}'
+        if op == Op.IF_GOTO:
+            if operator >= FIRST_TYPED:
+                return f'if {OPERATORS[operator]} {text(arg1)}, {text(arg2)} goto {label}'
+            return f'if {text(arg1)} {OPERATORS[operator]} {text(arg2)} goto {label}'
+        if op == Op.FUNCTION:
+            params = ', '.join(text(param) for param in self.call_args(index))
+            return f'function {text(arg1)}({params})'
+        if op == Op.END_FUNCTION:
+            return 'end function'
+        if op == Op.ARRAY:
+            return f'{text(result)} = array({text(arg1)}, {text(arg2)})'
+        if op == Op.JUMP_TABLE:
+            labels = ', '.join(f'L{entry}' for entry in self.call_args(index))
+            return f'goto table[{text(arg1)}] ({labels}) else {label}'
+        raise ValueError(f'Unknown opcode: {op}')
+
+    def lines(self):
+        return [self.render(index) for index in range(len(self))]
+
+    def __str__(self):
+        return '\n'.join(self.lines())
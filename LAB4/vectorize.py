@@ -0,0 +1,360 @@
+"""Run simple counted array loops as NumPy vector operations.
+
+    plan = analyze_loop(while_node)     # None unless the loop qualifies
+    new_i = plan.run(i, bound, scalars, arrays)
+
+A loop qualifies if it has the form
+
+    while (i < n) {             // or i <= n
+        a[2 * i + k] = b[i] * c + a[2 * i + k];
+        ...
+        i = i + 1;              // any positive integer step
+    }
+
+where n is an expression of variables the loop does not assign, every
+index is affine in i (a constant multiple of i plus constants and
+invariant variables), the values use only + - * on array elements, i,
+invariant variables and numbers, and an array that is written is always
+accessed with the same index, so no iteration reads what another one
+wrote.
+
+The analysis is purely syntactic; LoopPlan.run checks everything that
+depends on values (integer operands, in-range indices, arrays that are
+distinct lists of only ints or only floats, no int64 overflow) and
+returns None without touching anything if one of them fails, so the
+caller runs its scalar loop instead.  Results are written back as Python
+ints and floats, the same values the scalar loop would store.
+
+NumPy is optional: without it analyze_loop always returns None.
+"""
+from parser import NodeType
+from tac import BOOLEAN_LITERALS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Loops with fewer iterations are not worth converting the arrays.
+MIN_TRIPS = 16
+# Largest magnitude an int64 intermediate may reach.
+INT_LIMIT = 1 << 62
+VECTOR_OPERATORS = ('+', '-', '*')
+
+
+class Affine:
+    """coefficient * i + constant + sum(factor * variable)"""
+    __slots__ = ('coefficient', 'constant', 'terms')
+
+    def __init__(self, coefficient=0, constant=0, terms=()):
+        self.coefficient = coefficient
+        self.constant = constant
+        self.terms = tuple(sorted(terms))
+
+    def key(self):
+        return self.coefficient, self.constant, self.terms
+
+    def combine(self, other, sign):
+        terms = dict(self.terms)
+        for name, factor in other.terms:
+            terms[name] = terms.get(name, 0) + sign * factor
+        return Affine(self.coefficient + sign * other.coefficient, self.constant + sign * other.constant,
+                      [(name, factor) for name, factor in terms.items() if factor])
+
+    def scale(self, factor):
+        return Affine(self.coefficient * factor, self.constant * factor,
+                      [(name, term * factor) for name, term in self.terms])
+
+
+def int_literal(node):
+    if node.type == NodeType.NUMBER and '.' not in node.value:
+        return int(node.value)
+    return None
+
+
+class LoopPlan:
+    def __init__(self, induction, step, inclusive, scalars, arrays, statements):
+        self.induction = induction
+        self.step = step
+        self.inclusive = inclusive
+        # Invariant variables and arrays, in the order run() receives them.
+        self.scalars = scalars
+        self.arrays = arrays
+        # (array, Affine, value node) per assignment, in order.
+        self.statements = statements
+
+    def run(self, start, bound, scalar_values, array_values):
+        """Run the loop and return the final value of i, or None to run it in scalar"""
+        if type(start) is not int or type(bound) is not int:
+            return None
+        stop = bound + 1 if self.inclusive else bound
+        trips = max(0, -(-(stop - start) // self.step))
+        if trips < MIN_TRIPS:
+            return None
+        scalars = dict(zip(self.scalars, scalar_values))
+        for value in scalar_values:
+            if type(value) is not int and type(value) is not float:
+                return None
+        arrays = dict(zip(self.arrays, array_values))
+        if len({id(array) for array in array_values}) != len(array_values):
+            return None
+        for array in array_values:
+            if type(array) is not list:
+                return None
+
+        evaluation = Evaluation(self, start, trips, scalars, arrays)
+        with numpy.errstate(all='ignore'):
+            for name, index, value in self.statements:
+                if evaluation.access(name, index) is None:
+                    return None
+                result = evaluation.evaluate(value)
+                if result is None:
+                    return None
+                vector, _ = result
+                if not isinstance(vector, numpy.ndarray):
+                    vector = numpy.full(trips, vector)
+                evaluation.written[name] = vector
+        for name, vector in evaluation.written.items():
+            first, last, stride = evaluation.slices[name]
+            arrays[name][first:last + 1:stride] = vector.tolist()
+        return start + trips * self.step
+
+
+class Evaluation:
+    """Vectors and bounds for one run of a LoopPlan"""
+
+    def __init__(self, plan, start, trips, scalars, arrays):
+        self.plan = plan
+        self.start = start
+        self.trips = trips
+        self.scalars = scalars
+        self.arrays = arrays
+        # Array name -> its current vector, for arrays the loop writes.
+        self.written = {}
+        # Array name -> (first index, last index, stride) of its accesses.
+        self.slices = {}
+
+    def access(self, name, index):
+        """(first, last, stride) of an in-range access, or None"""
+        offset = index.constant
+        for variable, factor in index.terms:
+            value = self.scalars[variable]
+            if type(value) is not int:
+                return None
+            offset += factor * value
+        stride = index.coefficient * self.plan.step
+        first = index.coefficient * self.start + offset
+        last = first + stride * (self.trips - 1)
+        if min(first, last) < 0 or max(first, last) >= len(self.arrays[name]):
+            return None
+        self.slices[name] = (first, last, stride)
+        return first, last, stride
+
+    def load(self, name, index):
+        """(vector or scalar, bound) of the elements an access reads"""
+        if name in self.written:
+            vector = self.written[name]
+        else:
+            span = self.access(name, index)
+            if span is None:
+                return None
+            first, last, stride = span
+            if stride == 0:
+                return self.constant(self.arrays[name][first])
+            part = self.arrays[name][first:last + 1:stride] if stride > 0 else \
+                self.arrays[name][first:(last - 1 if last > 0 else None):stride]
+            kinds = set(map(type, part))
+            if kinds == {int}:
+                try:
+                    vector = numpy.array(part, dtype=numpy.int64)
+                except OverflowError:
+                    return None
+            elif kinds == {float}:
+                vector = numpy.array(part, dtype=numpy.float64)
+            else:
+                return None
+        if vector.dtype == numpy.int64:
+            return vector, max(int(vector.max()), -int(vector.min()))
+        return vector, 0
+
+    def constant(self, value):
+        if type(value) is int:
+            return value, abs(value)
+        if type(value) is float:
+            return value, 0
+        return None
+
+    def evaluate(self, node):
+        """(vector or scalar, bound on its magnitude if integer), or None"""
+        node_type = node.type
+        if node_type == NodeType.NUMBER:
+            return self.constant(float(node.value) if '.' in node.value else int(node.value))
+        if node_type == NodeType.IDENTIFIER:
+            if node.value == self.plan.induction:
+                last = self.start + self.plan.step * (self.trips - 1)
+                bound = max(abs(self.start), abs(last))
+                if bound >= INT_LIMIT:
+                    return None
+                return numpy.arange(self.start, last + 1, self.plan.step, dtype=numpy.int64), bound
+            return self.constant(self.scalars[node.value])
+        if node_type == NodeType.ARRAY_ACCESS:
+            return self.load(node.value, affine_index(node.left, self.plan.induction))
+        if node_type == NodeType.UNARY_OPERATION:
+            operand = self.evaluate(node.left)
+            return None if operand is None else (-operand[0], operand[1])
+        left = self.evaluate(node.left)
+        right = self.evaluate(node.right)
+        if left is None or right is None:
+            return None
+        if node.value == '*':
+            bound = left[1] * right[1]
+            value = left[0] * right[0]
+        else:
+            bound = left[1] + right[1]
+            value = left[0] + right[0] if node.value == '+' else left[0] - right[0]
+        if bound >= INT_LIMIT:
+            return None
+        return value, bound
+
+
+def affine_index(node, induction):
+    """Affine form of an index expression, or None"""
+    if node.type == NodeType.NUMBER:
+        value = int_literal(node)
+        return None if value is None else Affine(constant=value)
+    if node.type == NodeType.IDENTIFIER:
+        if node.value in BOOLEAN_LITERALS:
+            return None
+        if node.value == induction:
+            return Affine(coefficient=1)
+        return Affine(terms=[(node.value, 1)])
+    if node.type == NodeType.UNARY_OPERATION and node.value == '-':
+        operand = affine_index(node.left, induction)
+        return None if operand is None else operand.scale(-1)
+    if node.type != NodeType.BINARY_OPERATION or node.value not in VECTOR_OPERATORS:
+        return None
+    if node.value == '*':
+        for factor_node, other in ((node.left, node.right), (node.right, node.left)):
+            factor = int_literal(factor_node)
+            if factor is not None:
+                operand = affine_index(other, induction)
+                return None if operand is None else operand.scale(factor)
+        return None
+    left = affine_index(node.left, induction)
+    right = affine_index(node.right, induction)
+    if left is None or right is None:
+        return None
+    return left.combine(right, 1 if node.value == '+' else -1)
+
+
+def is_step(node, induction):
+    """Step of `i = i + k` for a positive integer constant k, else None"""
+    if (node.type != NodeType.ASSIGNMENT or node.left.type != NodeType.IDENTIFIER
+            or node.left.value != induction):
+        return None
+    value = node.right
+    if value.type != NodeType.BINARY_OPERATION or value.value != '+':
+        return None
+    for variable, step in ((value.left, value.right), (value.right, value.left)):
+        if variable.type == NodeType.IDENTIFIER and variable.value == induction:
+            constant = int_literal(step)
+            if constant is not None and constant > 0:
+                return constant
+    return None
+
+
+class LoopAnalysis:
+    def __init__(self, induction):
+        self.induction = induction
+        self.scalars = set()
+        self.arrays = set()
+        # Array name -> index keys of all its accesses.
+        self.accesses = {}
+
+    def note_index(self, name, index):
+        self.arrays.add(name)
+        self.accesses.setdefault(name, set()).add(index.key())
+        self.scalars.update(variable for variable, _ in index.terms)
+
+    def vector_value(self, node):
+        """True if `node` can be evaluated elementwise"""
+        node_type = node.type
+        if node_type == NodeType.NUMBER:
+            return True
+        if node_type == NodeType.IDENTIFIER:
+            if node.value in BOOLEAN_LITERALS:
+                return False
+            if node.value != self.induction:
+                self.scalars.add(node.value)
+            return True
+        if node_type == NodeType.ARRAY_ACCESS:
+            index = affine_index(node.left, self.induction)
+            if index is None:
+                return False
+            self.note_index(node.value, index)
+            return True
+        if node_type == NodeType.UNARY_OPERATION:
+            return node.value == '-' and self.vector_value(node.left)
+        if node_type == NodeType.BINARY_OPERATION and node.value in VECTOR_OPERATORS:
+            return self.vector_value(node.left) and self.vector_value(node.right)
+        return False
+
+
+def analyze_loop(node):
+    """LoopPlan for a WHILE_STATEMENT node, or None if it does not qualify"""
+    if numpy is None:
+        return None
+    condition = node.left
+    if (condition.type != NodeType.COMPARISON_OPERATION or condition.value not in ('<', '<=')
+            or condition.left.type != NodeType.IDENTIFIER or condition.left.value in BOOLEAN_LITERALS):
+        return None
+    induction = condition.left.value
+    body = node.right
+    if body is None or body.type != NodeType.PROGRAM or len(body.children) < 2:
+        return None
+    step = is_step(body.children[-1], induction)
+    if step is None:
+        return None
+
+    analysis = LoopAnalysis(induction)
+    statements = []
+    for statement in body.children[:-1]:
+        if statement.type != NodeType.ASSIGNMENT or statement.left.type != NodeType.ARRAY_ACCESS:
+            return None
+        index = affine_index(statement.left.left, induction)
+        if index is None or index.coefficient < 0 or not analysis.vector_value(statement.right):
+            return None
+        analysis.note_index(statement.left.value, index)
+        statements.append((statement.left.value, index, statement.right))
+
+    written = {name for name, _, _ in statements}
+    for name in written:
+        keys = analysis.accesses[name]
+        # Every iteration must touch its own element of a written array.
+        if len(keys) != 1 or next(iter(keys))[0] == 0:
+            return None
+    if analysis.scalars & analysis.arrays or induction in analysis.arrays:
+        return None
+    if not invariant(condition.right, induction, written):
+        return None
+    return LoopPlan(induction, step, condition.value == '<=', sorted(analysis.scalars),
+                    sorted(analysis.arrays), statements)
+
+
+def invariant(node, induction, written):
+    """True if the loop bound `node` has no calls and reads nothing the loop changes"""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            continue
+        if node.type == NodeType.FUNCTION_CALL:
+            return False
+        if node.type == NodeType.IDENTIFIER and node.value == induction:
+            return False
+        if node.type == NodeType.ARRAY_ACCESS and node.value in written:
+            return False
+        stack.append(node.left)
+        stack.append(node.right)
+        stack.extend(node.children)
+    return True
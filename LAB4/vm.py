@@ -0,0 +1,367 @@
+"""Virtual machine for three-address code.
+
+Usage: python3 vm.py FILE.sk [FUNCTION [ARGS...]]
+
+The VirtualMachine links a QuadBuffer into one Function per function
+body (plus one for top-level statements).  Every temp, variable and
+constant of a function gets a slot in its frame, a plain list; constants
+are stored in the frame template, so an operand is always a list index.
+Labels are resolved to instruction offsets, callees to their Function,
+and each instruction becomes an (opcode, a, b, c) tuple whose opcode
+already selects the operator.
+
+Calls push the caller's frame on an explicit stack instead of recursing
+in Python.  Variables are local to their function; arrays are lists and
+are passed to callees by reference.
+"""
+import sys
+import time
+
+from parser import compile_source
+from tac import CONST, GENERIC_OPERATORS, NO_OPERAND, OPERATORS, Op, operand_kind
+
+# VM opcodes, roughly in order of how often loops execute them; execute()
+# tests them in this order.
+(COPY, ADD, LOAD, IF_LT, IF_GE, IF_LE, IF_GT, IF_EQ, IF_NE, GOTO, STORE, SUB, MUL, IDIV, FDIV, DIV,
+ LT, GT, LE, GE, EQ, NE, AND, OR, NEG, NOT, ITOF, FTOI, CALL, RETURN, BUILTIN, ARRAY, TABLE,
+ UNDEFINED) = range(34)
+
+BINARY_OPCODES = {'+': ADD, '-': SUB, '*': MUL, '/': DIV, '<': LT, '>': GT, '<=': LE, '>=': GE,
+                  '==': EQ, '!=': NE, '&&': AND, '||': OR}
+UNARY_OPCODES = {'-': NEG, '!': NOT, 'itof': ITOF, 'ftoi': FTOI}
+BRANCH_OPCODES = {'<': IF_LT, '>': IF_GT, '<=': IF_LE, '>=': IF_GE, '==': IF_EQ, '!=': IF_NE}
+# Python's operators already do what the typed ones do, except division,
+# which the generic opcode has to pick by the operands' types.
+for typed, generic in GENERIC_OPERATORS.items():
+    if typed.endswith('neg'):
+        UNARY_OPCODES[typed] = NEG
+        continue
+    BINARY_OPCODES[typed] = BINARY_OPCODES[generic]
+    if generic in BRANCH_OPCODES:
+        BRANCH_OPCODES[typed] = BRANCH_OPCODES[generic]
+BINARY_OPCODES.update(idiv=IDIV, fdiv=FDIV)
+
+
+def builtin_print(*values):
+    print(*values)
+
+
+BUILTINS = {'print': builtin_print}
+
+
+def constant_value(text):
+    if text in ('true', 'false'):
+        return text == 'true'
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def int_divide(left, right):
+    if right == 0:
+        raise ValueError('Division by zero')
+    # Integer division truncates toward zero.
+    quotient = abs(left) // abs(right)
+    return quotient if (left < 0) == (right < 0) else -quotient
+
+
+def float_divide(left, right):
+    if right == 0:
+        raise ValueError('Division by zero')
+    return left / right
+
+
+def divide(left, right):
+    if isinstance(left, int) and isinstance(right, int):
+        return int_divide(left, right)
+    return float_divide(left, right)
+
+
+class Function:
+    """One linked function: its instruction tuples and frame template"""
+    __slots__ = ('name', 'params', 'code', 'slots', 'body', 'names')
+
+    def __init__(self, name, params, body):
+        self.name = name
+        self.body = body
+        self.code = []
+        self.slots = []
+        # Operand -> slot index.
+        self.names = {}
+        self.params = tuple(self.slot(param) for param in params)
+
+    def slot(self, operand):
+        index = self.names.get(operand)
+        if index is None:
+            index = self.names[operand] = len(self.slots)
+            self.slots.append(0)
+        return index
+
+    def __repr__(self):
+        return f'Function({self.name!r}, {len(self.code)} instructions, {len(self.slots)} slots)'
+
+
+class VirtualMachine:
+    def __init__(self, code, builtins=None, max_depth=10000):
+        """Link the QuadBuffer `code`; raises ValueError for malformed code"""
+        self.strings = code.strings
+        self.builtins = BUILTINS if builtins is None else builtins
+        self.max_depth = max_depth
+        self.functions = {}
+        self.top_level = None
+        # Instructions executed by the most recent run or call.
+        self.executed = 0
+        self.split_functions(code)
+        for function in self.functions.values():
+            self.link(function)
+        if self.top_level is not None:
+            self.link(self.top_level)
+
+    def text(self, operand):
+        return self.strings.strings[operand >> 2]
+
+    def split_functions(self, code):
+        top_level = []
+        body = None
+        for instruction in code.instructions():
+            if instruction.op == Op.FUNCTION:
+                name = self.text(instruction.arg1)
+                if name in self.functions:
+                    raise ValueError(f'Function {name} is defined twice')
+                body = []
+                self.functions[name] = Function(name, instruction.args, body)
+            elif instruction.op == Op.END_FUNCTION:
+                body = None
+            elif body is not None:
+                body.append(instruction)
+            else:
+                top_level.append(instruction)
+        if top_level:
+            self.top_level = Function(None, (), top_level)
+
+    def link(self, function):
+        """Translate the body of `function` into VM instructions"""
+        offsets = {}
+        position = 0
+        for instruction in function.body:
+            if instruction.op == Op.LABEL:
+                offsets[instruction.target] = position
+            else:
+                position += 1
+
+        def slot(operand):
+            index = function.slot(operand)
+            if operand_kind(operand) == CONST:
+                function.slots[index] = constant_value(self.text(operand))
+            return index
+
+        def offset(label):
+            if label not in offsets:
+                raise ValueError(f'Jump to undefined label L{label} in {function.name or "top level"}')
+            return offsets[label]
+
+        code = function.code
+        for instruction in function.body:
+            op = instruction.op
+            if op == Op.LABEL:
+                continue
+            if op == Op.COPY:
+                code.append((COPY, slot(instruction.result), slot(instruction.arg1), 0))
+            elif op == Op.BINARY:
+                opcode = BINARY_OPCODES[OPERATORS[instruction.operator]]
+                code.append((opcode, slot(instruction.result), slot(instruction.arg1), slot(instruction.arg2)))
+            elif op == Op.UNARY:
+                opcode = UNARY_OPCODES[OPERATORS[instruction.operator]]
+                code.append((opcode, slot(instruction.result), slot(instruction.arg1), 0))
+            elif op == Op.LOAD:
+                code.append((LOAD, slot(instruction.result), slot(instruction.arg1), slot(instruction.arg2)))
+            elif op == Op.STORE:
+                code.append((STORE, slot(instruction.result), slot(instruction.arg1), slot(instruction.arg2)))
+            elif op == Op.IF_GOTO:
+                opcode = BRANCH_OPCODES[OPERATORS[instruction.operator]]
+                code.append((opcode, slot(instruction.arg1), slot(instruction.arg2), offset(instruction.target)))
+            elif op == Op.GOTO:
+                code.append((GOTO, offset(instruction.target), 0, 0))
+            elif op == Op.JUMP_TABLE:
+                targets = tuple(offset(label) for label in instruction.args)
+                code.append((TABLE, slot(instruction.arg1), targets, offset(instruction.target)))
+            elif op == Op.CALL:
+                code.append(self.link_call(instruction, slot))
+            elif op == Op.RETURN:
+                value = slot(instruction.arg1) if instruction.arg1 != NO_OPERAND else -1
+                code.append((RETURN, value, 0, 0))
+            elif op == Op.ARRAY:
+                code.append((ARRAY, slot(instruction.result), slot(instruction.arg1), slot(instruction.arg2)))
+            else:
+                raise ValueError(f'Cannot execute {op.name} inside {function.name or "top level"}')
+        # Falling off the end returns nothing.
+        code.append((RETURN, -1, 0, 0))
+
+    def link_call(self, instruction, slot):
+        name = self.text(instruction.arg1)
+        result = slot(instruction.result)
+        args = tuple(slot(arg) for arg in instruction.args)
+        callee = self.functions.get(name)
+        if callee is not None:
+            if len(args) != len(callee.params):
+                raise ValueError(f'{name} takes {len(callee.params)} arguments, called with {len(args)}')
+            return (CALL, result, callee, args)
+        if name in self.builtins:
+            return (BUILTIN, result, self.builtins[name], args)
+        return (UNDEFINED, result, name, args)
+
+    def call(self, name, *args):
+        """Call function `name` with Python values and return its result"""
+        function = self.functions.get(name)
+        if function is None:
+            raise ValueError(f'No function named {name}')
+        if len(args) != len(function.params):
+            raise ValueError(f'{name} takes {len(function.params)} arguments, called with {len(args)}')
+        return self.execute(function, args)
+
+    def run(self):
+        """Execute the top-level statements"""
+        if self.top_level is None:
+            return None
+        return self.execute(self.top_level, ())
+
+    def execute(self, function, args):
+        frame = function.slots[:]
+        for param, value in zip(function.params, args):
+            frame[param] = value
+        code = function.code
+        pc = 0
+        stack = []
+        max_depth = self.max_depth
+        executed = 0
+        try:
+            while True:
+                op, a, b, c = code[pc]
+                pc += 1
+                executed += 1
+                if op == COPY:
+                    frame[a] = frame[b]
+                elif op == ADD:
+                    frame[a] = frame[b] + frame[c]
+                elif op == LOAD:
+                    index = frame[c]
+                    if index < 0:
+                        raise IndexError
+                    frame[a] = frame[b][index]
+                elif op == IF_LT:
+                    if frame[a] < frame[b]:
+                        pc = c
+                elif op == IF_GE:
+                    if frame[a] >= frame[b]:
+                        pc = c
+                elif op == IF_LE:
+                    if frame[a] <= frame[b]:
+                        pc = c
+                elif op == IF_GT:
+                    if frame[a] > frame[b]:
+                        pc = c
+                elif op == IF_EQ:
+                    if frame[a] == frame[b]:
+                        pc = c
+                elif op == IF_NE:
+                    if frame[a] != frame[b]:
+                        pc = c
+                elif op == GOTO:
+                    pc = a
+                elif op == STORE:
+                    index = frame[b]
+                    if index < 0:
+                        raise IndexError
+                    frame[a][index] = frame[c]
+                elif op == SUB:
+                    frame[a] = frame[b] - frame[c]
+                elif op == MUL:
+                    frame[a] = frame[b] * frame[c]
+                elif op == IDIV:
+                    left = frame[b]
+                    right = frame[c]
+                    if right == 0:
+                        raise ValueError('Division by zero')
+                    quotient = abs(left) // abs(right)
+                    frame[a] = quotient if (left < 0) == (right < 0) else -quotient
+                elif op == FDIV:
+                    right = frame[c]
+                    if right == 0:
+                        raise ValueError('Division by zero')
+                    frame[a] = frame[b] / right
+                elif op == DIV:
+                    frame[a] = divide(frame[b], frame[c])
+                elif op == LT:
+                    frame[a] = frame[b] < frame[c]
+                elif op == GT:
+                    frame[a] = frame[b] > frame[c]
+                elif op == LE:
+                    frame[a] = frame[b] <= frame[c]
+                elif op == GE:
+                    frame[a] = frame[b] >= frame[c]
+                elif op == EQ:
+                    frame[a] = frame[b] == frame[c]
+                elif op == NE:
+                    frame[a] = frame[b] != frame[c]
+                elif op == AND:
+                    frame[a] = frame[b] and frame[c]
+                elif op == OR:
+                    frame[a] = frame[b] or frame[c]
+                elif op == NEG:
+                    frame[a] = -frame[b]
+                elif op == NOT:
+                    frame[a] = not frame[b]
+                elif op == ITOF:
+                    frame[a] = float(frame[b])
+                elif op == FTOI:
+                    frame[a] = int(frame[b])
+                elif op == CALL:
+                    if len(stack) >= max_depth:
+                        raise ValueError(f'Call stack overflow calling {b.name}')
+                    callee_frame = b.slots[:]
+                    for param, arg in zip(b.params, c):
+                        callee_frame[param] = frame[arg]
+                    stack.append((code, pc, frame, a))
+                    code, pc, frame = b.code, 0, callee_frame
+                elif op == RETURN:
+                    value = frame[a] if a >= 0 else None
+                    if not stack:
+                        return value
+                    code, pc, frame, result = stack.pop()
+                    frame[result] = value
+                elif op == BUILTIN:
+                    frame[a] = b(*[frame[arg] for arg in c])
+                elif op == ARRAY:
+                    frame[a] = [frame[c]] * frame[b]
+                elif op == TABLE:
+                    index = frame[a]
+                    pc = b[index] if 0 <= index < len(b) else c
+                else:
+                    raise ValueError(f'Call to undefined function {b}')
+        except IndexError:
+            raise ValueError('Array index out of range') from None
+        except (TypeError, OverflowError) as error:
+            raise ValueError(f'Bad operand: {error}') from None
+        finally:
+            self.executed = executed
+
+
+def main(argv):
+    with open(argv[0]) as source_file:
+        machine = VirtualMachine(compile_source(source_file.read()))
+    start = time.perf_counter()
+    if len(argv) > 1:
+        result = machine.call(argv[1], *(constant_value(arg) for arg in argv[2:]))
+    elif 'main' in machine.functions and not machine.functions['main'].params:
+        result = machine.call('main')
+    else:
+        result = machine.run()
+    elapsed = time.perf_counter() - start
+    if result is not None:
+        print(result)
+    print(f'{machine.executed} instructions in {elapsed:.3f} s', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,99 @@
+"""Instructions per second of the VM on sort.sk-style loops.
+
+Usage: python3 vm_bench.py [size]
+
+The program fills an array of `size` elements from a small generator
+function, bubble-sorts it, and binary-searches for every element, as
+LAB1's sort.sk and search.sk do.  It is run from unoptimized code, from
+the peephole optimizer's output and from value numbering followed by
+the peephole optimizer, and once more after inlining next().
+"""
+import sys
+import time
+
+from inliner import Inliner
+from optimizer import optimize
+from parser import compile_source
+from ssa import eliminate_redundancy
+from vm import VirtualMachine
+
+SORT_SOURCE = """
+function next(int seed) {
+    int x = seed * 75 + 74;
+    return x - (x / 65537) * 65537;
+}
+
+function main() {
+    int size = %(size)d;
+    int[%(size)d] arr;
+    int seed = 42;
+    int i = 0;
+    while (i < size) {
+        seed = next(seed);
+        arr[i] = seed;
+        i = i + 1;
+    }
+
+    i = 0;
+    while (i < size - 1) {
+        int j = 0;
+        while (j < size - i - 1) {
+            if (arr[j] > arr[j + 1]) {
+                int temp = arr[j];
+                arr[j] = arr[j + 1];
+                arr[j + 1] = temp;
+            }
+            j = j + 1;
+        }
+        i = i + 1;
+    }
+
+    int missing = 0;
+    i = 0;
+    while (i < size) {
+        int key = arr[i];
+        int low = 0;
+        int high = size - 1;
+        bool found = false;
+        while (low <= high && !found) {
+            int mid = (low + high) / 2;
+            if (arr[mid] == key) {
+                found = true;
+            } else {
+                if (arr[mid] < key) {
+                    low = mid + 1;
+                } else {
+                    high = mid - 1;
+                }
+            }
+        }
+        if (!found) {
+            missing = missing + 1;
+        }
+        i = i + 1;
+    }
+    return missing;
+}
+"""
+
+
+def main(size):
+    code = compile_source(SORT_SOURCE % {'size': size})
+    variants = (('unoptimized', code), ('peephole', optimize(code)),
+                ('value numbering + peephole', optimize(eliminate_redundancy(code))),
+                ('inlined + vn + peephole', optimize(eliminate_redundancy(Inliner().run(code)))))
+    print(f'bubble sort and binary search over {size} elements\n')
+    print(f'{"code":<28}{"static":>8}{"executed":>12}{"seconds":>10}{"M instr/s":>11}')
+    for label, variant in variants:
+        machine = VirtualMachine(variant)
+        start = time.perf_counter()
+        missing = machine.call('main')
+        elapsed = time.perf_counter() - start
+        if missing != 0:
+            raise ValueError(f'{label}: binary search missed {missing} elements')
+        print(f'{label:<28}{len(variant):>8}{machine.executed:>12}{elapsed:>10.3f}'
+              f'{machine.executed / elapsed / 1e6:>11.2f}')
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)